@@ -1,20 +1,220 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, Flask, Response, abort, current_app, g, has_request_context, jsonify, make_response, render_template, request, redirect, stream_with_context, url_for, session, flash
+from flask.cli import with_appcontext
+from pymongo.errors import PyMongoError
 from functools import wraps
+from werkzeug.http import is_resource_modified
 from datetime import datetime
 from bson.objectid import ObjectId
 import os
+import time
+
+import click
+
+import archive
+import audit
+import config as app_config
+from dashboard import BUCKETS, fetch_dashboard, page_cursors
+import search
+import export
+from fanout import JOBS_COLL, MAX_CSV_BYTES, InvalidRecipients, create_job, load_job, parse_recipients, run_job
+from fragments import FragmentCache, FragmentCacheExtension, bytecode_cache
+from httpcache import agreement_validators, fingerprint_static
+from migrations import MissingIndexError, run_migrations, verify_indexes
+import pagination
+from livefeed import EVENT_PROJECTION, StatusFeed, format_sse
+from metrics import Metrics, instrument
+from passwords import HashingBusy, benchmark as hash_benchmark, hasher_from_config
+from repository import CausalContext, Repository, encode_token
+from responses import DECISIONS, InvalidBatch, respond_many
+from revisions import REVISIONS_COLL, RevisionConflict, history, revise
+from sessions import SESSIONS_COLL, make_session_interface
+from signatures import InvalidSignature, is_signature_hash, iter_blob, make_store, store_signature
+import strokes
+import suggest
+from usercache import UserCache
+import userstats
+
+bp = Blueprint("main", __name__)
+
+
+# --- Application factory ---
+def create_app(config=None):
+    """
+    Build the Flask app.
+
+    Settings come from the environment (see config.py) and are overridden
+    by config. Nothing here touches the network: the Mongo client is created
+    lazily by the Repository on first use.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(app_config.from_env())
+    app.config.update(config or {})
+    app.secret_key = app.config["SECRET_KEY"]
+    app.config["PAGE_SIZE"] = pagination.clamp_page_size(app.config["PAGE_SIZE"])
+    # compiled templates persist on disk; {% cache %} reuses rendered rows
+    app.jinja_options = dict(
+        app.jinja_options,
+        bytecode_cache=bytecode_cache(app.config["TEMPLATE_CACHE_DIR"]),
+        extensions=[FragmentCacheExtension],
+    )
+
+    # request/Mongo timings for /metrics and the slow-request log
+    app_metrics = Metrics.from_config(app.config)
+    app.extensions["metrics"] = app_metrics
+    instrument(app, app_metrics)
+
+    repository = app.config.get("REPOSITORY") or Repository.from_config(
+        app.config, session_source=causal_context, event_listeners=[app_metrics.command_listener]
+    )
+    if app.config["MONGO_READ_PREFERENCE"] != "primary":
+        # reads may hit a secondary: carry each user's last write between requests
+        app.before_request(load_causal_token)
+        app.after_request(save_causal_token)
+        app.teardown_request(end_causal_session)
+    app.extensions["repository"] = repository
+    app.extensions["signature_store"] = make_store(
+        app.config["SIGNATURE_STORE"], app.config["SIGNATURE_DIR"], lambda: repository.db
+    )
+    # the cookie holds only a session id; the wizard draft stays server-side
+    app.session_interface = make_session_interface(
+        app.config["SESSION_BACKEND"], app.config["SESSION_LIFETIME_SECONDS"],
+        app.config["SESSION_MEMORY_SIZE"], lambda: repository.collection(SESSIONS_COLL, "fast")
+    )
+    app.extensions["fragment_cache"] = app.jinja_env.fragment_cache = FragmentCache(
+        app.config["FRAGMENT_CACHE_SIZE"]
+    )
+    # usernames for /users/suggest, loaded by warm_up() when a worker starts
+    app.extensions["username_index"] = suggest.UsernameIndex(
+        lambda: repository.users, app.config["SUGGEST_REFRESH_SECONDS"]
+    )
+    # audit events are written in batches by a background thread per process
+    app.extensions["audit_log"] = audit.AuditLog.from_config(
+        app.config, lambda: repository.collection(audit.AUDIT_COLL, "fast")
+    )
+    app_metrics.collect(lambda registry: app.extensions["audit_log"].export_metrics(registry))
+    # one watcher/fan-out per process for /agreements/events
+    app.extensions["status_feed"] = StatusFeed(
+        app.config["LIVE_UPDATES"], lambda: repository.agreements, app.config["LIVE_QUEUE_SIZE"],
+        max_subscribers=app.config["SSE_MAX_STREAMS"]
+    )
+    app.extensions["signature_renders"] = strokes.RenderCache(app.config["SIGNATURE_RENDER_CACHE_BYTES"])
+    # KDF work runs in a bounded process pool when HASH_WORKERS > 0
+    app.extensions["password_hasher"] = hasher_from_config(app.config)
+    # USER_CACHE_TTL=0 (default) keeps only the per-request memo
+    app.extensions["user_cache"] = UserCache(
+        maxsize=app.config["USER_CACHE_SIZE"],
+        ttl=app.config["USER_CACHE_TTL"]
+    )
+    # service counters are exported on /metrics, not on an unauthenticated endpoint of their own
+    app_metrics.collect(lambda registry: app.extensions["user_cache"].export_metrics(registry))
+
+    # ?v=<content hash> on static URLs; validators for agreement pages
+    fingerprint_static(app)
+
+    app.register_blueprint(bp)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(hash_bench_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(archive_command)
+    return app
+
+
+def warm_up(flask_app):
+    """Load per-worker in-memory indexes before the first request needs them."""
+    try:
+        flask_app.extensions["username_index"].refresh(force=True)
+    except PyMongoError as e:
+        # the first /users/suggest request loads it instead
+        flask_app.logger.warning("username index not loaded at start: %s", e)
+
+
+# --- Service accessors ---
+def repo():
+    return current_app.extensions["repository"]
+
+def signature_store():
+    return current_app.extensions["signature_store"]
+
+def fragment_cache():
+    return current_app.extensions["fragment_cache"]
+
+def status_feed():
+    return current_app.extensions["status_feed"]
 
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "some-secret-key")
+def signature_renders():
+    return current_app.extensions["signature_renders"]
 
-# --- Database setup ---
-mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-client = MongoClient(mongo_uri)
-db = client["consent_data"]
-users_coll = db["users"]
-agreements_coll = db["agreements"]
+def password_hasher():
+    return current_app.extensions["password_hasher"]
+
+def stats_coll():
+    return repo().collection(userstats.STATS_COLL)
+
+def archive_coll():
+    return repo().collection(archive.ARCHIVE_COLL)
+
+def find_agreement(agreement_id):
+    """The agreement, from the hot collection or else the archive."""
+    query = {"_id": ObjectId(agreement_id)}
+    return repo().agreements.find_one(query) or archive_coll().find_one(query)
+
+def find_hot_agreement(agreement_id, may_restore):
+    """The agreement for a write; an archived one is restored first if may_restore(agr)."""
+    agr = repo().agreements.find_one({"_id": ObjectId(agreement_id)})
+    if agr is None:
+        agr = archive_coll().find_one({"_id": ObjectId(agreement_id)})
+        if agr is not None and may_restore(agr):
+            archive.restore(repo().agreements, archive_coll(), agr["_id"])
+    return agr
+
+def username_index():
+    return current_app.extensions["username_index"]
+
+def user_cache():
+    return current_app.extensions["user_cache"]
+
+def metrics():
+    return current_app.extensions["metrics"]
+
+def audit_log():
+    return current_app.extensions["audit_log"]
+
+def record_event(action, actor=None, target=None, users=(), **details):
+    """Queue an audit event for this request; never waits on MongoDB."""
+    audit_log().record(action, actor, target, users, ip=request.remote_addr, **details)
+
+# --- Causal reads ---
+CAUSAL_TOKEN = "mongo_causal"
+
+def load_causal_token():
+    g.causal_token = session.get(CAUSAL_TOKEN)
+
+def causal_context():
+    """This request's causally consistent session, started on first use."""
+    if not has_request_context() or "causal_token" not in g:
+        return None
+    if "causal" not in g:
+        g.causal = CausalContext(repo().causal_session(g.causal_token))
+    return g.causal
+
+def save_causal_token(response):
+    # the next request's reads start after this request's writes
+    context = g.get("causal")
+    if context is not None and context.wrote:
+        token = encode_token(context.session)
+        if token and token != g.causal_token:
+            session[CAUSAL_TOKEN] = token
+    return response
+
+def end_causal_session(exc=None):
+    context = g.pop("causal", None)
+    if context is not None:
+        context.session.end_session()
+
+# --- Error handlers ---
+@bp.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    return "Server is busy, please try again in a moment.", 503, {"Retry-After": "1"}
 
 # --- Auth helpers ---
 def login_required(f):
@@ -22,106 +222,178 @@ def login_required(f):
     def decorated(*args, **kwargs):
         if "user_id" not in session:
             flash("Please sign in to access that page.", "warning")
-            return redirect(url_for("login", next=request.path))
+            return redirect(url_for("main.login", next=request.path))
         return f(*args, **kwargs)
     return decorated
 
 def current_user():
     if "user_id" not in session:
         return None
-    return users_coll.find_one({"_id": ObjectId(session["user_id"])})
+    user_id = session["user_id"]
+    # memoized for the rest of this request
+    if g.get("current_user_id") == user_id:
+        user_cache().record_request_hit()
+        return g.current_user
+    user = user_cache().get(user_id)
+    if user is None:
+        user = repo().users.find_one({"_id": ObjectId(user_id)})
+        if user is not None:
+            user_cache().set(user_id, user)
+    g.current_user_id = user_id
+    g.current_user = user
+    return user
 
 # --- Authentication routes ---
-@app.route("/auth/register", methods=["GET", "POST"])
+@bp.route("/auth/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         username = request.form["username"].strip()
         email = request.form["email"].strip().lower()
         password = request.form["password"]
-        if users_coll.find_one({"$or": [{"username": username}, {"email": email}]}):
+        if repo().users.find_one({"$or": [{"username": username}, {"email": email}]}):
             flash("Username or email already taken.", "danger")
-            return redirect(url_for("register"))
-        pwd_hash = generate_password_hash(password)
-        result = users_coll.insert_one({
+            return redirect(url_for("main.register"))
+        pwd_hash = password_hasher().hash(password)
+        result = repo().users.insert_one({
             "username": username,
             "email": email,
             "password_hash": pwd_hash,
             "created_at": datetime.utcnow()
         })
+        username_index().add(username)
+        record_event("user.registered", result.inserted_id)
         session["user_id"] = str(result.inserted_id)
         flash("Registration successful. You are now logged in.", "success")
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
     return render_template("register.html")
 
-@app.route("/auth/login", methods=["GET", "POST"])
+@bp.route("/auth/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username_or_email = request.form["username_or_email"].strip()
         password = request.form["password"]
-        user = users_coll.find_one({
+        user = repo().users.find_one({
             "$or": [
                 {"username": username_or_email},
                 {"email": username_or_email.lower()}
             ]
         })
-        if user and check_password_hash(user["password_hash"], password):
+        if user and password_hasher().verify(user["password_hash"], password):
+            # upgrade hashes made with an older method/cost while we have the password
+            if password_hasher().needs_rehash(user["password_hash"]):
+                repo().users.update_one(
+                    {"_id": user["_id"]},
+                    {"$set": {"password_hash": password_hasher().hash(password)}}
+                )
+                user_cache().invalidate(user["_id"])
+            record_event("user.login", user["_id"])
             session["user_id"] = str(user["_id"])
             flash("Logged in successfully.", "success")
-            next_page = request.args.get("next") or url_for("home")
+            next_page = request.args.get("next") or url_for("main.home")
             return redirect(next_page)
+        # the typed name is not stored: it is often a password entered in the wrong field
+        record_event("user.login_failed", user["_id"] if user else None, known_user=user is not None)
         flash("Invalid credentials.", "danger")
     return render_template("login.html")
 
-@app.route("/auth/logout")
+@bp.route("/auth/logout")
 def logout():
+    if ObjectId.is_valid(session.get("user_id")):
+        record_event("user.logout", ObjectId(session["user_id"]))
     session.clear()
     flash("You have been logged out.", "info")
-    return redirect(url_for("login"))
+    return redirect(url_for("main.login"))
 
 # --- Agreement routes ---
-@app.route("/")
+@bp.route("/")
 @login_required
 def home():
     me = current_user()
 
-    # Agreements sent by me (as party1)
-    sent = list(agreements_coll.find({
-        "party1.user_id": me["_id"]
-    }).sort("created_at", -1))
-
-    # Agreements received by me (as party2)
-    received = list(agreements_coll.find({
-        "party2.user_id": me["_id"]
-    }).sort("created_at", -1))
-
-    # Split each list by response_status
-    sent_pending  = [a for a in sent     if a.get("response_status", "pending") != "agreed"]
-    sent_agreed   = [a for a in sent     if a.get("response_status", "pending") == "agreed"]
-    recv_pending  = [a for a in received if a.get("response_status", "pending") != "agreed"]
-    recv_agreed   = [a for a in received if a.get("response_status", "pending") == "agreed"]
+    # All four buckets in one projected, keyset-paged round trip
+    cursors = page_cursors(request.args)
+    buckets, next_cursors = fetch_dashboard(
+        repo().reads("agreements"), me["_id"], cursors, current_app.config["PAGE_SIZE"]
+    )
 
+    # each bucket pages on its own; the other buckets keep their position
+    current = {b: request.args[b] for b in BUCKETS if cursors[b]}
+    pages = {}
+    for bucket in BUCKETS:
+        others = {b: t for b, t in current.items() if b != bucket}
+        pages[bucket] = {
+            "next": (url_for("main.home", **others, **{bucket: next_cursors[bucket]})
+                     if next_cursors[bucket] else None),
+            "first": url_for("main.home", **others) if cursors[bucket] else None,
+        }
 
     return render_template(
       "home.html",
-      sent_pending=sent_pending,
-      sent_agreed=sent_agreed,
-      recv_pending=recv_pending,
-      recv_agreed=recv_agreed
+      pages=pages,
+      # one _id lookup instead of counting every agreement
+      counts=userstats.get(repo().reads(userstats.STATS_COLL), me["_id"]),
+      **buckets
     )
 
 
 
-@app.route("/agreements/new/step1", methods=["GET", "POST"])
+@bp.route("/agreements/archived")
+@login_required
+def archived_agreements():
+    """Agreements moved off the dashboard by `flask archive`, newest first."""
+    me = current_user()
+    rows, next_cursor = archive.list_archived(
+        repo().reads(archive.ARCHIVE_COLL), me["_id"], request.args.get("cursor"),
+        current_app.config["PAGE_SIZE"]
+    )
+    next_url = url_for("main.archived_agreements", cursor=next_cursor) if next_cursor else None
+    return render_template("archived.html", agreements=rows, me_id=me["_id"], next_url=next_url)
+
+@bp.route("/users/suggest")
+@login_required
+def suggest_users():
+    """Recipient type-ahead; answered from memory, never per keystroke from Mongo."""
+    prefix = request.args.get("q", "").strip()
+    limit = max(1, min(request.args.get("limit", suggest.DEFAULT_LIMIT, type=int), suggest.MAX_LIMIT))
+    users = username_index().suggest(prefix, limit) if len(prefix) >= suggest.MIN_PREFIX else []
+    resp = jsonify(q=prefix, users=users)
+    resp.headers["Cache-Control"] = "private, max-age=60"
+    return resp
+
+@bp.route("/agreements/new/step1", methods=["GET", "POST"])
 @login_required
 def step1():
     if request.method == "POST":
         title = request.form["title"]
-        party2_username = request.form["party2_username"].strip()
+        party2_username = request.form.get("party2_username", "").strip()
+
+        # fan-out mode: a recipient list and/or CSV instead of one username
+        recipients_text = request.form.get("recipients", "")
+        upload = request.files.get("recipients_csv")
+        csv_bytes = upload.read(MAX_CSV_BYTES + 1) if upload else b""
+        if recipients_text.strip() or csv_bytes:
+            try:
+                usernames = parse_recipients(recipients_text, csv_bytes)
+            except InvalidRecipients as e:
+                flash(str(e), "danger")
+                return redirect(url_for("main.step1"))
+            job_id = create_job(repo().collection(JOBS_COLL), repo().users,
+                                ObjectId(session["user_id"]), usernames)
+            session["agreement_data"] = {
+                "title": title,
+                "party1": {
+                    "user_id": session["user_id"],
+                    "name": current_user()["username"]
+                },
+                "party2": {"name": ""},
+                "fanout_job": str(job_id)
+            }
+            return redirect(url_for("main.step2"))
 
-        target = users_coll.find_one({"username": party2_username})
+        target = repo().users.find_one({"username": party2_username})
         if not target:
             flash(f"No user found with username '{party2_username}'", "danger")
-            return redirect(url_for("step1"))
+            return redirect(url_for("main.step1"))
 
         # session holds only strings
         session["agreement_data"] = {
@@ -135,14 +407,14 @@ def step1():
                 "name": target["username"]                 # for display
             }
         }
-        return redirect(url_for("step2"))
+        return redirect(url_for("main.step2"))
     data = session.get("agreement_data", {})
     data.setdefault("title", "")
     data.setdefault("party2", {"name": ""})
-    return render_template("step1.html", data=data)
+    return render_template("step1.html", data=data, min_prefix=suggest.MIN_PREFIX)
 
 
-@app.route("/agreements/new/step2", methods=["GET", "POST"])
+@bp.route("/agreements/new/step2", methods=["GET", "POST"])
 @login_required
 def step2():
     if request.method == "POST":
@@ -155,7 +427,7 @@ def step2():
             "record_allowed": request.form.get("record_allowed")
         }
         session["agreement_data"] = data
-        return redirect(url_for("signature_page"))
+        return redirect(url_for("main.signature_page"))
     data = session.get("agreement_data", {})
     data.setdefault("content", {
         "sexual_content": "",
@@ -165,14 +437,28 @@ def step2():
     })
     return render_template("step2.html", data=data)
 
-@app.route("/agreements/new/signature", methods=["GET", "POST"])
+@bp.route("/agreements/new/signature", methods=["GET", "POST"])
 @login_required
 def signature_page():
     if request.method == "POST":
+        try:
+            if request.form.get("signature_strokes"):
+                signature_ref = strokes.store_strokes(signature_store(), request.form["signature_strokes"])
+            else:
+                # PNG data URL from clients without stroke capture
+                signature_ref = store_signature(signature_store(), request.form["signature_data"])
+        except InvalidSignature as e:
+            flash(str(e), "danger")
+            return redirect(url_for("main.signature_page"))
         data = session.pop("agreement_data", {})
 
-        # add the signature blob & timestamp
-        data["signature"]    = request.form["signature_data"]
+        if data.get("fanout_job"):
+            return send_fanout(data, signature_ref)
+        if data.get("revises"):
+            return resend_revision(data, signature_ref)
+
+        # reference the stored signature & timestamp
+        data["signature_ref"] = signature_ref
         data["created_at"]   = datetime.utcnow()
 
         # convert back to ObjectId for Mongo
@@ -182,91 +468,364 @@ def signature_page():
         # … after setting data["created_at"] …
         data["response_status"] = "pending"       # initial state
         data["response_date"]   = None
+        data.update(search.index_fields(data))
 
-        inserted = agreements_coll.insert_one(data)
+        inserted = repo().agreements.insert_one(data)
+        userstats.record(stats_coll(), userstats.created(data))
+        status_feed().notify(dict(data, _id=inserted.inserted_id))
+        record_event("agreement.created", data["party1"]["user_id"], inserted.inserted_id,
+                     [data["party2"]["user_id"]])
         flash("Agreement created!", "success")
-        return redirect(url_for("view_agreement", agreement_id=str(inserted.inserted_id)))
+        return redirect(url_for("main.view_agreement", agreement_id=str(inserted.inserted_id)))
 
     return render_template("signature.html")
 
-@app.route("/agreements/<agreement_id>")
+def send_fanout(data, signature_ref):
+    """Finish a fan-out wizard: one agreement per resolved recipient."""
+    jobs = repo().collection(JOBS_COLL)
+    me_id = ObjectId(session["user_id"])
+    job = load_job(jobs, data.pop("fanout_job"), me_id)
+    template = {
+        "title": data.get("title"),
+        "party1": {"user_id": me_id, "name": data["party1"]["name"]},
+        "content": data.get("content", {}),
+        "signature_ref": signature_ref,
+    }
+    recipients = run_job(jobs, repo().agreements, job, template, stats_coll=stats_coll()) if job else None
+    if recipients is None:
+        flash("That bulk send was already processed.", "warning")
+        return redirect(url_for("main.home"))
+    created = sum(1 for r in recipients if r["status"] == "created")
+    if created and status_feed().wants_notify():
+        ids = [r["agreement_id"] for r in recipients if r["status"] == "created"]
+        status_feed().notify(*repo().agreements.find({"_id": {"$in": ids}}, EVENT_PROJECTION))
+    record_event("agreement.bulk_sent", me_id, job["_id"], created=created, recipients=len(recipients))
+    flash(f"Agreement sent to {created} of {len(recipients)} recipient(s).",
+          "success" if created == len(recipients) else "warning")
+    return redirect(url_for("main.fanout_report", job_id=str(job["_id"])))
+
+def resend_revision(data, signature_ref):
+    """Finish an edit: the rejected agreement becomes the next revision."""
+    agreement_id = ObjectId(data["revises"])
+    try:
+        revise(repo().agreements, repo().collection(REVISIONS_COLL), agreement_id,
+               ObjectId(session["user_id"]), data["title"], data.get("content", {}), signature_ref,
+               stats_coll=stats_coll())
+    except RevisionConflict:
+        flash("That agreement can no longer be edited.", "danger")
+        return redirect(url_for("main.home"))
+    fragment_cache().invalidate(agreement_id)
+    record_event("agreement.revised", ObjectId(session["user_id"]), agreement_id)
+    if status_feed().wants_notify():
+        status_feed().notify(repo().agreements.find_one({"_id": agreement_id}, EVENT_PROJECTION))
+    flash("Agreement updated and resent!", "success")
+    return redirect(url_for("main.view_agreement", agreement_id=str(agreement_id)))
+
+@bp.route("/agreements/bulk/<job_id>")
+@login_required
+def fanout_report(job_id):
+    job = load_job(repo().collection(JOBS_COLL), job_id, ObjectId(session["user_id"]))
+    if not job:
+        flash("Bulk send not found.", "danger")
+        return redirect(url_for("main.home"))
+    return render_template("fanout_report.html", job=job)
+
+@bp.route("/agreements/<agreement_id>")
 @login_required
 def view_agreement(agreement_id):
-    agr = agreements_coll.find_one({"_id": ObjectId(agreement_id)})
+    agr = find_agreement(agreement_id)
     me = current_user()
     
     if not agr or (agr["party2"]["user_id"] != me["_id"] and agr["party1"]["user_id"] != me["_id"]):
         flash("You are not authorized to view that agreement.", "danger")
-        return redirect(url_for("home"))
-    
-    return render_template(
-        "view_agreement.html",
-        agreement=agr,
-        me_id=str(me["_id"])
-    )
-
-
-@app.route("/agreements/search", methods=["GET", "POST"])
+        return redirect(url_for("main.home"))
+
+    # revalidate every time, but skip rendering when nothing has changed;
+    # pending flash messages must still be rendered (and consumed)
+    etag, modified = agreement_validators(agr, me["_id"], current_app.extensions["deploy_version"])
+    if not session.get("_flashes") and not is_resource_modified(
+        request.environ, etag=etag, last_modified=modified
+    ):
+        resp = Response(status=304)
+    else:
+        resp = make_response(render_template(
+            "view_agreement.html",
+            agreement=agr,
+            me_id=str(me["_id"])
+        ))
+        resp.last_modified = modified
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp
+
+
+def read_blob(sig_hash):
+    blob = signature_store().open(sig_hash)
+    if not blob:
+        abort(404)
+    with blob[0] as fileobj:
+        return fileobj.read()
+
+
+@bp.route("/signatures/<sig_hash>")
+@login_required
+def signature_image(sig_hash):
+    if not is_signature_hash(sig_hash):
+        abort(404)
+    # stroke signatures are rendered; ?format=svg and ?w=<px> pick the variant
+    fmt = request.args.get("format", "png")
+    width = request.args.get("w", type=int)
+    if fmt not in strokes.RENDERERS:
+        abort(404)
+    etag = sig_hash if fmt == "png" and width is None else f"{sig_hash}.{fmt}.{width}"
+    # content-addressed: a matching ETag means the client already has these bytes
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        me = current_user()
+        agr = archive.find_agreement(repo().agreements, archive_coll(), {
+            "signature_ref.hash": sig_hash,
+            "$or": [{"party1.user_id": me["_id"]}, {"party2.user_id": me["_id"]}]
+        }, {"signature_ref": 1})
+        if not agr:
+            # superseded signatures live on in the revision chain
+            agr = repo().collection(REVISIONS_COLL).find_one({
+                "signature_ref.hash": sig_hash, "party_ids": me["_id"]
+            }, {"signature_ref": 1})
+        if not agr:
+            abort(404)
+        if agr["signature_ref"]["content_type"] == strokes.CONTENT_TYPE:
+            # the blob is only read when this rendering is not cached
+            try:
+                mimetype, image = signature_renders().render(
+                    sig_hash, lambda: read_blob(sig_hash), fmt, width
+                )
+            except InvalidSignature:
+                # stored before the stroke limits and too costly to render
+                abort(404)
+            resp = Response(image, mimetype=mimetype)
+        else:
+            blob = signature_store().open(sig_hash)
+            if not blob:
+                abort(404)
+            fileobj, length = blob
+            resp = Response(iter_blob(fileobj), mimetype=agr["signature_ref"]["content_type"])
+            resp.content_length = length
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return resp
+
+
+@bp.route("/agreements/search", methods=["GET", "POST"])
 @login_required
 def search_agreements():
     me = current_user()
-    if request.method == "POST":
-        keyword = request.form.get("keyword", "")
+    keyword = request.values.get("keyword")
+    if keyword is not None:
         # only search among agreements where I'm party2
-        results = agreements_coll.find({
-            "party2.user_id": me["_id"],
-            "$or": [
-            {"party1.name": {"$regex": keyword, "$options": "i"}},
-            {"title":       {"$regex": keyword, "$options": "i"}}
-            ]
-        })
+        results, next_cursor = search.search_agreements(
+            repo().reads("agreements"), me["_id"], keyword, request.args.get("cursor"),
+            current_app.config["PAGE_SIZE"], archive=archive.ARCHIVE_COLL
+        )
+        next_url = None
+        if next_cursor:
+            next_url = url_for("main.search_agreements", keyword=keyword, cursor=next_cursor)
         return render_template("search_results.html",
-                               results=list(results),
-                               keyword=keyword)
+                               results=results,
+                               keyword=keyword,
+                               next_url=next_url)
     return render_template("search.html")
 
-@app.route("/agreements/<agreement_id>/respond", methods=["POST"])
+@bp.route("/agreements/export")
+@login_required
+def export_agreements():
+    """Stream the caller's agreements as CSV or NDJSON."""
+    me = current_user()
+    fmt = request.args.get("format", "csv")
+    signature_url = None
+    if request.args.get("signatures") == "1":
+        signature_url = lambda h: url_for("main.signature_image", sig_hash=h, _external=True)
+    try:
+        query = export.export_query(
+            me["_id"], request.args.get("from"), request.args.get("to"),
+            request.args.get("status") or None
+        )
+        rows = export.iter_merged([repo().reads("agreements"), repo().reads(archive.ARCHIVE_COLL)], query)
+        lines = export.stream(fmt, rows, me["_id"], signature_url)
+    except export.InvalidExport as e:
+        return str(e), 400
+
+    filename = f"agreements-{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(
+        stream_with_context(lines),
+        mimetype=export.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@bp.route("/agreements/respond", methods=["POST"])
+@login_required
+def respond_agreements():
+    """Answer many agreements at once; JSON in gives per-item JSON out."""
+    me = current_user()
+    payload = request.get_json(silent=True) if request.is_json else None
+    if payload is not None:
+        if not isinstance(payload, dict):
+            return jsonify(error="request body must be a JSON object"), 400
+        ids, decision = payload.get("ids", []), payload.get("response")
+    else:
+        ids, decision = request.form.getlist("agreement_ids"), request.form.get("response")
+
+    try:
+        results, modified = respond_many(repo().agreements, me["_id"], ids, decision, stats_coll=stats_coll())
+    except InvalidBatch as e:
+        if payload is not None:
+            return jsonify(error=str(e)), 400
+        flash(f"{str(e).capitalize()}.", "warning")
+        return redirect(url_for("main.home"))
+
+    updated_ids = [i for i, r in results.items() if r == "updated"]
+    fragment_cache().invalidate(*updated_ids)
+    if updated_ids:
+        # one read gives the senders for the audit trail and the live events
+        answered = list(repo().agreements.find(
+            {"_id": {"$in": [ObjectId(i) for i in updated_ids]}}, EVENT_PROJECTION
+        ))
+        for agr in answered:
+            record_event("agreement.responded", me["_id"], agr["_id"], [agr["party1"]["user_id"]],
+                         status=decision, batch=True)
+        status_feed().notify(*answered)
+    if payload is not None:
+        return jsonify(response=decision, modified=modified, results=results)
+    updated = len(updated_ids)
+    skipped = len(results) - updated
+    flash(f"{decision.capitalize()} {updated} agreement(s)."
+          + (f" {skipped} could not be updated." if skipped else ""),
+          "success" if updated else "warning")
+    return redirect(url_for("main.home"))
+
+@bp.route("/agreements/<agreement_id>/respond", methods=["POST"])
 @login_required
 def respond_agreement(agreement_id):
     from bson import ObjectId
 
     me = current_user()
-    agr = agreements_coll.find_one({"_id": ObjectId(agreement_id)})
+    agr = find_hot_agreement(agreement_id, lambda a: a["party2"]["user_id"] == me["_id"])
     # only party2 can respond, and only if it’s still pending or rejected
     if not agr or str(me["_id"]) != str(agr["party2"]["user_id"]):
         flash("Not authorized.", "danger")
-        return redirect(url_for("home"))
-
-    choice = request.form["response"]      # 'agreed' or 'rejected'
-    new_status = choice  # exactly “agreed” or “rejected”
-
-    agreements_coll.update_one(
-        {"_id": ObjectId(agreement_id)},
+        return redirect(url_for("main.home"))
+
+    new_status = request.form.get("response")
+    # exactly “agreed” or “rejected”; anything else would be stored and counted as-is
+    if new_status not in DECISIONS:
+        flash("Please choose to agree or reject.", "danger")
+        return redirect(url_for("main.view_agreement", agreement_id=agreement_id))
+
+    now = datetime.utcnow()
+    result = repo().agreements.update_one(
+        # only if nobody answered meanwhile, so the counters move once
+        {"_id": ObjectId(agreement_id), "response_status": agr.get("response_status")},
         {"$set": {
             "response_status": new_status,
-            "response_date": datetime.utcnow()
+            "response_date": now
         }}
     )
+    if not result.modified_count:
+        flash("This agreement was answered meanwhile; please review it again.", "warning")
+        return redirect(url_for("main.view_agreement", agreement_id=agreement_id))
+    userstats.record(stats_coll(), userstats.transition(agr, userstats.status_of(agr), new_status))
+    fragment_cache().invalidate(agreement_id)
+    status_feed().notify(dict(agr, response_status=new_status, response_date=now))
+    record_event("agreement.responded", me["_id"], agr["_id"], [agr["party1"]["user_id"]], status=new_status)
 
     flash(
       "You have “Agreed” to this form." if new_status=="agreed"
       else "You have “Rejected” this form – party 1 can now edit & resend.",
       "success"
     )
-    return redirect(url_for("home"))
+    return redirect(url_for("main.home"))
 
-@app.route("/agreements/<agreement_id>/edit", methods=["GET"])
+@bp.route("/agreements/events")
+@login_required
+def agreement_events():
+    """Server-Sent Events: status changes to the signed-in user's agreements."""
+    feed = status_feed()
+    if not feed.enabled:
+        abort(404)
+    sub = feed.subscribe(session["user_id"])
+    if sub is None:
+        # every stream pins a worker thread; turn extra clients away instead of starving pages
+        retry = current_app.config["SSE_RETRY_SECONDS"]
+        resp = Response(f"retry: {retry * 1000}\n\n", status=503, mimetype="text/event-stream")
+        resp.headers["Retry-After"] = str(retry)
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
+    heartbeat = current_app.config["SSE_HEARTBEAT_SECONDS"]
+    # streams end now and then so held worker threads are recycled
+    deadline = time.monotonic() + current_app.config["SSE_MAX_SECONDS"]
+
+    def events():
+        try:
+            yield f"retry: {int(heartbeat * 1000)}\n\n"
+            while time.monotonic() < deadline:
+                event = sub.get(max(0, min(heartbeat, deadline - time.monotonic())))
+                yield format_sse(event) if event else ": keepalive\n\n"
+        finally:
+            feed.unsubscribe(sub)
+
+    resp = Response(events(), mimetype="text/event-stream")
+    # also runs when the client disconnects before the stream starts
+    resp.call_on_close(lambda: feed.unsubscribe(sub))
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+@bp.route("/agreements/stats")
+@login_required
+def agreement_stats():
+    """Counters for badges: sent/received agreements per status."""
+    return jsonify(userstats.get(stats_coll(), current_user()["_id"]))
+
+@bp.route("/audit/events")
+@login_required
+def audit_events():
+    """The signed-in user's audit trail, newest first; ?action= filters, ?cursor= pages."""
+    me_id = current_user()["_id"]
+    events, next_cursor = audit.query(
+        repo().collection(audit.AUDIT_COLL), me_id, request.args.getlist("action"),
+        cursor=request.args.get("cursor"), page_size=current_app.config["PAGE_SIZE"]
+    )
+    return jsonify(events=[audit.to_json(e, me_id) for e in events], next=next_cursor)
+
+@bp.route("/agreements/<agreement_id>/history")
+@login_required
+def agreement_history(agreement_id):
+    agr = find_agreement(agreement_id)
+    me = current_user()
+    if not agr or me["_id"] not in (agr["party1"]["user_id"], agr["party2"]["user_id"]):
+        flash("You are not authorized to view that agreement.", "danger")
+        return redirect(url_for("main.home"))
+    return render_template(
+        "agreement_history.html",
+        agreement=agr,
+        versions=history(repo().collection(REVISIONS_COLL), agr)
+    )
+
+@bp.route("/agreements/<agreement_id>/edit", methods=["GET"])
 @login_required
 def edit_agreement(agreement_id):
-    agr = agreements_coll.find_one({"_id": ObjectId(agreement_id)})
     me  = current_user()
+    agr = find_hot_agreement(
+        agreement_id, lambda a: a["party1"]["user_id"] == me["_id"] and a["response_status"] == "rejected"
+    )
 
     # only party1 on a rejected form can edit
     if (not agr
         or agr["party1"]["user_id"] != me["_id"]
         or agr["response_status"] != "rejected"):
         flash("Not authorized to edit.", "danger")
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
     # seed the session exactly as step1/step2 expect it
     session["agreement_data"] = {
@@ -279,13 +838,113 @@ def edit_agreement(agreement_id):
             "user_id": str(agr["party2"]["user_id"]),
             "name":    agr["party2"]["name"]
         },
-        "content": agr["content"]
+        "content": agr["content"],
+        # signing updates this agreement as its next revision
+        "revises": str(agr["_id"])
     }
 
     # jump right back into the flow—start at Step 2 to edit content,
     # or use step1 if you want them to also tweak title/target
-    return redirect(url_for("step2"))
+    return redirect(url_for("main.step2"))
+
+
+# --- Operational endpoints ---
+@bp.route("/healthz")
+def healthz():
+    return jsonify(status="ok")
+
+
+@bp.route("/readyz")
+def readyz():
+    # ready only once this worker can reach MongoDB
+    try:
+        repo().ping()
+    except PyMongoError as e:
+        return jsonify(status="unavailable", error=type(e).__name__), 503
+    return jsonify(status="ready", pid=os.getpid())
+
+
+@bp.route("/metrics")
+def metrics_export():
+    return Response(metrics().render(), mimetype="text/plain; version=0.0.4")
+
+
+# --- CLI commands ---
+@click.command("migrate")
+@click.option("--check", is_flag=True, help="Only verify that required indexes exist.")
+@with_appcontext
+def migrate_command(check):
+    """Apply pending schema/index migrations."""
+    db = repo().db
+    if not check:
+        applied = run_migrations(db, log=click.echo)
+        click.echo(f"{len(applied)} migration(s) applied.")
+    try:
+        verify_indexes(db)
+    except MissingIndexError as e:
+        raise click.ClickException(str(e))
+    click.echo("All required indexes present.")
+
+
+@click.command("hash-bench")
+@click.option("--seconds", default=2.0, help="How long to hash for.")
+@click.option("--processes", default=0, help="Worker processes (default: one per core).")
+@with_appcontext
+def hash_bench_command(seconds, processes):
+    """Report password hashes/sec per core for the configured method."""
+    result = hash_benchmark(password_hasher().method, processes or None, seconds)
+    for key, value in result.items():
+        click.echo(f"{key}: {value}")
+
+
+@click.command("rebuild-stats")
+@click.option("--user", "username", default=None, help="Recount one user only.")
+@with_appcontext
+def rebuild_stats_command(username):
+    """Recompute per-user agreement counters from the agreements."""
+    user_ids = None
+    if username:
+        user = repo().users.find_one({"username": username}, {"_id": 1})
+        if not user:
+            raise click.ClickException(f"No user named {username!r}.")
+        user_ids = [user["_id"]]
+    written = userstats.rebuild(repo().agreements, stats_coll(), user_ids)
+    click.echo(f"Counters rebuilt for {written} user(s).")
+
+
+def _echo_hot_set(label, report):
+    for name, size in report.items():
+        extra = f", {size['size']} bytes data, {size['index_size']} bytes indexes" if size["size"] is not None else ""
+        click.echo(f"{label} {name}: {size['count']} documents{extra}")
+
+
+@click.command("archive")
+@click.option("--older-than-days", type=int, default=None,
+              help="Archive agreements answered this long ago (default: ARCHIVE_AFTER_DAYS).")
+@click.option("--batch-size", default=archive.ARCHIVE_BATCH, help="Agreements moved per batch.")
+@click.option("--max-batches", type=int, default=None, help="Stop after this many batches.")
+@with_appcontext
+def archive_command(older_than_days, batch_size, max_batches):
+    """Move settled agreements to agreements_archive; safe to rerun after an interruption."""
+    if older_than_days is None:
+        older_than_days = current_app.config["ARCHIVE_AFTER_DAYS"]
+    db = repo().db
+    _echo_hot_set("before", archive.hot_set_report(db))
+    moved = archive.archive_settled(repo().agreements, archive_coll(), older_than_days,
+                                    batch_size, max_batches, log=click.echo)
+    _echo_hot_set("after", archive.hot_set_report(db))
+    click.echo(f"{moved} agreement(s) archived.")
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    with app.app_context():
+        if app.config["AUTO_MIGRATE"]:
+            run_migrations(repo().db)
+        # refuse to serve on top of collection scans
+        verify_indexes(repo().db)
+    warm_up(app)
+    # development server only; production runs `gunicorn -c gunicorn.conf.py app:app`
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG") == "1")
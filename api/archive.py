@@ -0,0 +1,130 @@
+"""
+archive.py
+
+Hot/cold tiering: settled agreements move to agreements_archive.
+
+An agreement is settled once it has been agreed for longer than
+ARCHIVE_AFTER_DAYS. Rejected agreements stay hot: the sender can still edit
+and resend them and the recipient can still agree, so they belong on the
+dashboard however old they are. archive_settled() moves those documents, oldest id
+first, in batches: copy the batch into the archive, then delete it from
+agreements with the settled filter repeated. Each batch is idempotent (the
+copy tolerates duplicates and anything answered again in between is dropped
+from the archive), so an interrupted run is resumed by starting it again.
+
+Dashboards read the hot collection only and link to list_archived(), a
+keyset-paged listing of the archive; single-agreement views, search and
+export read through to the archive. Editing a rejected agreement archived
+before rejected ones were kept hot restores it first.
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from pagination import DEFAULT_PAGE_SIZE, NEWEST_FIRST, decode_cursor, keyset_match, split_page
+
+ARCHIVE_COLL = "agreements_archive"
+ARCHIVE_BATCH = 500
+
+SETTLED = ("agreed",)
+
+# what archived.html renders, plus the cursor keys
+LISTING_FIELDS = {"title": 1, "party1.user_id": 1, "party1.name": 1, "party2.name": 1,
+                  "response_date": 1, "created_at": 1, "revision": 1}
+
+DUPLICATE_KEY = 11000
+
+
+def settled_query(cutoff):
+    """Agreements answered before cutoff."""
+    return {"response_status": {"$in": list(SETTLED)}, "response_date": {"$lt": cutoff}}
+
+
+def _insert_ignoring_duplicates(coll, docs):
+    try:
+        coll.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # copies left behind by an interrupted batch are already there
+        if any(err.get("code") != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def archive_batch(agreements_coll, archive_coll, cutoff, batch_size=ARCHIVE_BATCH):
+    """Move up to batch_size settled agreements; return how many moved."""
+    query = settled_query(cutoff)
+    docs = list(agreements_coll.find(query).sort("_id", 1).limit(batch_size))
+    if not docs:
+        return 0
+    ids = [d["_id"] for d in docs]
+    _insert_ignoring_duplicates(archive_coll, docs)
+    result = agreements_coll.delete_many(dict(query, _id={"$in": ids}))
+    moved = result.deleted_count
+    if moved < len(ids):
+        # answered again between copy and delete: the hot copy stays authoritative
+        still_hot = [d["_id"] for d in agreements_coll.find({"_id": {"$in": ids}}, {"_id": 1})]
+        archive_coll.delete_many({"_id": {"$in": still_hot}})
+    return moved
+
+
+def archive_settled(agreements_coll, archive_coll, older_than_days, batch_size=ARCHIVE_BATCH,
+                    max_batches=None, now=None, log=None):
+    """Move every agreement settled more than older_than_days ago; return the total."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(agreements_coll, archive_coll, cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        if log:
+            log(f"batch {batches}: moved {moved} ({total} total)")
+    return total
+
+
+def restore(agreements_coll, archive_coll, agreement_id):
+    """Move one archived agreement back to the hot collection; return it or None."""
+    doc = archive_coll.find_one({"_id": agreement_id})
+    if doc is None:
+        return None
+    _insert_ignoring_duplicates(agreements_coll, [doc])
+    archive_coll.delete_many({"_id": agreement_id})
+    return doc
+
+
+def find_agreement(agreements_coll, archive_coll, query, projection=None):
+    """find_one on the hot collection, falling back to the archive."""
+    return agreements_coll.find_one(query, projection) or archive_coll.find_one(query, projection)
+
+
+def list_archived(archive_coll, user_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Archived agreements user_id sent or received, newest first.
+
+    Returns (agreements, next_cursor); each $or branch is served by a
+    party{1,2}_user_created_at_id index and merged in sort order.
+    """
+    query = {"$or": [{"party1.user_id": user_id}, {"party2.user_id": user_id}]}
+    after = decode_cursor(cursor)
+    if after:
+        query = {"$and": [query, keyset_match(after)]}
+    rows = list(archive_coll.find(query, LISTING_FIELDS).sort(list(NEWEST_FIRST)).limit(page_size + 1))
+    return split_page(rows, page_size)
+
+
+def collection_size(db, name):
+    """{"count", "size", "index_size"} for a collection; sizes are None if unavailable."""
+    coll = db[name]
+    report = {"count": coll.count_documents({}), "size": None, "index_size": None}
+    try:
+        stats = db.command("collStats", name)
+    except (AttributeError, OperationFailure):
+        return report
+    report.update(size=stats.get("size"), index_size=stats.get("totalIndexSize"))
+    return report
+
+
+def hot_set_report(db):
+    """Sizes of the hot and archive collections."""
+    return {name: collection_size(db, name) for name in ("agreements", ARCHIVE_COLL)}
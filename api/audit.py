@@ -0,0 +1,223 @@
+"""
+audit.py
+
+Asynchronous audit trail: sign-ins, agreement creation, responses and edits.
+
+Routes call AuditLog.record(), which only puts a small dict on a bounded
+in-process queue. One writer thread per process drains the queue and stores
+events with insert_many, in batches of up to batch_size events or whatever
+arrived within flush_seconds, so a request never waits on an audit write.
+
+When MongoDB falls behind and the queue fills up, record() waits at most
+block_seconds for room (backpressure) and then drops the event; drops and
+failed writes are counted in stats(), and exported on /metrics by
+export_metrics(), so lost coverage is visible. Pending events are flushed at
+interpreter exit.
+
+Events are queried newest first per user with query(), paged with the same
+keyset cursors as the dashboard. The client address is stored beside the
+details, not in them: everyone listed in users can read an event, but only
+its actor sees the address.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, keyset_match, split_page
+
+log = logging.getLogger("consent.audit")
+
+AUDIT_COLL = "audit_events"
+
+# newest first, like the dashboard
+NEWEST_FIRST = (("ts", -1), ("_id", -1))
+
+
+def event(action, actor=None, target=None, users=(), ip=None, **details):
+    """An audit document; users lists everyone the event concerns, actor included."""
+    involved = []
+    for user_id in (actor, *users):
+        if user_id is not None and user_id not in involved:
+            involved.append(user_id)
+    doc = {"_id": ObjectId(), "ts": datetime.utcnow(), "action": action, "actor": actor, "users": involved}
+    if target is not None:
+        doc["target"] = target
+    if ip is not None:
+        doc["ip"] = ip
+    if details:
+        doc["details"] = details
+    return doc
+
+
+def to_json(doc, viewer=None):
+    """A stored event with ids and timestamps as strings; the address only for its actor."""
+    out = {
+        "id": str(doc["_id"]),
+        "ts": doc["ts"].isoformat(),
+        "action": doc["action"],
+        "actor": str(doc["actor"]) if doc.get("actor") is not None else None,
+    }
+    if doc.get("target") is not None:
+        out["target"] = str(doc["target"])
+    if doc.get("details"):
+        out["details"] = doc["details"]
+    if viewer is not None and doc.get("ip") is not None and doc.get("actor") == viewer:
+        out["ip"] = doc["ip"]
+    return out
+
+
+class AuditLog:
+    """Per-process bounded queue plus a batching writer thread."""
+
+    def __init__(self, collection=None, queue_size=10000, batch_size=500, flush_seconds=1.0,
+                 block_seconds=0.005):
+        self.collection = collection  # callable returning the audit collection
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        # queue_size 0 turns auditing off (queue.Queue(0) would be unbounded)
+        self.enabled = queue_size > 0
+        self._queue = queue.Queue(max(1, queue_size))
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_config(cls, config, collection):
+        """Build an AuditLog from create_app() settings."""
+        return cls(
+            collection,
+            queue_size=config["AUDIT_QUEUE_SIZE"],
+            batch_size=config["AUDIT_BATCH_SIZE"],
+            flush_seconds=config["AUDIT_FLUSH_SECONDS"],
+            block_seconds=config["AUDIT_BLOCK_MS"] / 1000,
+        )
+
+    def record(self, action, actor=None, target=None, users=(), ip=None, **details):
+        """Queue an event; returns False when it had to be dropped."""
+        if not self.enabled:
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put(event(action, actor, target, users, ip, **details), timeout=self.block_seconds)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.recorded += 1
+        return True
+
+    # --- Writer ---
+    def _ensure_writer(self):
+        with self._lock:
+            # a forked worker starts its own thread
+            if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _next_batch(self):
+        """Block for the first event, then gather more until full or flush_seconds pass."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.collection().insert_many(batch, ordered=False)
+        except PyMongoError as e:
+            # the request that caused these events has long returned; count and move on
+            log.warning("dropping %d audit event(s): %s", len(batch), e)
+            with self._lock:
+                self.failed += len(batch)
+            return
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout=5.0):
+        """Wait until every queued event has been written (or failed); True if it was."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if self._writer is None or not self._writer.is_alive() or time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queued": self._queue.qsize(),
+                "recorded": self.recorded,
+                "dropped": self.dropped,
+                "written": self.written,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+
+    def export_metrics(self, registry):
+        """Copy the counters into a metrics Registry (see Metrics.collect)."""
+        stats = self.stats()
+        events = registry.counter("audit_events_total", "Audit events by outcome.", ("outcome",))
+        for outcome in ("recorded", "dropped", "written", "failed"):
+            events.set((outcome,), stats[outcome])
+        registry.counter("audit_batches_total", "insert_many batches written.", ()).set((), stats["batches"])
+        registry.gauge("audit_queue_depth", "Audit events waiting to be written.", ()).set((), stats["queued"])
+
+
+def query(audit_coll, user_id, actions=None, since=None, until=None, cursor=None,
+          page_size=DEFAULT_PAGE_SIZE):
+    """
+    Audit events concerning user_id, newest first.
+
+    Returns (events, next_cursor); next_cursor is None on the last page.
+    """
+    filters = {"users": user_id}
+    if actions:
+        filters["action"] = {"$in": list(actions)}
+    if since or until:
+        filters["ts"] = {}
+        if since:
+            filters["ts"]["$gte"] = since
+        if until:
+            filters["ts"]["$lt"] = until
+    after = decode_cursor(cursor, NEWEST_FIRST)
+    if after:
+        filters = {"$and": [filters, keyset_match(after, NEWEST_FIRST)]}
+    # served by the users_ts_id index
+    rows = list(audit_coll.find(filters).sort(list(NEWEST_FIRST)).limit(page_size + 1))
+    return split_page(rows, page_size, NEWEST_FIRST)
@@ -0,0 +1,5 @@
+"""
+benchmarks
+
+Synthetic data generator and concurrent route benchmark (see run.py).
+"""
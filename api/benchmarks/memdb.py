@@ -0,0 +1,461 @@
+"""
+memdb.py
+
+In-process stand-in for the subset of pymongo the app uses.
+
+It understands the filters, updates and aggregation stages issued by app.py
+and its data modules, so benchmarks (and quick experiments) can run without
+a MongoDB server. It is a linear scan over Python dicts: absolute numbers say
+nothing about MongoDB, but relative numbers between commits are meaningful.
+"""
+
+import copy
+import threading
+from collections import namedtuple
+
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+InsertOneResult = namedtuple("InsertOneResult", "inserted_id")
+InsertManyResult = namedtuple("InsertManyResult", "inserted_ids")
+UpdateResult = namedtuple("UpdateResult", "matched_count modified_count upserted_id")
+BulkWriteResult = namedtuple("BulkWriteResult", "matched_count modified_count")
+DeleteResult = namedtuple("DeleteResult", "deleted_count")
+
+_MISSING = object()
+
+
+# --- Field access ---
+def get_path(doc, path):
+    """Resolve a dotted path; _MISSING when any part is absent."""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+# --- Query matching ---
+def _candidates(value):
+    """A field matches if it, or any element of it, satisfies the test."""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+
+def _sort_key(value):
+    # order across types the way the tests and app need: None < numbers < rest
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (3, value.binary)
+    return (4, value)
+
+
+def _compare(op, value, operand):
+    if value is _MISSING or value is None or operand is None:
+        return False
+    try:
+        if op == "$lt":
+            return _sort_key(value) < _sort_key(operand)
+        if op == "$lte":
+            return _sort_key(value) <= _sort_key(operand)
+        if op == "$gt":
+            return _sort_key(value) > _sort_key(operand)
+        return _sort_key(value) >= _sort_key(operand)
+    except TypeError:
+        return False
+
+
+def _match_operator(value, op, operand):
+    if op == "$ne":
+        return not _match_operator(value, "$eq", operand)
+    if op == "$eq":
+        if value is _MISSING:
+            return operand is None
+        return any(c == operand for c in _candidates(value))
+    if op in ("$lt", "$lte", "$gt", "$gte"):
+        return any(_compare(op, c, operand) for c in _candidates(value))
+    if op == "$in":
+        return any(_match_operator(value, "$eq", o) for o in operand)
+    if op == "$nin":
+        return not _match_operator(value, "$in", operand)
+    if op == "$all":
+        return all(_match_operator(value, "$eq", o) for o in operand)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if op == "$type":
+        types = {"string": str, "date": object, "objectId": ObjectId}
+        return value is not _MISSING and isinstance(value, types[operand])
+    raise NotImplementedError(f"memdb does not support {op}")
+
+
+def matches(doc, query):
+    """True if doc satisfies a MongoDB filter document."""
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        else:
+            value = get_path(doc, key)
+            if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+                if not all(_match_operator(value, op, arg) for op, arg in cond.items()):
+                    return False
+            elif not _match_operator(value, "$eq", cond):
+                return False
+    return True
+
+
+# --- Projection, sort and expressions ---
+def project(doc, projection):
+    """Apply an inclusion (or pure exclusion) projection, with $literal support."""
+    if not projection:
+        return copy.deepcopy(doc)
+    if all(v in (0, False) for v in projection.values()):
+        out = copy.deepcopy(doc)
+        for path in projection:
+            unset_path(out, path)
+        return out
+    out = {}
+    if projection.get("_id", 1) and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for path, spec in projection.items():
+        if path == "_id":
+            continue
+        if isinstance(spec, dict):
+            set_path(out, path, evaluate(doc, spec))
+        elif spec:
+            value = get_path(doc, path)
+            if value is not _MISSING:
+                set_path(out, path, copy.deepcopy(value))
+    return out
+
+
+def sort_docs(docs, spec):
+    for field, direction in reversed(list(spec.items())):
+        docs.sort(key=lambda d, f=field: _sort_key(get_path(d, f)), reverse=direction < 0)
+    return docs
+
+
+def evaluate(doc, expr):
+    """Evaluate the small aggregation-expression subset the app uses."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = get_path(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op == "$literal":
+            return arg
+        if op == "$size":
+            return len(evaluate(doc, arg) or [])
+        if op == "$ifNull":
+            value = evaluate(doc, arg[0])
+            return evaluate(doc, arg[1]) if value is None else value
+        if op == "$setIntersection":
+            sets = [evaluate(doc, a) or [] for a in arg]
+            common = [v for v in dict.fromkeys(sets[0]) if all(v in s for s in sets[1:])]
+            return common
+    if isinstance(expr, dict) and not any(k.startswith("$") for k in expr):
+        return {k: evaluate(doc, v) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [evaluate(doc, e) for e in expr]
+    return expr
+
+
+def group(docs, spec):
+    """$group with the $sum accumulator."""
+    groups = {}
+    for doc in docs:
+        key = evaluate(doc, spec["_id"])
+        out = groups.setdefault(repr(key), {"_id": key})
+        for field, acc in spec.items():
+            if field == "_id":
+                continue
+            (op, arg), = acc.items()
+            if op != "$sum":
+                raise NotImplementedError(f"memdb does not support {op}")
+            out[field] = out.get(field, 0) + (evaluate(doc, arg) or 0)
+    return list(groups.values())
+
+
+# --- Updates ---
+def apply_update(doc, update):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$inc":
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$setOnInsert":
+                continue
+            else:
+                raise NotImplementedError(f"memdb does not support {op}")
+
+
+class MemoryCursor:
+    """Just enough of pymongo's Cursor: sort, skip, limit, batch_size, iteration."""
+
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._sort = None
+        self._limit = 0
+        self._skip = 0
+
+    def sort(self, key, direction=None):
+        self._sort = {key: direction or 1} if isinstance(key, str) else dict(key)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        docs = list(self._docs)
+        if self._sort:
+            sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return iter([project(d, self._projection) for d in docs])
+
+
+class MemoryCollection:
+    """A thread-safe list of documents with pymongo-like methods."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.docs = []
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self._lock = threading.RLock()
+
+    def _snapshot(self, query):
+        with self._lock:
+            return [d for d in self.docs if matches(d, query or {})]
+
+    # reads
+    def find(self, query=None, projection=None):
+        return MemoryCursor(self._snapshot(query), projection)
+
+    def find_one(self, query=None, projection=None):
+        for doc in MemoryCursor(self._snapshot(query), projection).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, query):
+        return len(self._snapshot(query))
+
+    def aggregate(self, pipeline):
+        # a leading $match filters before copying, as an index would
+        query = {}
+        if pipeline and "$match" in pipeline[0]:
+            query, pipeline = pipeline[0]["$match"], pipeline[1:]
+        docs = [copy.deepcopy(d) for d in self._snapshot(query)]
+        return iter(self.database.run_pipeline(docs, pipeline))
+
+    # writes
+    def insert_one(self, doc):
+        given = "_id" in doc
+        doc.setdefault("_id", ObjectId())
+        with self._lock:
+            # only the _id index is enforced, and only for caller-chosen ids
+            if given and any(d["_id"] == doc["_id"] for d in self.docs):
+                raise DuplicateKeyError(f"duplicate _id {doc['_id']}", 11000)
+            self.docs.append(copy.deepcopy(doc))
+        return InsertOneResult(doc["_id"])
+
+    def insert_many(self, docs, ordered=True):
+        inserted, errors = [], []
+        for i, doc in enumerate(docs):
+            try:
+                inserted.append(self.insert_one(doc).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": e.code, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return InsertManyResult(inserted)
+
+    def update_one(self, query, update, upsert=False):
+        with self._lock:
+            for doc in self.docs:
+                if matches(doc, query):
+                    apply_update(doc, update)
+                    return UpdateResult(1, 1, None)
+            if not upsert:
+                return UpdateResult(0, 0, None)
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            apply_update(doc, update)
+            for path, value in update.get("$setOnInsert", {}).items():
+                set_path(doc, path, value)
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(doc)
+            return UpdateResult(0, 0, doc["_id"])
+
+    def replace_one(self, query, replacement, upsert=False):
+        with self._lock:
+            for i, doc in enumerate(self.docs):
+                if matches(doc, query):
+                    self.docs[i] = dict(copy.deepcopy(replacement), _id=doc["_id"])
+                    return UpdateResult(1, 1, None)
+            if not upsert:
+                return UpdateResult(0, 0, None)
+            doc = dict(copy.deepcopy(replacement))
+            doc.setdefault("_id", query.get("_id", ObjectId()))
+            self.docs.append(doc)
+            return UpdateResult(0, 0, doc["_id"])
+
+    def update_many(self, query, update):
+        with self._lock:
+            hits = [d for d in self.docs if matches(d, query)]
+            for doc in hits:
+                apply_update(doc, update)
+        return UpdateResult(len(hits), len(hits), None)
+
+    def bulk_write(self, requests, ordered=True):
+        # pymongo's UpdateOne/ReplaceOne keep their arguments in private attributes
+        matched = modified = 0
+        for op in requests:
+            write = self.replace_one if isinstance(op, ReplaceOne) else self.update_one
+            result = write(op._filter, op._doc, upsert=op._upsert)
+            matched += result.matched_count
+            modified += result.modified_count
+        return BulkWriteResult(matched, modified)
+
+    def delete_one(self, query):
+        with self._lock:
+            for i, doc in enumerate(self.docs):
+                if matches(doc, query):
+                    del self.docs[i]
+                    return DeleteResult(1)
+        return DeleteResult(0)
+
+    def delete_many(self, query):
+        with self._lock:
+            kept = [d for d in self.docs if not matches(d, query)]
+            deleted, self.docs = len(self.docs) - len(kept), kept
+        return DeleteResult(deleted)
+
+    # indexes are accepted and listed, never used
+    def create_index(self, keys, name=None, **kwargs):
+        self.indexes[name] = {"key": keys, **kwargs}
+        return name
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def drop_index(self, name):
+        self.indexes.pop(name, None)
+
+
+class MemoryDatabase:
+    """Dict of MemoryCollections, created on first access like pymongo."""
+
+    def __init__(self, name="consent_data"):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def run_pipeline(self, docs, pipeline):
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, arg)]
+            elif op == "$sort":
+                docs = sort_docs(docs, arg)
+            elif op == "$limit":
+                docs = docs[:arg]
+            elif op == "$skip":
+                docs = docs[arg:]
+            elif op == "$project":
+                docs = [project(d, arg) for d in docs]
+            elif op in ("$addFields", "$set"):
+                for d in docs:
+                    for path, expr in arg.items():
+                        set_path(d, path, evaluate(d, expr))
+            elif op == "$unionWith":
+                other = self[arg["coll"]]
+                docs = docs + list(other.aggregate(arg.get("pipeline", [])))
+            elif op == "$count":
+                docs = [{arg: len(docs)}]
+            elif op == "$group":
+                docs = group(docs, arg)
+            else:
+                raise NotImplementedError(f"memdb does not support {op}")
+        return docs
+
+
+class MemoryRepository:
+    """Drop-in for repository.Repository backed by a MemoryDatabase."""
+
+    def __init__(self, db=None):
+        self.db = db or MemoryDatabase()
+
+    # no replica set here: durability and read routing are accepted and ignored
+    def collection(self, name, durability="default"):
+        return self.db[name]
+
+    def reads(self, name):
+        return self.db[name]
+
+    @property
+    def users(self):
+        return self.db["users"]
+
+    @property
+    def agreements(self):
+        return self.db["agreements"]
+
+    @property
+    def connected(self):
+        return True
+
+    def ping(self):
+        return None
+
+    def close(self):
+        return None
@@ -0,0 +1,133 @@
+"""
+render.py
+
+Template rendering benchmark for large dashboards.
+
+Renders home.html with --rows agreements split over its four lists and
+reports the time per render for each stage of the template caches:
+
+    cold          fresh Jinja environment, template parsed and compiled
+    bytecode      fresh environment loading compiled code from the bytecode cache
+    uncached      warm environment, every row rendered
+    fragments     warm environment, rows served from the fragment cache
+
+    python -m benchmarks.render --rows 2000 --repeat 20
+
+Run from the api/ directory.
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from benchmarks import seed
+
+SECTIONS = ("sent_pending", "sent_agreed", "recv_pending", "recv_agreed")
+
+
+def dashboard_context(rows, rng_seed=42):
+    """home.html context with rows agreements spread over the four lists."""
+    rng = random.Random(rng_seed)
+    start = datetime(2025, 1, 1)
+    context = {section: [] for section in SECTIONS}
+    for i in range(rows):
+        section = SECTIONS[i % len(SECTIONS)]
+        created = start + timedelta(minutes=i)
+        context[section].append({
+            "_id": ObjectId(),
+            "title": " ".join(rng.choice(seed.WORDS) for _ in range(4)),
+            "party1": {"name": f"user{rng.randrange(1000)}"},
+            "party2": {"name": f"user{rng.randrange(1000)}"},
+            "response_status": "agreed" if section.endswith("agreed") else rng.choice(("pending", "rejected")),
+            "response_date": created + timedelta(hours=1) if section.endswith("agreed") else None,
+            "created_at": created,
+        })
+    context["pages"] = {section: {} for section in SECTIONS}
+    context["counts"] = {role: {"pending": 0, "agreed": 0, "rejected": 0} for role in ("sent", "received")}
+    return context
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - began)
+    return 1000 * min(samples)
+
+
+def measure(rows, repeat=10, rng_seed=42):
+    """Milliseconds per home.html render at each caching stage."""
+    # imported late so the module loads without the app's dependencies
+    import app as app_module  # pylint: disable=import-outside-toplevel
+    from benchmarks import memdb  # pylint: disable=import-outside-toplevel
+
+    cache_dir = tempfile.mkdtemp(prefix="bench-jinja-")
+    context = dashboard_context(rows, rng_seed)
+
+    def fresh_app(fragments):
+        return app_module.create_app({
+            "REPOSITORY": memdb.MemoryRepository(),
+            "SIGNATURE_STORE": "local",
+            "SIGNATURE_DIR": cache_dir,
+            "TEMPLATE_CACHE_DIR": cache_dir,
+            "FRAGMENT_CACHE_SIZE": 4 * rows if fragments else 0,
+        })
+
+    def render(app):
+        with app.test_request_context():
+            app.jinja_env.get_template("home.html").render(**context)
+
+    def first_render():
+        render(fresh_app(fragments=False))
+
+    try:
+        cold = _time(lambda: (shutil.rmtree(cache_dir, ignore_errors=True), first_render()), repeat)
+        first_render()  # populate the bytecode cache
+        bytecode = _time(first_render, repeat)
+
+        plain = fresh_app(fragments=False)
+        render(plain)
+        uncached = _time(lambda: render(plain), repeat)
+
+        cached = fresh_app(fragments=True)
+        render(cached)
+        fragments = _time(lambda: render(cached), repeat)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return {
+        "rows": rows,
+        "cold_ms": round(cold, 3),
+        "bytecode_ms": round(bytecode, 3),
+        "uncached_ms": round(uncached, 3),
+        "fragments_ms": round(fragments, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+
+    result = measure(args.rows, args.repeat, args.seed)
+    for stage in ("cold", "bytecode", "uncached", "fragments"):
+        print(f"{stage:<12}{result[stage + '_ms']:>10.2f} ms")
+    print(f"fragment speed-up: {result['uncached_ms'] / result['fragments_ms']:.1f}x")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+run.py
+
+Concurrent route benchmark for the consent app.
+
+Seeds an in-process stand-in (memdb) or a real MongoDB database, then drives
+the routes with a weighted mix from several threads, each holding its own
+logged-in test client. Per-route throughput and p50/p95/p99 latency are
+printed and written as JSON so two commits can be compared:
+
+    python -m benchmarks.run --agreements 5000 --duration 20 --out new.json
+    python -m benchmarks.run --compare old.json new.json
+
+Run from the api/ directory.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+
+from benchmarks import memdb, seed
+from passwords import DEFAULT_METHOD
+
+# relative frequency of each scenario in the mix
+DEFAULT_MIX = {
+    "home": 40,
+    "view_agreement": 20,
+    "search_agreements": 15,
+    "respond_agreement": 10,
+    "respond_batch": 3,
+    "create_agreement": 5,
+    "login": 10,
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, errors, elapsed):
+    """Turn raw per-route latencies (seconds) into the reported statistics."""
+    routes = {}
+    for route in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(route, []))
+        count = len(values)
+        routes[route] = {
+            "count": count,
+            "errors": errors.get(route, 0),
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return routes
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    """Seeded data plus the lookups scenarios need to pick valid targets."""
+
+    def __init__(self, app, repository, usernames):
+        self.app = app
+        self.users = list(repository.users.find({}, {"username": 1}))
+        self.by_user = defaultdict(lambda: {"sent": [], "received": []})
+        for agr in repository.agreements.find({}, {"party1.user_id": 1, "party2.user_id": 1}):
+            self.by_user[agr["party1"]["user_id"]]["sent"].append(str(agr["_id"]))
+            self.by_user[agr["party2"]["user_id"]]["received"].append(str(agr["_id"]))
+        self.usernames = usernames
+
+    def client_for(self, user):
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = str(user["_id"])
+        return client
+
+
+def _scenario(name, workload, rng, user, client, record):
+    """Run one scenario, recording each HTTP call under its route name."""
+    def call(route, method, url, **kwargs):
+        start = time.perf_counter()
+        resp = getattr(client, method)(url, **kwargs)
+        record(route, time.perf_counter() - start, resp.status_code >= 500)
+        return resp
+
+    mine = workload.by_user[user["_id"]]
+    if name == "home":
+        call("home", "get", "/")
+    elif name == "view_agreement":
+        ids = mine["sent"] + mine["received"]
+        if ids:
+            call("view_agreement", "get", f"/agreements/{rng.choice(ids)}")
+    elif name == "search_agreements":
+        word = rng.choice(seed.WORDS)
+        call("search_agreements", "get", "/agreements/search",
+             query_string={"keyword": word[:rng.randint(2, len(word))]})
+    elif name == "respond_agreement":
+        if mine["received"]:
+            call("respond_agreement", "post", f"/agreements/{rng.choice(mine['received'])}/respond",
+                 data={"response": rng.choice(["agreed", "rejected"])})
+    elif name == "respond_batch":
+        if mine["received"]:
+            ids = rng.sample(mine["received"], min(10, len(mine["received"])))
+            call("respond_batch", "post", "/agreements/respond",
+                 json={"ids": ids, "response": rng.choice(["agreed", "rejected"])})
+    elif name == "create_agreement":
+        other = rng.choice(workload.users)
+        start = time.perf_counter()
+        call("step1", "post", "/agreements/new/step1",
+             data={"title": "Benchmark agreement", "party2_username": other["username"]})
+        call("step2", "post", "/agreements/new/step2", data={
+            "sexual_content": "benchmark", "contraception": "yes",
+            "std_check": "no", "record_allowed": "no"})
+        call("signature_page", "post", "/agreements/new/signature",
+             data={"signature_strokes": seed.signature_strokes(rng)})
+        record("create_agreement", time.perf_counter() - start, False)
+    elif name == "login":
+        anonymous = workload.app.test_client()
+        start = time.perf_counter()
+        resp = anonymous.post("/auth/login", data={
+            "username_or_email": user["username"], "password": seed.PASSWORD})
+        record("login", time.perf_counter() - start, resp.status_code >= 500)
+
+
+def drive(workload, concurrency=4, duration=10.0, mix=None, rng_seed=7):
+    """Run the weighted mix from concurrency threads for duration seconds."""
+    mix = mix or DEFAULT_MIX
+    names, weights = zip(*mix.items())
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def record(route, seconds, failed):
+        with lock:
+            samples[route].append(seconds)
+            if failed:
+                errors[route] += 1
+
+    def worker(index):
+        rng = random.Random(rng_seed + index)
+        user = rng.choice(workload.users)
+        client = workload.client_for(user)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            _scenario(name, workload, rng, user, client, record)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, errors, time.perf_counter() - started)
+
+
+def build(args):
+    """Create the repository, app and seeded workload described by args."""
+    # imported late so `--compare` works without the app's dependencies
+    import app as app_module  # pylint: disable=import-outside-toplevel
+    from migrations import run_migrations  # pylint: disable=import-outside-toplevel
+    from repository import Repository  # pylint: disable=import-outside-toplevel
+
+    overrides = {"PASSWORD_HASH_METHOD": args.hash_method}
+    if args.backend == "memory":
+        repository = memdb.MemoryRepository()
+        overrides.update(SIGNATURE_STORE="local", SIGNATURE_DIR=tempfile.mkdtemp(prefix="bench-blobs-"))
+    else:
+        if args.db_name == "consent_data":
+            sys.exit("refusing to benchmark against the production database name")
+        repository = Repository(args.mongo_uri, args.db_name)
+        repository.client.drop_database(args.db_name)
+        overrides.update(SIGNATURE_STORE="gridfs")
+    overrides["REPOSITORY"] = repository
+    app = app_module.create_app(overrides)
+    run_migrations(repository.db, log=lambda msg: None)
+
+    usernames = seed.seed(
+        repository, app.extensions["signature_store"],
+        generate_password_hash(seed.PASSWORD, method=args.hash_method),
+        users=args.users, agreements=args.agreements,
+        signature_bytes=args.signature_bytes, rng_seed=args.seed,
+    )
+    return Workload(app, repository, usernames)
+
+
+def compare(old, new, threshold=0.2):
+    """Print p95 changes between two result files; return regressed routes."""
+    regressed = []
+    print(f"{'route':<20}{'old p95':>12}{'new p95':>12}{'change':>10}")
+    for route, stats in sorted(new["routes"].items()):
+        before = old["routes"].get(route)
+        if not before or not before["p95_ms"]:
+            print(f"{route:<20}{'-':>12}{stats['p95_ms']:>12.2f}{'new':>10}")
+            continue
+        change = stats["p95_ms"] / before["p95_ms"] - 1
+        print(f"{route:<20}{before['p95_ms']:>12.2f}{stats['p95_ms']:>12.2f}{change:>+10.1%}")
+        if change > threshold:
+            regressed.append(route)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="consent_bench")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--agreements", type=int, default=2_000)
+    parser.add_argument("--signature-bytes", type=int, default=12_000)
+    parser.add_argument("--hash-method", default=DEFAULT_METHOD)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p95 growth that counts as a regression in --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            regressed = compare(json.load(f_old), json.load(f_new), args.threshold)
+        return 1 if regressed else 0
+
+    workload = build(args)
+    routes = drive(workload, args.concurrency, args.duration, rng_seed=args.seed)
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "backend": args.backend,
+            "users": args.users,
+            "agreements": args.agreements,
+            "signature_bytes": args.signature_bytes,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        "routes": routes,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{'route':<20}{'count':>8}{'err':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for route, s in routes.items():
+        print(f"{route:<20}{s['count']:>8}{s['errors']:>6}{s['throughput_rps']:>10.1f}"
+              f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+    print(f"results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+seed.py
+
+Reproducible synthetic users and agreements for benchmarks.
+
+Volumes, the random seed and the signature size distribution are all
+parameters, so two runs with the same arguments produce the same data set.
+Every agreement gets its own signature blob (random PNG-framed bytes around
+the size a 300x150 canvas export usually has) stored through the app's blob
+store, exactly as signature_page() would. The bulk inserts bypass the
+per-user counters, so they are rebuilt from the agreements at the end.
+"""
+
+import base64
+import math
+import random
+from datetime import datetime, timedelta
+
+import search
+import strokes
+import userstats
+from signatures import store_signature
+
+PASSWORD = "benchmark-password"
+
+WORDS = (
+    "movie night weekend trip dinner party photo shoot beach house concert "
+    "study group road trip camping hike museum gallery brunch picnic"
+).split()
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+def signature_data_url(rng, mean_bytes=12_000, spread=4_000):
+    """A data URL around mean_bytes long, like canvas.toDataURL() output."""
+    size = max(512, int(rng.gauss(mean_bytes, spread)))
+    raw = PNG_MAGIC + rng.randbytes(size - len(PNG_MAGIC))
+    return "data:image/png;base64," + base64.b64encode(raw).decode()
+
+
+def signature_strokes(rng, points=300):
+    """A base64url stroke field like the one signature.html posts."""
+    phase, fx, fy = rng.random() * 6, rng.uniform(10, 25), rng.uniform(5, 12)
+    line = [(int(150 + 120 * math.sin(phase + i / fx)), int(75 + 50 * math.sin(i / fy)))
+            for i in range(points)]
+    data = strokes.encode(300, 150, [line])
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def seed(repository, store, password_hash, users=100, agreements=2_000,
+         agreed_ratio=0.5, rejected_ratio=0.1, signature_bytes=12_000, rng_seed=42):
+    """
+    Insert users and agreements; return the seeded usernames.
+
+    password_hash is computed once by the caller and shared by every user so
+    seeding does not spend minutes in the KDF.
+    """
+    rng = random.Random(rng_seed)
+    start = datetime(2025, 1, 1)
+
+    user_docs = []
+    for i in range(users):
+        user_docs.append({
+            "username": f"user{i:05d}",
+            "email": f"user{i:05d}@example.com",
+            "password_hash": password_hash,
+            "created_at": start,
+        })
+    repository.users.insert_many(user_docs)
+
+    batch = []
+    for i in range(agreements):
+        party1, party2 = rng.sample(user_docs, 2)
+        roll = rng.random()
+        if roll < agreed_ratio:
+            status = "agreed"
+        elif roll < agreed_ratio + rejected_ratio:
+            status = "rejected"
+        else:
+            status = "pending"
+        created_at = start + timedelta(minutes=i)
+        doc = {
+            "title": " ".join(rng.sample(WORDS, 3)).title(),
+            "party1": {"user_id": party1["_id"], "name": party1["username"]},
+            "party2": {"user_id": party2["_id"], "name": party2["username"]},
+            "content": {
+                "sexual_content": " ".join(rng.sample(WORDS, 8)),
+                "contraception": rng.choice(["yes", "no"]),
+                "std_check": rng.choice(["yes", "no"]),
+                "record_allowed": rng.choice(["yes", "no"]),
+            },
+            "signature_ref": store_signature(store, signature_data_url(rng, signature_bytes)),
+            "created_at": created_at,
+            "response_status": status,
+            "response_date": created_at + timedelta(hours=1) if status != "pending" else None,
+        }
+        doc.update(search.index_fields(doc))
+        batch.append(doc)
+        if len(batch) >= 500:
+            repository.agreements.insert_many(batch)
+            batch = []
+    if batch:
+        repository.agreements.insert_many(batch)
+    # migrations ran on an empty database; the dashboard reads these counters
+    userstats.rebuild(repository.agreements, repository.collection(userstats.STATS_COLL))
+    return [u["username"] for u in user_docs]
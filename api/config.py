@@ -0,0 +1,98 @@
+"""
+config.py
+
+Settings for create_app(), read from the environment.
+
+Every key can be overridden by the mapping passed to create_app(); tests use
+that to inject a fake REPOSITORY or SIGNATURE_STORE instead of patching
+module globals.
+"""
+
+import os
+
+
+def _int(environ, key, default):
+    return int(environ.get(key, default))
+
+
+def from_env(environ=None):
+    """Return the application settings derived from environment variables."""
+    environ = os.environ if environ is None else environ
+    hash_queue = environ.get("HASH_QUEUE")
+    return {
+        "SECRET_KEY": environ.get("FLASK_SECRET_KEY", "some-secret-key"),
+
+        # MongoDB client; nothing connects until the first query
+        "MONGO_URI": environ.get("MONGO_URI", "mongodb://localhost:27017"),
+        "MONGO_DB_NAME": environ.get("MONGO_DB_NAME", "consent_data"),
+        "MONGO_MAX_POOL_SIZE": _int(environ, "MONGO_MAX_POOL_SIZE", "100"),
+        "MONGO_MIN_POOL_SIZE": _int(environ, "MONGO_MIN_POOL_SIZE", "0"),
+        "MONGO_MAX_IDLE_TIME_MS": _int(environ, "MONGO_MAX_IDLE_TIME_MS", "300000"),
+        "MONGO_CONNECT_TIMEOUT_MS": _int(environ, "MONGO_CONNECT_TIMEOUT_MS", "5000"),
+        "MONGO_SERVER_SELECTION_TIMEOUT_MS": _int(environ, "MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"),
+        "MONGO_SOCKET_TIMEOUT_MS": _int(environ, "MONGO_SOCKET_TIMEOUT_MS", "20000"),
+        # listing/search/export reads: primary, secondaryPreferred, nearest, ...
+        "MONGO_READ_PREFERENCE": environ.get("MONGO_READ_PREFERENCE", "primary"),
+        # secondaries further behind are not read from; -1 = no bound (the server minimum is 90)
+        "MONGO_MAX_STALENESS_SECONDS": _int(environ, "MONGO_MAX_STALENESS_SECONDS", "90"),
+        # write concern for agreements and users; sessions and audit events use w=1
+        "MONGO_CRITICAL_WRITE_CONCERN": environ.get("MONGO_CRITICAL_WRITE_CONCERN", "majority"),
+        "MONGO_WRITE_TIMEOUT_MS": _int(environ, "MONGO_WRITE_TIMEOUT_MS", "5000"),
+        "AUTO_MIGRATE": environ.get("AUTO_MIGRATE", "1") == "1",
+
+        "PAGE_SIZE": _int(environ, "PAGE_SIZE", "20"),
+
+        "SIGNATURE_STORE": environ.get("SIGNATURE_STORE", "gridfs"),
+        "SIGNATURE_DIR": environ.get("SIGNATURE_DIR", "signature_blobs"),
+        # rendered PNG/SVG images of stroke signatures kept per worker
+        "SIGNATURE_RENDER_CACHE_BYTES": _int(environ, "SIGNATURE_RENDER_CACHE_BYTES", str(8 * 1024 * 1024)),
+
+        "PASSWORD_HASH_METHOD": environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1"),
+        "HASH_WORKERS": _int(environ, "HASH_WORKERS", "0"),
+        "HASH_QUEUE": int(hash_queue) if hash_queue is not None else None,
+        "HASH_TIMEOUT": float(environ.get("HASH_TIMEOUT", "30")),
+
+        "USER_CACHE_TTL": float(environ.get("USER_CACHE_TTL", "0")),
+        "USER_CACHE_SIZE": _int(environ, "USER_CACHE_SIZE", "1024"),
+
+        # compiled templates survive restarts here; "" = a per-user temp dir
+        "TEMPLATE_CACHE_DIR": environ.get("TEMPLATE_CACHE_DIR", ""),
+        # rendered agreement rows kept per worker; 0 disables fragment caching
+        "FRAGMENT_CACHE_SIZE": _int(environ, "FRAGMENT_CACHE_SIZE", "10000"),
+
+        # where sessions live: mongo, memory (single process) or cookie
+        "SESSION_BACKEND": environ.get("SESSION_BACKEND", "mongo"),
+        # idle sessions (and unfinished wizard drafts) expire after this long
+        "SESSION_LIFETIME_SECONDS": _int(environ, "SESSION_LIFETIME_SECONDS", str(7 * 24 * 3600)),
+        "SESSION_MEMORY_SIZE": _int(environ, "SESSION_MEMORY_SIZE", "10000"),
+
+        # audit events wait here for the background writer; 0 disables auditing
+        "AUDIT_QUEUE_SIZE": _int(environ, "AUDIT_QUEUE_SIZE", "10000"),
+        "AUDIT_BATCH_SIZE": _int(environ, "AUDIT_BATCH_SIZE", "500"),
+        "AUDIT_FLUSH_SECONDS": float(environ.get("AUDIT_FLUSH_SECONDS", "1")),
+        # longest a request waits for queue space before the event is dropped
+        "AUDIT_BLOCK_MS": float(environ.get("AUDIT_BLOCK_MS", "5")),
+
+        # agreements answered longer ago than this move to agreements_archive
+        "ARCHIVE_AFTER_DAYS": _int(environ, "ARCHIVE_AFTER_DAYS", "180"),
+
+        # how often /users/suggest looks for users registered by other workers
+        "SUGGEST_REFRESH_SECONDS": float(environ.get("SUGGEST_REFRESH_SECONDS", "300")),
+
+        # /agreements/events source: auto, changestream, local or off
+        "LIVE_UPDATES": environ.get("LIVE_UPDATES", "auto"),
+        "LIVE_QUEUE_SIZE": _int(environ, "LIVE_QUEUE_SIZE", "100"),
+        "SSE_HEARTBEAT_SECONDS": float(environ.get("SSE_HEARTBEAT_SECONDS", "15")),
+        "SSE_MAX_SECONDS": float(environ.get("SSE_MAX_SECONDS", "300")),
+        # open streams per worker; the rest of WEB_THREADS stays free for page requests
+        "SSE_MAX_STREAMS": _int(environ, "SSE_MAX_STREAMS",
+                                str(max(1, _int(environ, "WEB_THREADS", "4") // 4))),
+        # how long a browser turned away waits before reconnecting
+        "SSE_RETRY_SECONDS": _int(environ, "SSE_RETRY_SECONDS", "30"),
+
+        # requests slower than SLOW_REQUEST_MS are logged at this sample rate
+        "SLOW_REQUEST_MS": float(environ.get("SLOW_REQUEST_MS", "500")),
+        "SLOW_REQUEST_SAMPLE": float(environ.get("SLOW_REQUEST_SAMPLE", "0.1")),
+        # shared directory for per-worker snapshots; empty = this process only
+        "METRICS_DIR": environ.get("METRICS_DIR", ""),
+    }
@@ -0,0 +1,94 @@
+"""
+dashboard.py
+
+Data access for the home() dashboard.
+
+All four buckets (sent/received x pending/agreed) are fetched in a single
+aggregation round trip. Each bucket is its own indexed branch, combined with
+$unionWith, that projects only the fields home.html renders and pages with a
+(created_at, _id) keyset cursor, so neither page one nor page fifty grows
+with a user's history. The branches are served by the
+(partyN.user_id, response_status, created_at, _id) indexes: the status is an
+equality (or a short $in) ahead of the sort keys, so the other bucket's rows
+are never examined.
+"""
+
+from pagination import decode_cursor, keyset_match, sort_spec, split_page
+
+# Fields home.html actually renders (plus created_at for the cursor and
+# revision for the row cache key).
+DASHBOARD_FIELDS = {
+    "title": 1,
+    "party1.name": 1,
+    "party2.name": 1,
+    "response_status": 1,
+    "response_date": 1,
+    "created_at": 1,
+    "revision": 1,
+}
+
+BUCKETS = ("sent_pending", "sent_agreed", "recv_pending", "recv_agreed")
+
+# every status that is not agreed; None also matches a missing response_status
+NOT_AGREED = ["pending", "rejected", None]
+
+
+def bucket_match(bucket, user_id):
+    """Return the $match stage body selecting one dashboard bucket."""
+    party = "party1.user_id" if bucket.startswith("sent") else "party2.user_id"
+    if bucket.endswith("agreed"):
+        status = "agreed"
+    else:
+        # missing response_status counts as pending, like the old code did;
+        # $in (not $ne) keeps the status bounds tight in the index
+        status = {"$in": NOT_AGREED}
+    return {party: user_id, "response_status": status}
+
+
+def page_cursors(args):
+    """Decode the per-bucket cursor tokens from the query string."""
+    return {bucket: decode_cursor(args.get(bucket)) for bucket in BUCKETS}
+
+
+def bucket_pipeline(bucket, user_id, after, page_size):
+    """One bucket's page: index-backed match, sort and limit."""
+    match = bucket_match(bucket, user_id)
+    if after:
+        match = {"$and": [match, keyset_match(after)]}
+    return [
+        {"$match": match},
+        {"$sort": sort_spec()},
+        # one extra row tells us whether there is a next page
+        {"$limit": page_size + 1},
+        {"$project": dict(DASHBOARD_FIELDS, bucket={"$literal": bucket})},
+    ]
+
+
+def dashboard_pipeline(coll_name, user_id, cursors, page_size):
+    """Build the single-round-trip aggregation for a user's dashboard."""
+    first, *rest = BUCKETS
+    pipeline = bucket_pipeline(first, user_id, cursors.get(first), page_size)
+    for bucket in rest:
+        pipeline.append({"$unionWith": {
+            "coll": coll_name,
+            "pipeline": bucket_pipeline(bucket, user_id, cursors.get(bucket), page_size),
+        }})
+    return pipeline
+
+
+def fetch_dashboard(agreements_coll, user_id, cursors, page_size):
+    """
+    Run the dashboard aggregation.
+
+    Returns (buckets, next_cursors): both dicts keyed by bucket name, the
+    first holding at most page_size agreements, the second the token for
+    the bucket's next page or None.
+    """
+    pipeline = dashboard_pipeline(agreements_coll.name, user_id, cursors, page_size)
+    grouped = {bucket: [] for bucket in BUCKETS}
+    for row in agreements_coll.aggregate(pipeline):
+        grouped[row.pop("bucket")].append(row)
+    buckets, next_cursors = {}, {}
+    for bucket in BUCKETS:
+        buckets[bucket], next_cursors[bucket] = split_page(grouped[bucket], page_size)
+    return buckets, next_cursors
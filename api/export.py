@@ -0,0 +1,143 @@
+"""
+export.py
+
+Streaming export of a user's agreements as CSV or NDJSON.
+
+Rows come from batched server-side cursors sorted by (created_at, _id), one
+on agreements and one on agreements_archive, merged as they stream and
+serialised one at a time by a generator, so memory stays flat however long
+the history is. Both party indexes (party{1,2}_user_created_at_id)
+serve the $or query and MongoDB merges their sorted output. Signature images
+are never inlined: with signatures=1 each row carries the blob hash and the
+/signatures/<hash> URL that serves it.
+"""
+
+import csv
+import heapq
+import io
+import json
+from datetime import datetime, timedelta
+
+EXPORT_BATCH = 200
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+STATUSES = ("pending", "agreed", "rejected")
+
+COLUMNS = (
+    "id", "title", "role", "party1", "party2", "status", "created_at", "response_date",
+    "sexual_content", "contraception", "std_check", "record_allowed",
+)
+SIGNATURE_COLUMNS = ("signature_hash", "signature_url")
+
+# search fields and legacy inline signatures stay on the server
+_PROJECTION = {"search_terms": 0, "search_words": 0, "signature": 0}
+
+
+class InvalidExport(ValueError):
+    """Raised for an unknown format or status, or an unparseable date."""
+
+
+def _date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise InvalidExport(f"{name} must be a date like 2025-01-31") from None
+
+
+def export_query(user_id, start=None, end=None, status=None):
+    """
+    Filter for agreements user_id is party to.
+
+    start and end are YYYY-MM-DD strings; end is inclusive. status "pending"
+    also matches old agreements that never had a response_status.
+    """
+    query = {"$or": [{"party1.user_id": user_id}, {"party2.user_id": user_id}]}
+    created = {}
+    if start:
+        created["$gte"] = _date(start, "from")
+    if end:
+        created["$lt"] = _date(end, "to") + timedelta(days=1)
+    if created:
+        query["created_at"] = created
+    if status:
+        if status not in STATUSES:
+            raise InvalidExport(f"status must be one of {', '.join(STATUSES)}")
+        query["response_status"] = status if status != "pending" else {"$nin": ["agreed", "rejected"]}
+    return query
+
+
+def iter_agreements(agreements_coll, query, batch_size=EXPORT_BATCH):
+    """Oldest-first cursor fetching batch_size documents per round trip."""
+    return agreements_coll.find(query, _PROJECTION).sort(
+        [("created_at", 1), ("_id", 1)]
+    ).batch_size(batch_size)
+
+
+def _order(agr):
+    return (agr.get("created_at") or datetime.min, agr["_id"])
+
+
+def iter_merged(collections, query, batch_size=EXPORT_BATCH):
+    """iter_agreements over several collections (hot and archive) as one oldest-first stream."""
+    return heapq.merge(*(iter_agreements(c, query, batch_size) for c in collections), key=_order)
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_row(agr, user_id, signature_url=None):
+    """Flatten an agreement into an export record (dict in COLUMNS order)."""
+    content = agr.get("content") or {}
+    row = {
+        "id": str(agr["_id"]),
+        "title": agr.get("title"),
+        "role": "sent" if agr.get("party1", {}).get("user_id") == user_id else "received",
+        "party1": agr.get("party1", {}).get("name"),
+        "party2": agr.get("party2", {}).get("name"),
+        "status": agr.get("response_status") or "pending",
+        "created_at": _iso(agr.get("created_at")),
+        "response_date": _iso(agr.get("response_date")),
+        "sexual_content": content.get("sexual_content"),
+        "contraception": content.get("contraception"),
+        "std_check": content.get("std_check"),
+        "record_allowed": content.get("record_allowed"),
+    }
+    if signature_url is not None:
+        sig_hash = (agr.get("signature_ref") or {}).get("hash")
+        row["signature_hash"] = sig_hash
+        row["signature_url"] = signature_url(sig_hash) if sig_hash else None
+    return row
+
+
+def iter_csv(docs, user_id, signature_url=None):
+    """Yield a CSV header line and then one line per agreement."""
+    columns = COLUMNS + (SIGNATURE_COLUMNS if signature_url else ())
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns)
+    writer.writeheader()
+    yield buf.getvalue()
+    for agr in docs:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(to_row(agr, user_id, signature_url))
+        yield buf.getvalue()
+
+
+def iter_ndjson(docs, user_id, signature_url=None):
+    """Yield one JSON object per line."""
+    for agr in docs:
+        yield json.dumps(to_row(agr, user_id, signature_url)) + "\n"
+
+
+def stream(fmt, docs, user_id, signature_url=None):
+    """The line generator for fmt; raises InvalidExport before any output."""
+    if fmt not in FORMATS:
+        raise InvalidExport(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "csv":
+        return iter_csv(docs, user_id, signature_url)
+    return iter_ndjson(docs, user_id, signature_url)
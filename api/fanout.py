@@ -0,0 +1,148 @@
+"""
+fanout.py
+
+Sending one agreement to many recipients.
+
+The wizard's step 1 accepts a list of usernames (typed or as a CSV upload)
+instead of a single party2. Recipients are resolved with one $in query and
+parked in a draft job document, so the cookie session only carries the
+job id through steps 2 and 3. On signing, all agreements are written with
+one insert_many; they share the signature blob (signatures are
+content-addressed) and the search fields, which depend only on the title
+and sender. The job document keeps the per-recipient outcome for the report;
+drafts the wizard never finishes expire after DRAFT_TTL_SECONDS.
+"""
+
+import csv
+import io
+import re
+from datetime import datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+import search
+import userstats
+
+JOBS_COLL = "fanout_jobs"
+
+MAX_RECIPIENTS = 500
+MAX_CSV_BYTES = 64 * 1024
+# abandoned wizards: a TTL index (migration 14) removes drafts this old
+DRAFT_TTL_SECONDS = 24 * 3600
+
+_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
+class InvalidRecipients(ValueError):
+    """Raised when the recipient list is empty or too long."""
+
+
+def parse_recipients(text="", csv_bytes=b""):
+    """
+    Usernames from free text (comma, semicolon or whitespace separated) and
+    from a CSV file (a "username" column if there is one, else the first
+    column), de-duplicated in order.
+    """
+    names = [n for n in _SPLIT_RE.split(text or "") if n]
+    if len(csv_bytes or b"") > MAX_CSV_BYTES:
+        raise InvalidRecipients(f"CSV uploads are limited to {MAX_CSV_BYTES // 1024} KB.")
+    if csv_bytes:
+        rows = list(csv.reader(io.StringIO(csv_bytes.decode("utf-8-sig", errors="replace"))))
+        column = 0
+        if rows:
+            header = [h.strip().lower() for h in rows[0]]
+            if "username" in header:
+                column = header.index("username")
+                rows = rows[1:]
+        names += [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+    names = list(dict.fromkeys(names))
+    if not names:
+        raise InvalidRecipients("Enter at least one recipient username.")
+    if len(names) > MAX_RECIPIENTS:
+        raise InvalidRecipients(f"At most {MAX_RECIPIENTS} recipients per agreement.")
+    return names
+
+
+def create_job(jobs_coll, users_coll, owner_id, usernames, now=None):
+    """Resolve usernames with one query and store a draft job; return its id."""
+    found = {
+        u["username"]: u["_id"]
+        for u in users_coll.find({"username": {"$in": usernames}}, {"username": 1})
+    }
+    recipients = []
+    for name in usernames:
+        if name not in found:
+            status = "unknown_user"
+        elif found[name] == owner_id:
+            status = "self"
+        else:
+            status = "pending"
+        recipients.append({"username": name, "user_id": found.get(name), "status": status})
+    return jobs_coll.insert_one({
+        "owner_id": owner_id,
+        "status": "draft",
+        "created_at": now or datetime.utcnow(),
+        "recipients": recipients,
+    }).inserted_id
+
+
+def load_job(jobs_coll, job_id, owner_id):
+    """The job if owner_id created it, else None."""
+    try:
+        oid = ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+    return jobs_coll.find_one({"_id": oid, "owner_id": owner_id})
+
+
+def run_job(jobs_coll, agreements_coll, job, template, now=None, stats_coll=None):
+    """
+    Insert one agreement per resolved recipient of a draft job.
+
+    template is the wizard's agreement (title, party1, content,
+    signature_ref). Returns the finished job's recipients list, or None if
+    the job was not a draft (already sent, e.g. by a double submit). With
+    stats_coll, the created agreements are counted for both parties.
+    """
+    claimed = jobs_coll.update_one({"_id": job["_id"], "status": "draft"},
+                                   {"$set": {"status": "running"}})
+    if not claimed.modified_count:
+        return None
+    now = now or datetime.utcnow()
+    shared = dict(template, created_at=now, response_status="pending",
+                  response_date=None, fanout_id=job["_id"])
+    shared.update(search.index_fields(shared))
+
+    recipients = job["recipients"]
+    targets = [r for r in recipients if r["status"] == "pending"]
+    docs = [
+        dict(shared, _id=ObjectId(), party2={"user_id": r["user_id"], "name": r["username"]})
+        for r in targets
+    ]
+    failed = set()
+    if docs:
+        try:
+            agreements_coll.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+    changes = []
+    for i, (recipient, doc) in enumerate(zip(targets, docs)):
+        if i in failed:
+            recipient["status"] = "failed"
+        else:
+            recipient["status"] = "created"
+            recipient["agreement_id"] = doc["_id"]
+            changes += userstats.created(doc)
+    if stats_coll is not None:
+        userstats.record(stats_coll, changes)
+
+    jobs_coll.update_one({"_id": job["_id"]}, {"$set": {
+        "status": "done",
+        "title": template.get("title"),
+        "finished_at": now,
+        "recipients": recipients,
+        "created": sum(1 for r in recipients if r["status"] == "created"),
+    }})
+    return recipients
@@ -0,0 +1,138 @@
+"""
+fragments.py
+
+Template fragment caching and compiled-template persistence.
+
+Dashboards and search results repeat the same markup for every agreement
+row. Wrapping a row in
+
+    {% cache agr._id, "sent_pending", agr.response_status, agr.revision %}
+      ...
+    {% endcache %}
+
+renders it once and reuses the HTML until one of the key parts changes.
+The first part is the invalidation tag: routes that write an agreement
+call FragmentCache.invalidate(agreement_id) to free its rows at once. The
+key already carries the status and revision, so a worker that missed the
+invalidation still never serves a stale row, it just holds it until LRU
+eviction.
+
+bytecode_cache() persists compiled templates on disk, so restarted or newly
+forked workers skip Jinja's parse/compile step.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, invalidated by tag."""
+
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            self._tags.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._forget(self._entries.popitem(last=False)[0])
+
+    def _forget(self, key):
+        keys = self._tags.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[key[0]]
+
+    def invalidate(self, *tags):
+        """Drop every fragment tagged with one of tags (agreement ids)."""
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(str(tag), ()):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache tag, key... %} ... {% endcache %} template tag."""
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        # None renders every fragment, so templates work without a cache
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        call = self.call_method("_render", [nodes.Const(parser.name), nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, template_name, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or not cache.enabled:
+            return caller()
+        # the template name keeps identical keys in different templates apart
+        key = (str(parts[0]), template_name) + tuple(str(p) for p in parts[1:])
+        html = cache.get(key)
+        if html is None:
+            html = Markup(caller())
+            cache.set(key, html)
+        return html
+
+
+def bytecode_cache(directory):
+    """Compiled-template cache in directory; "" uses Jinja's per-user temp dir."""
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory or None)
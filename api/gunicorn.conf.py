@@ -0,0 +1,83 @@
+"""
+gunicorn.conf.py
+
+Production serving settings: pre-fork gthread workers sized from the
+environment.
+
+preload_app stays off so every worker imports app.py itself after fork(),
+and the app's Repository creates its MongoClient lazily per process anyway
+(pymongo clients are not fork-safe). Send SIGHUP to the master for a
+graceful reload: new workers are started with fresh config/code and old
+ones finish their in-flight requests.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# one worker per core by default, each with a small thread pool
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_class = "gthread"
+
+preload_app = False
+
+timeout = int(os.getenv("WEB_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("WEB_KEEPALIVE", "5"))
+
+# recycle workers now and then so slow leaks cannot accumulate
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "500"))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """Apply migrations once in the master and refuse to boot without indexes."""
+    # imported here so reading this file never pulls in the app's modules
+    # pylint: disable=import-outside-toplevel
+    import config
+    from migrations import run_migrations, verify_indexes
+    from repository import Repository
+
+    # workers write metric snapshots here so /metrics can sum all of them;
+    # set before fork so every worker inherits it
+    metrics_dir = os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="consent-metrics-"))
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".json"):
+            os.remove(os.path.join(metrics_dir, name))
+
+    settings = config.from_env()
+    repository = Repository.from_config(settings)
+    try:
+        if settings["AUTO_MIGRATE"]:
+            run_migrations(repository.db, log=server.log.info)
+        verify_indexes(repository.db)
+    finally:
+        # closed before fork so no worker inherits its sockets
+        repository.close()
+
+
+def post_fork(server, worker):
+    server.log.info("worker %s booted (threads=%s)", worker.pid, threads)
+
+
+def post_worker_init(worker):
+    """Warm the worker's in-memory indexes once its app is loaded, not in a request."""
+    # pylint: disable=import-outside-toplevel
+    from app import warm_up
+
+    warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    """Keep a recycled worker's counters in the /metrics totals and drop its gauges."""
+    # pylint: disable=import-outside-toplevel
+    from metrics import mark_process_dead
+
+    if os.environ.get("METRICS_DIR"):
+        mark_process_dead(os.environ["METRICS_DIR"], worker.pid)
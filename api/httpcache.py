@@ -0,0 +1,101 @@
+"""
+httpcache.py
+
+HTTP caching helpers: validators for agreement pages and fingerprinted
+static files.
+
+An agreement page only changes when the agreement does (a response, a new
+revision), when the viewer changes, or when the templates/static files are
+redeployed. agreement_validators() folds exactly those into an ETag and a
+Last-Modified date, so view_agreement() can answer a repeat visit with 304
+before rendering anything.
+
+Static URLs built with url_for("static", ...) get a ?v=<content hash>
+parameter; a request whose v matches the file's current hash is served with
+a one-year immutable Cache-Control, so browsers stop revalidating.
+"""
+
+import hashlib
+import os
+
+from flask import request
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+HASH_LEN = 12
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LEN]
+
+
+def tree_manifest(root):
+    """{relative posix path: content hash} for every file under root."""
+    manifest = {}
+    if not root or not os.path.isdir(root):
+        return manifest
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            manifest[os.path.relpath(path, root).replace(os.sep, "/")] = file_digest(path)
+    return manifest
+
+
+def manifest_digest(*manifests):
+    """One short hash standing for several manifests."""
+    h = hashlib.sha256()
+    for manifest in manifests:
+        for name in sorted(manifest):
+            h.update(f"{name}={manifest[name]};".encode())
+    return h.hexdigest()[:HASH_LEN]
+
+
+def last_modified(agr):
+    """Latest timestamp that can change the agreement page, or None."""
+    stamps = [t for t in (agr.get("created_at"), agr.get("response_date")) if t]
+    return max(stamps) if stamps else None
+
+
+def agreement_validators(agr, viewer_id, deploy_version=""):
+    """(etag, last_modified) for one viewer's page of one agreement version."""
+    parts = (
+        str(agr["_id"]),
+        str(agr.get("revision", 1)),
+        str(agr.get("response_status")),
+        str(agr.get("response_date")),
+        str((agr.get("signature_ref") or {}).get("hash")),
+        str(viewer_id),
+        deploy_version,
+    )
+    etag = hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+    return etag, last_modified(agr)
+
+
+def fingerprint_static(app):
+    """Add ?v=<hash> to static URLs and serve matching requests as immutable."""
+    manifest = tree_manifest(app.static_folder)
+    templates = tree_manifest(os.path.join(app.root_path, app.template_folder or "templates"))
+    app.extensions["static_manifest"] = manifest
+    # changes whenever a template or static file does, so pages revalidate
+    app.extensions["deploy_version"] = manifest_digest(manifest, templates)
+
+    @app.url_defaults
+    def _static_version(endpoint, values):
+        if endpoint == "static" and "v" not in values:
+            digest = manifest.get(values.get("filename", ""))
+            if digest:
+                values["v"] = digest
+
+    @app.after_request
+    def _static_cache_headers(response):
+        if request.endpoint == "static" and response.status_code in (200, 304):
+            digest = manifest.get(request.view_args.get("filename", ""))
+            if digest and request.args.get("v") == digest:
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+                response.cache_control.no_cache = None
+        return response
@@ -0,0 +1,256 @@
+"""
+livefeed.py
+
+Push agreement status changes to signed-in users over Server-Sent Events.
+
+Each process has one StatusFeed. Browsers connect to /agreements/events and
+get a Subscription: a small bounded queue registered under their user id.
+Events reach the queues from one of two sources:
+
+    changestream  one watcher thread per process follows a MongoDB change
+                  stream on agreements and publishes every status change,
+                  whichever worker or node wrote it (needs a replica set)
+    local         routes call notify() after writing; only subscribers in
+                  the same process hear it (single node, tests, memdb)
+
+LIVE_UPDATES=auto tries the change stream when the first client connects
+and falls back to local if the server cannot provide one. The watcher runs
+only while somebody is subscribed, so idle workers hold no extra cursor.
+
+Every open stream holds a worker thread, so a process accepts at most
+max_subscribers of them; subscribe() returns None beyond that and the route
+asks the browser to come back later.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+log = logging.getLogger("consent.livefeed")
+
+SOURCES = ("auto", "changestream", "local", "off")
+
+# only what an event needs comes back with each change
+_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace"]}},
+        {"operationType": "update", "updateDescription.updatedFields.response_status": {"$exists": True}},
+    ]}},
+    {"$project": {
+        "operationType": 1,
+        "fullDocument._id": 1,
+        "fullDocument.title": 1,
+        "fullDocument.response_status": 1,
+        "fullDocument.response_date": 1,
+        "fullDocument.revision": 1,
+        "fullDocument.party1.user_id": 1,
+        "fullDocument.party2.user_id": 1,
+    }},
+]
+
+EVENT_PROJECTION = {"title": 1, "response_status": 1, "response_date": 1, "revision": 1,
+                    "party1.user_id": 1, "party2.user_id": 1}
+
+
+def event_for(agr):
+    """(recipient user ids, JSON-ready event) for an agreement document."""
+    date = agr.get("response_date")
+    event = {
+        "id": str(agr["_id"]),
+        "title": agr.get("title"),
+        "status": agr.get("response_status") or "pending",
+        "response_date": date.isoformat() if isinstance(date, datetime) else date,
+        "revision": agr.get("revision", 1),
+    }
+    recipients = {str(agr[p]["user_id"]) for p in ("party1", "party2") if agr.get(p)}
+    return recipients, event
+
+
+def format_sse(event, name="status"):
+    return f"id: {event['id']}.{event['revision']}.{event['status']}\nevent: {name}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    """One connected client: a bounded queue of pending events."""
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def get(self, timeout):
+        """Next event, or None after timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StatusFeed:
+    """Per-process fan-out of status events to subscribed users."""
+
+    def __init__(self, source="auto", collection=None, queue_size=100, retry_seconds=2.0,
+                 max_subscribers=None):
+        if source not in SOURCES:
+            raise ValueError(f"LIVE_UPDATES must be one of {', '.join(SOURCES)}")
+        self.source = source
+        self.collection = collection  # callable returning the agreements collection
+        self.queue_size = queue_size
+        self.retry_seconds = retry_seconds
+        self.max_subscribers = max_subscribers  # None = unlimited
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watcher_pid = None
+        self._stream = None
+        self.published = 0
+        self.dropped = 0
+        self.refused = 0
+
+    @property
+    def enabled(self):
+        return self.source != "off"
+
+    @property
+    def watching(self):
+        return self._watcher is not None and self._watcher_pid == os.getpid() and self._watcher.is_alive()
+
+    # --- Subscribers ---
+    def subscribe(self, user_id):
+        """A new Subscription, or None when this process already serves max_subscribers."""
+        sub = Subscription(str(user_id), self.queue_size)
+        with self._lock:
+            open_streams = sum(len(subs) for subs in self._subscribers.values())
+            if self.max_subscribers is not None and open_streams >= self.max_subscribers:
+                self.refused += 1
+                return None
+            self._subscribers.setdefault(sub.user_id, set()).add(sub)
+        if self.source in ("auto", "changestream"):
+            self._ensure_watcher()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+            idle = not self._subscribers
+        if idle:
+            self._stop_watcher()
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, recipients, event):
+        """Queue event for every subscription of the recipient user ids."""
+        with self._lock:
+            targets = [sub for uid in recipients for sub in self._subscribers.get(str(uid), ())]
+        for sub in targets:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # a stalled client loses events rather than growing memory
+                sub.dropped += 1
+                self.dropped += 1
+        self.published += 1
+
+    def notify(self, *agreements):
+        """Called by routes after a write; publishes unless a change stream will."""
+        if self.source != "local" or not self.subscriber_count():
+            return
+        for agr in agreements:
+            self.publish(*event_for(agr))
+
+    def wants_notify(self):
+        """True when notify() would publish, so callers can skip loading documents."""
+        return self.source == "local" and bool(self.subscriber_count())
+
+    # --- Change stream watcher ---
+    def _open_stream(self, resume_after=None):
+        return self.collection().watch(_PIPELINE, full_document="updateLookup", resume_after=resume_after)
+
+    def _ensure_watcher(self):
+        with self._lock:
+            if self.watching or self.source == "local":
+                return
+            try:
+                # opened here so an unsupported server is detected synchronously
+                self._stream = self._open_stream()
+            except (OperationFailure, AttributeError, NotImplementedError) as e:
+                if self.source == "auto":
+                    log.warning("change streams unavailable (%s); live updates are process-local", e)
+                    self.source = "local"
+                    return
+                log.error("cannot open change stream: %s", e)
+                return
+            except PyMongoError as e:
+                # transient; the next subscriber tries again
+                log.warning("cannot open change stream: %s", e)
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(self._stream,),
+                                             name="status-feed", daemon=True)
+            self._watcher_pid = os.getpid()
+            self._watcher.start()
+
+    def _stop_watcher(self):
+        with self._lock:
+            stream, self._stream = self._stream, None
+            self._watcher = None
+        if stream is not None:
+            try:
+                stream.close()
+            except PyMongoError:
+                pass
+
+    def _watch(self, stream):
+        token = None
+        while stream is not None:
+            try:
+                for change in stream:
+                    token = change.get("_id")
+                    doc = change.get("fullDocument")
+                    if doc:
+                        self.publish(*event_for(doc))
+                return  # closed by _stop_watcher() or invalidated
+            except PyMongoError as e:
+                if self._stream is not stream:
+                    return
+                log.warning("change stream interrupted (%s); resuming", e)
+            stream = self._reopen(stream, token)
+
+    def _reopen(self, old, token):
+        """Resume after token once the server is back; None if stopped meanwhile."""
+        while True:
+            time.sleep(self.retry_seconds)
+            if self._stream is not old:
+                return None
+            try:
+                stream = self._open_stream(resume_after=token)
+            except PyMongoError as e:
+                log.warning("change stream resume failed (%s); retrying", e)
+                continue
+            with self._lock:
+                if self._stream is not old:
+                    stream.close()
+                    return None
+                self._stream = stream
+            return stream
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "watching": self.watching,
+            "subscribers": self.subscriber_count(),
+            "published": self.published,
+            "dropped": self.dropped,
+            "refused": self.refused,
+        }
@@ -0,0 +1,500 @@
+"""
+metrics.py
+
+Request and MongoDB instrumentation exported as Prometheus text.
+
+- timing hooks installed by instrument(app) record each request's total,
+  MongoDB and template-rendering time per route
+- CommandTimer, a pymongo CommandListener, records every command's
+  duration, collection and the number of documents in its cursor batch,
+  and charges it to the request that issued it; replies are never
+  re-encoded just to be measured
+- requests slower than SLOW_REQUEST_MS are logged (a sampled fraction) with
+  the shapes of the queries they ran
+- collectors registered with Metrics.collect() copy in-process service
+  counters (caches, queues) into the registry just before it is exported
+
+Observations are a bisect and a few additions under a lock. Under
+gunicorn each worker has its own registry; when METRICS_DIR is set, workers
+periodically write snapshots there and /metrics merges the live ones. When
+a worker exits, the master folds its counters and histograms into
+dead.json with mark_process_dead(), so totals survive worker recycling,
+and drops its gauges, which only describe a running process.
+"""
+
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import before_render_template, g, request, template_rendered
+from pymongo import monitoring
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# only the first commands of a request are kept for the slow log
+MAX_TRACED_COMMANDS = 50
+
+DUMP_INTERVAL = 1.0
+
+# counters and histograms of workers that have exited
+DEAD_SNAPSHOT = "dead.json"
+
+log = logging.getLogger("consent.metrics")
+slow_log = logging.getLogger("consent.slow_requests")
+
+_current_trace = ContextVar("request_trace", default=None)
+
+
+# --- Metric types ---
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: value for labels, value in self.values.items()}
+
+    def set(self, labels, value):
+        """Mirror a total kept elsewhere, e.g. a service's own hit count."""
+        with self._lock:
+            self.values[labels] = value
+
+    def merge(self, labels, value):
+        self.inc(labels, value)
+
+    def samples(self):
+        for labels, value in sorted(self.snapshot().items()):
+            yield self.name, self.labelnames, labels, value
+
+
+class Gauge(Counter):
+    """A value that goes up and down; workers' values are summed like counters."""
+
+    kind = "gauge"
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self.values.get(labels)
+            if row is None:
+                row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[slot] += 1
+            row[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(row) for labels, row in self.values.items()}
+
+    def merge(self, labels, row):
+        with self._lock:
+            mine = self.values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, value in enumerate(row):
+                mine[i] += value
+
+    def samples(self):
+        for labels, row in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", self.labelnames + ("le",), labels + (_fmt(bound),), cumulative
+            yield self.name + "_sum", self.labelnames, labels, row[-1]
+            yield self.name + "_count", self.labelnames, labels, cumulative
+
+
+def _fmt(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """The metrics of one process, renderable as Prometheus text."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, help_text, labelnames):
+        return self.metrics.setdefault(name, Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames):
+        return self.metrics.setdefault(name, Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames, buckets):
+        return self.metrics.setdefault(name, Histogram(name, help_text, labelnames, buckets))
+
+    def snapshot(self):
+        """JSON-serialisable copy of every metric's kind and values."""
+        return {
+            name: {"kind": metric.kind,
+                   "rows": [[list(labels), value] for labels, value in metric.snapshot().items()]}
+            for name, metric in self.metrics.items()
+        }
+
+    def merged_with(self, snapshots):
+        """A new Registry with the same metrics holding the sum of snapshots."""
+        total = Registry()
+        for name, metric in self.metrics.items():
+            if metric.kind == "histogram":
+                total.histogram(name, metric.help, metric.labelnames, metric.buckets)
+            elif metric.kind == "gauge":
+                total.gauge(name, metric.help, metric.labelnames)
+            else:
+                total.counter(name, metric.help, metric.labelnames)
+        for snapshot in snapshots:
+            for name, entry in snapshot.items():
+                if name in total.metrics:
+                    for labels, value in entry["rows"]:
+                        total.metrics[name].merge(tuple(labels), value)
+        return total
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labelnames, labels, value in metric.samples():
+                pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels))
+                lines.append(f"{name}{{{pairs}}} {_fmt(value)}" if pairs else f"{name} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Query shapes ---
+def query_shape(value):
+    """Replace literal values with "?" so queries group by structure, not data."""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, dict) for v in value):
+            return [query_shape(v) for v in value]
+        return "?"
+    return "?"
+
+
+def command_shape(command_name, command):
+    """The filter part of a command, shaped; None for commands without one."""
+    if command_name == "find":
+        return query_shape(command.get("filter", {}))
+    if command_name == "aggregate":
+        return query_shape(command.get("pipeline", []))
+    if command_name in ("update", "delete"):
+        key = "updates" if command_name == "update" else "deletes"
+        return [query_shape(op.get("q", {})) for op in command.get(key, [])[:3]]
+    if command_name in ("count", "distinct", "findAndModify"):
+        return query_shape(command.get("query", {}))
+    return None
+
+
+# --- Per-request trace ---
+class RequestTrace:
+    """Time spent by one request, filled in by the hooks and the listener."""
+
+    __slots__ = ("started", "mongo_seconds", "mongo_commands", "render_seconds",
+                 "render_started", "commands")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+        self.render_seconds = 0.0
+        self.render_started = None
+        # (command name, collection, seconds, documents returned, command document)
+        self.commands = []
+
+
+def _batch_size(reply):
+    """Documents in a find/aggregate/getMore reply; a len(), no re-encoding."""
+    cursor = reply.get("cursor") if isinstance(reply, dict) else None
+    if not isinstance(cursor, dict):
+        return 0
+    batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+    return len(batch) if isinstance(batch, list) else 0
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo listener feeding Metrics; pass it via event_listeners=[...]."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._pending = {}
+
+    def started(self, event):
+        command = event.command
+        target = command.get(event.command_name)
+        if not isinstance(target, str):
+            target = command.get("collection", "-")
+        self._pending[event.request_id] = (target, command, _current_trace.get())
+
+    def succeeded(self, event):
+        self._finish(event, _batch_size(event.reply), failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, reply_docs, failed):
+        target, command, trace = self._pending.pop(event.request_id, ("-", {}, None))
+        seconds = event.duration_micros / 1e6
+        self.metrics.observe_command(event.command_name, target, seconds, reply_docs, failed)
+        if trace is not None:
+            trace.mongo_seconds += seconds
+            trace.mongo_commands += 1
+            if len(trace.commands) < MAX_TRACED_COMMANDS:
+                trace.commands.append((event.command_name, target, seconds, reply_docs, command))
+
+
+class Metrics:
+    """The app's metric set, its Mongo listener and the slow-request log."""
+
+    def __init__(self, slow_request_ms=500, slow_sample=0.1, directory=None, rng=random.random):
+        self.registry = Registry()
+        self.slow_request_seconds = slow_request_ms / 1000.0
+        self.slow_sample = slow_sample
+        self.directory = directory or None
+        self._rng = rng
+        self._last_dump = 0.0
+        self._collectors = []
+        self.command_listener = CommandTimer(self)
+
+        labels = ("route", "method", "status")
+        self.request_seconds = self.registry.histogram(
+            "http_request_duration_seconds", "Time to produce a response.", labels, REQUEST_BUCKETS)
+        self.request_mongo_seconds = self.registry.histogram(
+            "http_request_mongo_seconds", "MongoDB time spent per request.", ("route",), REQUEST_BUCKETS)
+        self.request_render_seconds = self.registry.histogram(
+            "http_request_render_seconds", "Template rendering time per request.", ("route",), REQUEST_BUCKETS)
+        self.request_mongo_commands = self.registry.counter(
+            "http_request_mongo_commands_total", "MongoDB commands issued, by route.", ("route",))
+        self.slow_requests = self.registry.counter(
+            "http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("route",))
+        self.command_seconds = self.registry.histogram(
+            "mongo_command_duration_seconds", "MongoDB command round trip.",
+            ("command", "collection"), MONGO_BUCKETS)
+        self.command_reply_docs = self.registry.counter(
+            "mongo_command_reply_documents_total", "Documents returned in cursor batches.",
+            ("command", "collection"))
+        self.command_failures = self.registry.counter(
+            "mongo_command_failures_total", "MongoDB commands that failed.", ("command", "collection"))
+
+    @classmethod
+    def from_config(cls, config):
+        """Build Metrics from create_app() settings."""
+        return cls(
+            slow_request_ms=config["SLOW_REQUEST_MS"],
+            slow_sample=config["SLOW_REQUEST_SAMPLE"],
+            directory=config["METRICS_DIR"],
+        )
+
+    def collect(self, func):
+        """Call func(registry) before every export to refresh mirrored values."""
+        self._collectors.append(func)
+        return func
+
+    def _run_collectors(self):
+        for func in self._collectors:
+            try:
+                func(self.registry)
+            except Exception:  # pylint: disable=broad-except
+                # a broken collector must not take the whole scrape down
+                log.exception("metrics collector %r failed", func)
+
+    def observe_command(self, command, collection, seconds, reply_docs, failed=False):
+        labels = (command, collection)
+        self.command_seconds.observe(labels, seconds)
+        if reply_docs:
+            self.command_reply_docs.inc(labels, reply_docs)
+        if failed:
+            self.command_failures.inc(labels)
+
+    # request lifecycle, driven by the hooks in instrument()
+    def start_request(self):
+        trace = RequestTrace()
+        g.metrics_trace = trace
+        g.metrics_token = _current_trace.set(trace)
+        return trace
+
+    def finish_request(self, route, method, status):
+        trace = g.pop("metrics_trace", None)
+        if trace is None:
+            return
+        _current_trace.reset(g.pop("metrics_token"))
+        seconds = time.perf_counter() - trace.started
+        self.request_seconds.observe((route, method, str(status)), seconds)
+        self.request_mongo_seconds.observe((route,), trace.mongo_seconds)
+        self.request_render_seconds.observe((route,), trace.render_seconds)
+        if trace.mongo_commands:
+            self.request_mongo_commands.inc((route,), trace.mongo_commands)
+        if seconds >= self.slow_request_seconds:
+            self.slow_requests.inc((route,))
+            if self._rng() < self.slow_sample:
+                slow_log.warning("%s", json.dumps(self.slow_record(trace, route, method, status, seconds)))
+        if self.directory and trace.started - self._last_dump >= DUMP_INTERVAL:
+            self.dump()
+
+    @staticmethod
+    def slow_record(trace, route, method, status, seconds):
+        return {
+            "route": route,
+            "method": method,
+            "status": status,
+            "ms": round(seconds * 1000, 1),
+            "mongo_ms": round(trace.mongo_seconds * 1000, 1),
+            "render_ms": round(trace.render_seconds * 1000, 1),
+            "commands": [
+                {"command": name, "collection": coll, "ms": round(secs * 1000, 2),
+                 "documents": size, "shape": command_shape(name, command)}
+                for name, coll, secs, size, command in trace.commands
+            ],
+        }
+
+    # multi-process export
+    def dump(self):
+        """Write this process's snapshot to METRICS_DIR atomically."""
+        self._last_dump = time.perf_counter()
+        self._run_collectors()
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, path)
+
+    def render(self):
+        """Prometheus text for this process, or for every live worker with METRICS_DIR."""
+        if not self.directory:
+            self._run_collectors()
+            return self.registry.render()
+        self.dump()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            pid = name[:-len(".json")]
+            # a worker killed before the master folded it in must not count twice
+            if name != DEAD_SNAPSHOT and (not pid.isdigit() or not _alive(int(pid))):
+                continue
+            snapshot = _read_snapshot(os.path.join(self.directory, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return self.registry.merged_with(snapshots).render()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add_rows(total, rows):
+    merged = {tuple(labels): value for labels, value in total}
+    for labels, value in rows:
+        key = tuple(labels)
+        if key not in merged:
+            merged[key] = value
+        elif isinstance(value, list):
+            merged[key] = [a + b for a, b in zip(merged[key], value)]
+        else:
+            merged[key] += value
+    return [[list(labels), value] for labels, value in merged.items()]
+
+
+def mark_process_dead(directory, pid):
+    """Fold an exited worker's counters and histograms into DEAD_SNAPSHOT; drop the rest."""
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_snapshot(path)
+    if snapshot is not None:
+        dead_path = os.path.join(directory, DEAD_SNAPSHOT)
+        dead = _read_snapshot(dead_path) or {}
+        for name, entry in snapshot.items():
+            if entry["kind"] == "gauge":
+                continue
+            folded = dead.setdefault(name, {"kind": entry["kind"], "rows": []})
+            folded["rows"] = _add_rows(folded["rows"], entry["rows"])
+        tmp = f"{dead_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(dead, f)
+        os.replace(tmp, dead_path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# --- Flask wiring ---
+def instrument(app, metrics):
+    """Install the timing hooks and render-time signals on app."""
+
+    @app.before_request
+    def _start_timer():
+        metrics.start_request()
+
+    @app.after_request
+    def _stop_timer(response):
+        metrics.finish_request(request.endpoint or "unmatched", request.method, response.status_code)
+        return response
+
+    @app.teardown_request
+    def _stop_on_error(exc):
+        # after_request is skipped when a view raised
+        if "metrics_trace" in g:
+            metrics.finish_request(request.endpoint or "unmatched", request.method, 500)
+
+    def _render_started(sender, **extra):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.render_started = time.perf_counter()
+
+    def _render_finished(sender, **extra):
+        trace = _current_trace.get()
+        if trace is not None and trace.render_started is not None:
+            trace.render_seconds += time.perf_counter() - trace.render_started
+            trace.render_started = None
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
@@ -0,0 +1,235 @@
+"""
+migrations.py
+
+Versioned schema/index migrations for the consent_data database.
+
+Each migration is registered with @migration(version, description) and is
+applied at most once; applied versions are recorded in the
+schema_migrations collection. verify_indexes() is the startup guard that
+refuses to serve when an index a hot query relies on is missing.
+"""
+
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from archive import ARCHIVE_COLL
+from audit import AUDIT_COLL
+from fanout import DRAFT_TTL_SECONDS, JOBS_COLL
+from search import backfill_search_fields
+from sessions import SESSIONS_COLL
+from signatures import migrate_inline_signatures, store_from_env
+from userstats import STATS_COLL, rebuild as rebuild_user_stats
+
+MIGRATIONS_COLL = "schema_migrations"
+
+MIGRATIONS = []
+
+# collection -> index names the request handlers depend on
+REQUIRED_INDEXES = {
+    "users": ["username_unique", "email_unique", "users_created_at"],
+    "agreements": [
+        "party1_user_created_at_id",
+        "party2_user_created_at_id",
+        "party1_user_status_created_at_id",
+        "party2_user_status_created_at_id",
+        "signature_ref_hash",
+        "party2_search_terms",
+    ],
+    "agreement_revisions": ["agreement_id_revision", "revision_signature_ref_hash"],
+    ARCHIVE_COLL: [
+        "party1_user_created_at_id",
+        "party2_user_created_at_id",
+        "signature_ref_hash",
+        "party2_search_terms",
+    ],
+    SESSIONS_COLL: ["expires_at_ttl"],
+    AUDIT_COLL: ["users_ts_id"],
+    JOBS_COLL: ["draft_created_at_ttl"],
+}
+
+
+class MissingIndexError(RuntimeError):
+    """Raised when a required index is not present on startup."""
+
+
+def migration(version, description):
+    """Register a migration function taking the database as its argument."""
+    def register(func):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"duplicate migration version {version}")
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+# --- Migrations ---
+@migration(1, "unique username/email indexes on users")
+def _users_identity_indexes(db):
+    db["users"].create_index(
+        [("username", ASCENDING)], unique=True,
+        name="username_unique")
+    db["users"].create_index(
+        [("email", ASCENDING)], unique=True,
+        name="email_unique")
+
+
+@migration(2, "per-party (user_id, created_at) indexes on agreements")
+def _agreements_party_indexes(db):
+    for party in ("party1", "party2"):
+        db["agreements"].create_index(
+            [(f"{party}.user_id", ASCENDING), ("created_at", DESCENDING)],
+            name=f"{party}_user_created_at")
+
+
+@migration(3, "signature_ref.hash index for /signatures/<hash> lookups")
+def _signature_ref_index(db):
+    db["agreements"].create_index(
+        [("signature_ref.hash", ASCENDING)],
+        name="signature_ref_hash")
+
+
+@migration(4, "move inline signature data URLs into the blob store")
+def _move_inline_signatures(db):
+    migrate_inline_signatures(db["agreements"], store_from_env(db))
+
+
+@migration(5, "prefix search index on agreements, backfilled")
+def _search_terms_index(db):
+    backfill_search_fields(db["agreements"])
+    db["agreements"].create_index(
+        [("party2.user_id", ASCENDING), ("search_terms", ASCENDING)],
+        name="party2_search_terms")
+
+
+@migration(6, "extend party indexes with _id so keyset pages sort in the index")
+def _agreements_keyset_indexes(db):
+    for party in ("party1", "party2"):
+        db["agreements"].create_index(
+            [(f"{party}.user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name=f"{party}_user_created_at_id")
+        # the old (user_id, created_at) index is a prefix of the new one
+        if f"{party}_user_created_at" in db["agreements"].index_information():
+            db["agreements"].drop_index(f"{party}_user_created_at")
+
+
+@migration(7, "agreement_revisions chain and signature indexes")
+def _revisions_index(db):
+    db["agreement_revisions"].create_index(
+        [("agreement_id", ASCENDING), ("revision", DESCENDING)],
+        name="agreement_id_revision")
+    db["agreement_revisions"].create_index(
+        [("signature_ref.hash", ASCENDING)],
+        name="revision_signature_ref_hash")
+
+
+@migration(8, "per-user agreement counters, computed from existing agreements")
+def _user_stats(db):
+    rebuild_user_stats(db["agreements"], db[STATS_COLL])
+
+
+@migration(9, "agreements_archive read-through indexes and the settled-agreement scan")
+def _archive_indexes(db):
+    archive = db[ARCHIVE_COLL]
+    for party in ("party1", "party2"):
+        archive.create_index(
+            [(f"{party}.user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name=f"{party}_user_created_at_id")
+    archive.create_index([("signature_ref.hash", ASCENDING)], name="signature_ref_hash")
+    archive.create_index(
+        [("party2.user_id", ASCENDING), ("search_terms", ASCENDING)],
+        name="party2_search_terms")
+    # lets `flask archive` find settled agreements without a collection scan
+    db["agreements"].create_index(
+        [("response_status", ASCENDING), ("response_date", ASCENDING)],
+        name="response_status_date")
+
+
+@migration(10, "TTL index expiring server-side sessions")
+def _sessions_ttl_index(db):
+    db[SESSIONS_COLL].create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+
+
+@migration(11, "audit_events index for per-user history")
+def _audit_index(db):
+    db[AUDIT_COLL].create_index(
+        [("users", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)],
+        name="users_ts_id")
+
+
+@migration(12, "per-party (user_id, response_status, created_at, _id) indexes for dashboard buckets")
+def _agreements_bucket_indexes(db):
+    # the (user_id, created_at, _id) indexes stay: export, search and counters sort by party alone
+    for party in ("party1", "party2"):
+        db["agreements"].create_index(
+            [(f"{party}.user_id", ASCENDING), ("response_status", ASCENDING),
+             ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name=f"{party}_user_status_created_at_id")
+
+
+@migration(13, "users created_at index for the /users/suggest catch-up query")
+def _users_created_at_index(db):
+    db["users"].create_index([("created_at", ASCENDING)], name="users_created_at")
+
+
+@migration(14, "TTL index expiring fan-out jobs left in draft")
+def _fanout_drafts_ttl_index(db):
+    # finished jobs back the report page, so only drafts expire
+    db[JOBS_COLL].create_index(
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=DRAFT_TTL_SECONDS,
+        partialFilterExpression={"status": "draft"},
+        name="draft_created_at_ttl",
+    )
+
+
+# --- Runner ---
+def applied_versions(db):
+    """Return the set of migration versions already applied."""
+    return {doc["_id"] for doc in db[MIGRATIONS_COLL].find({}, {"_id": 1})}
+
+
+def pending_migrations(db):
+    """Return the registered migrations not yet recorded as applied."""
+    done = applied_versions(db)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def run_migrations(db, log=print):
+    """Apply every pending migration in version order; return those applied."""
+    applied = []
+    for version, description, func in pending_migrations(db):
+        log(f"Applying migration {version}: {description}")
+        func(db)
+        try:
+            db[MIGRATIONS_COLL].insert_one({
+                "_id": version,
+                "description": description,
+                "applied_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            # another worker got there first; index creation is idempotent
+            pass
+        applied.append(version)
+    return applied
+
+
+def missing_indexes(db):
+    """Return (collection, index_name) pairs that are required but absent."""
+    missing = []
+    for coll_name, names in REQUIRED_INDEXES.items():
+        present = db[coll_name].index_information()
+        missing.extend((coll_name, name) for name in names if name not in present)
+    return missing
+
+
+def verify_indexes(db):
+    """Raise MissingIndexError unless every required index exists."""
+    missing = missing_indexes(db)
+    if missing:
+        listed = ", ".join(f"{c}.{n}" for c, n in missing)
+        raise MissingIndexError(
+            f"Missing required indexes: {listed}. Run `flask --app app migrate`."
+        )
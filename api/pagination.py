@@ -0,0 +1,82 @@
+"""
+pagination.py
+
+Keyset (cursor) pagination shared by every agreement listing.
+
+A page is fetched by sorting on a unique key, e.g. (created_at, _id), and
+asking for rows strictly after the last one already shown. With a matching
+index the cost of page N is the same as page 1, unlike skip/limit. Cursor
+tokens are opaque url-safe strings wrapping the last row's sort values.
+"""
+
+import base64
+
+from bson import json_util
+
+# every listing pages newest first, ties broken on _id
+NEWEST_FIRST = (("created_at", -1), ("_id", -1))
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def clamp_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Coerce a configured page size into 1..MAX_PAGE_SIZE."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def encode_cursor(row, sort=NEWEST_FIRST):
+    """Opaque token for the position just after row."""
+    values = [row[field] for field, _ in sort]
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, sort=NEWEST_FIRST):
+    """Inverse of encode_cursor(); None for a missing or garbled token."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json_util.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(sort):
+        return None
+    return values
+
+
+def keyset_match(after, sort=NEWEST_FIRST):
+    """
+    Filter selecting rows strictly after the cursor values in sort order.
+
+    For ((a, -1), (b, -1)) and after (x, y) this is
+    {"$or": [{a: {"$lt": x}}, {a: x, b: {"$lt": y}}]}.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {f: after[j] for j, (f, _) in enumerate(sort[:i])}
+        clause[field] = {"$lt" if direction < 0 else "$gt": after[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def sort_spec(sort=NEWEST_FIRST):
+    """The $sort stage body for a sort tuple."""
+    return dict(sort)
+
+
+def split_page(rows, page_size, sort=NEWEST_FIRST):
+    """
+    Trim a page fetched with page_size + 1 rows.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1], sort)
+    return rows, None
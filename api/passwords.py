@@ -0,0 +1,144 @@
+"""
+passwords.py
+
+Password hashing off the request thread.
+
+KDF work (werkzeug's scrypt/pbkdf2) runs in a bounded process pool so a
+login storm cannot hold every request worker. At most workers + max_queue
+jobs are in flight; beyond that HashingBusy is raised immediately and the
+app answers 503. A job that does not finish within timeout is answered the
+same way. Pool workers are started by a forkserver (spawn where there is
+none), never forked from a request worker that is running threads and
+holding a MongoDB client. Stored hashes whose method differs from the configured
+one are flagged by needs_rehash() so login can upgrade them transparently.
+
+workers=0 runs the KDF inline, which is what tests and the dev server use.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing queue is full or a job timed out."""
+
+
+def _mp_context():
+    # forking a threaded process can copy held locks into the child
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """Runs password KDFs in a lazily created, fork-aware process pool."""
+
+    def __init__(self, method=DEFAULT_METHOD, workers=0, max_queue=None, timeout=30.0):
+        self.method = method
+        self.workers = workers
+        self.max_queue = workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, workers + self.max_queue))
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._method_prefix = None
+        self.rejected = 0
+
+    def _executor(self):
+        # a pool inherited across fork() is unusable; build one per process
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy("Password hashing queue is full.")
+        try:
+            future = self._executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout as e:
+            # the slot stays taken until the job really ends
+            future.cancel()
+            raise HashingBusy("Password hashing timed out.") from e
+
+    def hash(self, password):
+        """Hash a password with the configured method."""
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password against a stored hash."""
+        return self._run(_verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with a different method or cost."""
+        if self._method_prefix is None:
+            # werkzeug fills in default costs, so normalise via a real hash
+            self._method_prefix = _hash("", self.method).split("$", 1)[0]
+        return pwhash.split("$", 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+def hasher_from_config(config):
+    """Build a PasswordHasher from create_app() settings."""
+    return PasswordHasher(
+        method=config["PASSWORD_HASH_METHOD"],
+        workers=config["HASH_WORKERS"],
+        max_queue=config["HASH_QUEUE"],
+        timeout=config["HASH_TIMEOUT"]
+    )
+
+
+def benchmark(method=DEFAULT_METHOD, processes=None, duration=2.0):
+    """
+    Measure hashes/sec with one worker process per core.
+
+    Returns a dict with total and per-core throughput.
+    """
+    processes = processes or os.cpu_count() or 1
+    done = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # warm the workers up before timing
+        list(pool.map(_hash, ["warmup"] * processes, [method] * processes))
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            batch = list(pool.map(_hash, ["benchmark"] * processes, [method] * processes))
+            done += len(batch)
+        elapsed = time.perf_counter() - start
+    return {
+        "method": method,
+        "processes": processes,
+        "hashes": done,
+        "seconds": round(elapsed, 3),
+        "hashes_per_sec": round(done / elapsed, 2),
+        "hashes_per_sec_per_core": round(done / elapsed / processes, 2),
+    }
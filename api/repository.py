@@ -0,0 +1,213 @@
+"""
+repository.py
+
+Lazily connected, fork-aware access to the consent_data collections.
+
+Constructing a Repository does no I/O: the pooled MongoClient is created on
+first use, and re-created if the process has forked since, so importing the
+app and building it with create_app() stays cheap.
+
+Reads and writes are routed per call site:
+
+- reads(name) is for read-only listing, search and export queries. It uses
+  MONGO_READ_PREFERENCE (e.g. secondaryPreferred) bounded by
+  MONGO_MAX_STALENESS_SECONDS, with majority read concern.
+- collection(name, durability) picks the write concern: "critical"
+  (agreements and users) waits for MONGO_CRITICAL_WRITE_CONCERN, "fast"
+  (sessions, audit events) for the primary only.
+- When reads are routed, a request's operations run in one causally
+  consistent session (session_source). Its operation time is carried to the
+  user's next request, so a secondary read never misses what the same user
+  just wrote. With the primary read preference no session is started.
+"""
+
+import os
+import threading
+
+from bson import json_util
+from pymongo import MongoClient, ReadPreference
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Nearest, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+DURABILITIES = ("critical", "default", "fast")
+
+_READ_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+# the collection methods a causal session is threaded through
+_SESSION_READS = frozenset(("find", "find_one", "aggregate", "count_documents", "distinct"))
+_SESSION_WRITES = frozenset((
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "bulk_write",
+    "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+))
+
+
+def read_preference(mode, max_staleness=-1):
+    """A pymongo read preference from its name and a staleness bound in seconds (-1: none)."""
+    if mode == "primary":
+        return ReadPreference.PRIMARY
+    if mode not in _READ_MODES:
+        raise ValueError(f"MONGO_READ_PREFERENCE must be primary or one of {', '.join(_READ_MODES)}")
+    return _READ_MODES[mode](max_staleness=max_staleness)
+
+
+def write_concerns(critical_w="majority", wtimeout_ms=5000):
+    """The write concern for each durability; None keeps the client's default."""
+    w = int(critical_w) if str(critical_w).isdigit() else critical_w
+    return {
+        "critical": WriteConcern(w=w, wtimeout=wtimeout_ms),
+        "default": None,
+        "fast": WriteConcern(w=1),
+    }
+
+
+class CausalContext:
+    """One request's causally consistent session, and whether it wrote anything."""
+
+    def __init__(self, session):
+        self.session = session
+        self.wrote = False
+
+
+def encode_token(session):
+    """The causal position of a session as a string, or None before any operation."""
+    if session.operation_time is None:
+        return None
+    return json_util.dumps({"cluster_time": session.cluster_time, "operation_time": session.operation_time})
+
+
+def decode_token(token):
+    return json_util.loads(token) if token else None
+
+
+class SessionCollection:
+    """A collection whose reads and writes all run in one client session."""
+
+    def __init__(self, collection, context):
+        self._collection = collection
+        self._context = context
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in _SESSION_READS and name not in _SESSION_WRITES:
+            return attr
+
+        def call(*args, **kwargs):
+            kwargs.setdefault("session", self._context.session)
+            result = attr(*args, **kwargs)
+            if name in _SESSION_WRITES:
+                self._context.wrote = True
+            return result
+        return call
+
+
+class Repository:
+    """Owns the MongoClient and hands out collections."""
+
+    def __init__(self, uri, db_name="consent_data", read_mode="primary", max_staleness=-1,
+                 concerns=None, session_source=None, **client_options):
+        self.uri = uri
+        self.db_name = db_name
+        self.read_preference = read_preference(read_mode, max_staleness)
+        self.concerns = concerns or write_concerns()
+        # callable returning the current request's CausalContext, or None
+        self.session_source = session_source
+        self.client_options = client_options
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, session_source=None, **extra_options):
+        """Build a Repository from create_app() settings; extra_options go to MongoClient."""
+        return cls(
+            config["MONGO_URI"],
+            config["MONGO_DB_NAME"],
+            read_mode=config["MONGO_READ_PREFERENCE"],
+            max_staleness=config["MONGO_MAX_STALENESS_SECONDS"],
+            concerns=write_concerns(config["MONGO_CRITICAL_WRITE_CONCERN"], config["MONGO_WRITE_TIMEOUT_MS"]),
+            session_source=session_source,
+            maxPoolSize=config["MONGO_MAX_POOL_SIZE"],
+            minPoolSize=config["MONGO_MIN_POOL_SIZE"],
+            maxIdleTimeMS=config["MONGO_MAX_IDLE_TIME_MS"],
+            connectTimeoutMS=config["MONGO_CONNECT_TIMEOUT_MS"],
+            serverSelectionTimeoutMS=config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+            socketTimeoutMS=config["MONGO_SOCKET_TIMEOUT_MS"],
+            **extra_options,
+        )
+
+    @property
+    def connected(self):
+        """True once this process has created its client."""
+        return self._client is not None and self._client_pid == os.getpid()
+
+    @property
+    def client(self):
+        if not self.connected:
+            with self._lock:
+                if not self.connected:
+                    # never reuse a client inherited across fork()
+                    self._client = MongoClient(self.uri, **self.client_options)
+                    self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    @property
+    def routes_reads(self):
+        """True when reads() may be served by a secondary."""
+        return self.read_preference != ReadPreference.PRIMARY
+
+    def _bind(self, coll):
+        context = self.session_source() if self.routes_reads and self.session_source else None
+        return SessionCollection(coll, context) if context is not None else coll
+
+    def collection(self, name, durability="default"):
+        coll = self.db[name]
+        concern = self.concerns[durability]
+        if concern is not None:
+            coll = coll.with_options(write_concern=concern)
+        return self._bind(coll)
+
+    def reads(self, name):
+        """name for read-only listing/search queries, served per the read preference."""
+        coll = self.db[name]
+        if self.routes_reads:
+            coll = coll.with_options(read_preference=self.read_preference, read_concern=ReadConcern("majority"))
+        return self._bind(coll)
+
+    def causal_session(self, token=None):
+        """A causally consistent session that starts after token (see encode_token)."""
+        session = self.client.start_session(causal_consistency=True)
+        position = decode_token(token)
+        if position:
+            session.advance_cluster_time(position["cluster_time"])
+            session.advance_operation_time(position["operation_time"])
+        return session
+
+    @property
+    def users(self):
+        return self.collection("users", "critical")
+
+    @property
+    def agreements(self):
+        return self.collection("agreements", "critical")
+
+    def ping(self):
+        """Round trip to the server; raises PyMongoError when unreachable."""
+        self.client.admin.command("ping")
+
+    def close(self):
+        with self._lock:
+            if self.connected:
+                self._client.close()
+            self._client = None
+            self._client_pid = None
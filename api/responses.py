@@ -0,0 +1,116 @@
+"""
+responses.py
+
+Agreeing to or rejecting many agreements in one request.
+
+Ownership of the whole batch is checked with a single $in query on _id, and
+the permitted updates go to the server as one unordered bulk_write. Every
+update filter repeats the party2 condition, so an agreement cannot be
+answered by anyone but its recipient even if the batch races another write.
+It also repeats the status that was read, so per-user counters move exactly
+once per change.
+
+When fewer documents were modified than updates sent, the batch re-reads its
+ids once to see which carry its own (status, response_date) stamp; the rest
+lost a race with another write and are reported as conflict.
+"""
+
+from datetime import datetime
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+import userstats
+
+DECISIONS = ("agreed", "rejected")
+
+MAX_BATCH = 100
+
+
+class InvalidBatch(ValueError):
+    """Raised for a malformed batch (bad decision, empty or oversized)."""
+
+
+def respond_many(agreements_coll, user_id, agreement_ids, decision, now=None, stats_coll=None):
+    """
+    Record decision on every agreement in agreement_ids addressed to user_id.
+
+    Returns ({agreement_id: "updated" | "conflict" | "not_found" | "invalid_id"},
+    modified) keyed by the ids as given; agreements owned by someone else are
+    reported as not_found so a batch cannot probe for other users' agreements,
+    and ones answered by a concurrent write as conflict. With stats_coll, the
+    sender's and recipient's counters follow the changes.
+    """
+    if decision not in DECISIONS:
+        raise InvalidBatch(f"response must be one of {', '.join(DECISIONS)}")
+    if not isinstance(agreement_ids, (list, tuple)):
+        raise InvalidBatch("agreement ids must be a list")
+    agreement_ids = list(dict.fromkeys(str(i) for i in agreement_ids))
+    if not agreement_ids:
+        raise InvalidBatch("no agreements selected")
+    if len(agreement_ids) > MAX_BATCH:
+        raise InvalidBatch(f"at most {MAX_BATCH} agreements per request")
+
+    results = {}
+    oids = {}
+    for raw in agreement_ids:
+        try:
+            oids[raw] = ObjectId(raw)
+        except (InvalidId, TypeError):
+            results[raw] = "invalid_id"
+
+    owned = {}
+    if oids:
+        owned = {
+            agr["_id"]: agr for agr in agreements_coll.find(
+                {"_id": {"$in": list(oids.values())}, "party2.user_id": user_id},
+                {"_id": 1, "response_status": 1, "party1.user_id": 1, "party2.user_id": 1},
+            )
+        }
+
+    now = now or datetime.utcnow()
+    # BSON dates keep milliseconds; the re-read below compares against the stored value
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    ops = []
+    changes = {}
+    for raw, oid in oids.items():
+        agr = owned.get(oid)
+        if agr is not None:
+            ops.append(UpdateOne(
+                # None also matches legacy agreements without a status
+                {"_id": oid, "party2.user_id": user_id, "response_status": agr.get("response_status")},
+                {"$set": {"response_status": decision, "response_date": now}},
+            ))
+            changes[raw] = (userstats.transition(agr, userstats.status_of(agr), decision)
+                            if stats_coll is not None else [])
+            results[raw] = "updated"
+        else:
+            results[raw] = "not_found"
+
+    modified = 0
+    if ops:
+        modified = agreements_coll.bulk_write(ops, ordered=False).modified_count
+        if modified < len(ops):
+            _mark_conflicts(agreements_coll, results, oids, changes, decision, now)
+        if stats_coll is not None:
+            if modified == len(ops):
+                userstats.record(stats_coll, [c for cs in changes.values() for c in cs])
+            else:
+                # some raced another write; recount just the users involved
+                users = {c[0] for cs in changes.values() for c in cs} | {user_id}
+                userstats.rebuild(agreements_coll, stats_coll, users)
+    return {raw: results[raw] for raw in agreement_ids}, modified
+
+
+def _mark_conflicts(agreements_coll, results, oids, changes, decision, now):
+    """Report as conflict every attempted id that does not carry this batch's write."""
+    ours = {
+        agr["_id"] for agr in agreements_coll.find(
+            {"_id": {"$in": [oids[raw] for raw in changes]}, "response_status": decision, "response_date": now},
+            {"_id": 1},
+        )
+    }
+    for raw in changes:
+        if oids[raw] not in ours:
+            results[raw] = "conflict"
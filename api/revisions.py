@@ -0,0 +1,144 @@
+"""
+revisions.py
+
+Revision chains for agreements that are edited and resent.
+
+The agreement document is always the head: resending a rejected agreement
+updates it in place (new title/content/signature, back to pending) instead
+of inserting a second full document. What it replaced is saved in
+agreement_revisions as a compact reverse diff: only the title/content
+fields that changed, plus the old signature reference and response, with a
+pointer to the revision before it. Listings keep reading heads only;
+history() rebuilds every earlier version on demand.
+"""
+
+from datetime import datetime
+
+import search
+import userstats
+
+REVISIONS_COLL = "agreement_revisions"
+
+# fields a revision may change, as dotted paths
+CONTENT_FIELDS = ("sexual_content", "contraception", "std_check", "record_allowed")
+TRACKED = ("title",) + tuple(f"content.{f}" for f in CONTENT_FIELDS)
+
+
+class RevisionConflict(RuntimeError):
+    """The head changed (or is not a rejected agreement of this user) mid-edit."""
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        doc = (doc or {}).get(part)
+    return doc
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def diff(old, new):
+    """[{"field", "old"}] for every tracked field whose value differs."""
+    return [
+        {"field": path, "old": _get(old, path)}
+        for path in TRACKED
+        if _get(old, path) != _get(new, path)
+    ]
+
+
+def revise(agreements_coll, revisions_coll, agreement_id, editor_id, title, content,
+           signature_ref, now=None, stats_coll=None):
+    """
+    Replace a rejected agreement's terms and signature, keeping the old ones.
+
+    Returns the new revision number. Raises RevisionConflict unless the
+    agreement exists, editor_id is its party1, it is rejected, and nobody
+    revised it concurrently. With stats_coll, both parties' counters move
+    from rejected to pending.
+    """
+    now = now or datetime.utcnow()
+    head = agreements_coll.find_one({"_id": agreement_id})
+    if not head or head["party1"]["user_id"] != editor_id or head.get("response_status") != "rejected":
+        raise RevisionConflict("agreement is not a rejected agreement of yours")
+
+    number = head.get("revision", 1)
+    new = {"title": title, "content": content}
+    saved = revisions_coll.insert_one({
+        "agreement_id": agreement_id,
+        "revision": number,
+        "changes": diff(head, new),
+        "signature_ref": head.get("signature_ref"),
+        "response_status": head.get("response_status"),
+        "response_date": head.get("response_date"),
+        "created_at": head.get("created_at"),
+        "prev": head.get("prev_revision"),
+        # lets /signatures/<hash> authorise old signatures without the head
+        "party_ids": [head["party1"]["user_id"], head["party2"]["user_id"]],
+    }).inserted_id
+
+    update = {
+        "title": title,
+        "content": content,
+        "signature_ref": signature_ref,
+        "response_status": "pending",
+        "response_date": None,
+        # resent agreements sort as new, as a fresh insert used to
+        "created_at": now,
+        "revision": number + 1,
+        "prev_revision": saved,
+    }
+    update.update(search.index_fields(dict(head, title=title)))
+    result = agreements_coll.update_one(
+        # revision is absent on never-edited agreements, and None matches that
+        {"_id": agreement_id, "response_status": "rejected", "revision": head.get("revision")},
+        {"$set": update},
+    )
+    if not result.modified_count:
+        revisions_coll.delete_many({"_id": saved})
+        raise RevisionConflict("agreement was changed while you were editing it")
+    if stats_coll is not None:
+        userstats.record(stats_coll, userstats.transition(head, "rejected", "pending"))
+    return number + 1
+
+
+def history(revisions_coll, head):
+    """
+    Every version of an agreement, newest (the head) first.
+
+    One indexed query fetches the chain; walking it from the head applies
+    each reverse diff to rebuild the version before it.
+    """
+    versions = [dict(head, revision=head.get("revision", 1))]
+    if not head.get("prev_revision"):
+        return versions
+    by_id = {
+        rev["_id"]: rev
+        for rev in revisions_coll.find({"agreement_id": head["_id"]}).sort("revision", -1)
+    }
+    current = versions[0]
+    rev = by_id.get(head["prev_revision"])
+    while rev is not None:
+        older = {
+            "_id": head["_id"],
+            "title": current.get("title"),
+            "content": dict(current.get("content") or {}),
+            "party1": head["party1"],
+            "party2": head["party2"],
+        }
+        for change in rev["changes"]:
+            _set(older, change["field"], change["old"])
+        older.update(
+            revision=rev["revision"],
+            signature_ref=rev.get("signature_ref"),
+            response_status=rev.get("response_status"),
+            response_date=rev.get("response_date"),
+            created_at=rev.get("created_at"),
+        )
+        versions.append(older)
+        current = older
+        rev = by_id.get(rev.get("prev"))
+    return versions
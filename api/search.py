@@ -0,0 +1,124 @@
+"""
+search.py
+
+Indexed agreement search.
+
+Each agreement carries two derived fields maintained on insert:
+
+- search_words: the normalised tokens of its title and party1 name
+- search_terms: every prefix of those tokens (the inverted index)
+
+A multikey index on (party2.user_id, search_terms) answers prefix queries
+without regexes. Matches are ranked by how many query tokens hit a whole
+word, newest first on ties, and paged with a keyset cursor (pagination.py).
+Archived agreements are searched through a $unionWith on the same fields.
+"""
+
+import re
+
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, keyset_match, sort_spec, split_page
+
+# best match first, then the usual newest-first order
+RANKED = (("score", -1), ("created_at", -1), ("_id", -1))
+
+MAX_QUERY_TOKENS = 8
+MAX_PREFIX_LEN = 20
+
+RESULT_FIELDS = {
+    "title": 1,
+    "party1.name": 1,
+    "party2.name": 1,
+    "created_at": 1,
+    # part of the cached row's key, so an edited title is not served stale
+    "revision": 1,
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Lower-cased word tokens; everything else in the input is ignored."""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def index_fields(agreement):
+    """Return the derived search fields for an agreement document."""
+    words = set(tokenize(agreement.get("title")))
+    words.update(tokenize(agreement.get("party1", {}).get("name")))
+    terms = set()
+    for word in words:
+        for end in range(1, min(len(word), MAX_PREFIX_LEN) + 1):
+            terms.add(word[:end])
+    return {"search_words": sorted(words), "search_terms": sorted(terms)}
+
+
+def query_tokens(keyword):
+    """Distinct query tokens, truncated to what the index can answer."""
+    tokens = []
+    for token in tokenize(keyword)[:MAX_QUERY_TOKENS]:
+        token = token[:MAX_PREFIX_LEN]
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def _ranked_branch(user_id, tokens, after, page_size):
+    pipeline = [
+        {"$match": {"party2.user_id": user_id, "search_terms": {"$all": tokens}}},
+        {"$addFields": {"score": {"$size": {"$setIntersection": [
+            {"$ifNull": ["$search_words", []]}, tokens
+        ]}}}},
+    ]
+    if after:
+        pipeline.append({"$match": keyset_match(after, RANKED)})
+    pipeline += [
+        {"$sort": sort_spec(RANKED)},
+        {"$limit": page_size + 1},
+    ]
+    return pipeline
+
+
+def search_pipeline(user_id, tokens, after=None, page_size=DEFAULT_PAGE_SIZE, archive=None):
+    """
+    Aggregation returning one ranked page (plus one look-ahead row).
+
+    With archive (a collection name) the same ranked page is taken from it
+    too and the two are merged before the final sort and limit.
+    """
+    pipeline = _ranked_branch(user_id, tokens, after, page_size)
+    if archive:
+        pipeline += [
+            {"$unionWith": {"coll": archive, "pipeline": _ranked_branch(user_id, tokens, after, page_size)}},
+            {"$sort": sort_spec(RANKED)},
+            {"$limit": page_size + 1},
+        ]
+    pipeline.append({"$project": dict(RESULT_FIELDS, score=1)})
+    return pipeline
+
+
+def search_agreements(agreements_coll, user_id, keyword, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                      archive=None):
+    """
+    Search agreements addressed to user_id, including archive if given.
+
+    Returns (results, next_cursor); next_cursor is None on the last page.
+    """
+    tokens = query_tokens(keyword)
+    if not tokens:
+        return [], None
+    rows = list(agreements_coll.aggregate(
+        search_pipeline(user_id, tokens, decode_cursor(cursor, RANKED), page_size, archive)
+    ))
+    return split_page(rows, page_size, RANKED)
+
+
+def backfill_search_fields(agreements_coll, batch_size=100):
+    """Add search fields to agreements stored before indexing existed."""
+    updated = 0
+    cursor = agreements_coll.find(
+        {"search_terms": {"$exists": False}}, {"title": 1, "party1.name": 1}
+    ).batch_size(batch_size)
+    for agr in cursor:
+        agreements_coll.update_one({"_id": agr["_id"]}, {"$set": index_fields(agr)})
+        updated += 1
+    return updated
@@ -0,0 +1,232 @@
+"""
+sessions.py
+
+Server-side sessions: the cookie carries only an opaque session id.
+
+SESSION_BACKEND picks where the session dict (sign-in, flashes and the
+agreement wizard's draft) lives:
+
+    cookie   Flask's signed cookie; the whole session travels with every request
+    mongo    one document per session in the sessions collection; a TTL index on
+             expires_at deletes abandoned sessions and their drafts
+    memory   a per-process LRU, for a single worker or development
+
+Sessions are stored with the cookie session's own tagged JSON (so flashes
+and other tuples round-trip), zlib-compressed above COMPRESS_OVER bytes. A
+session is written only when it changed or when less than half of its
+lifetime is left, so most requests cost one primary-key read and no signing.
+
+A visitor who is not signed in and only carries flash messages (a failed
+sign-in, say) gets no stored session: the flashes travel in the same cookie,
+signed like Flask's own, until they are shown. Only sign-in or a wizard
+draft creates a server-side session, so anonymous traffic cannot fill the
+store.
+"""
+
+import secrets
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+from itsdangerous import BadSignature
+
+SESSIONS_COLL = "sessions"
+BACKENDS = ("cookie", "mongo", "memory")
+
+COMPRESS_OVER = 512
+SID_BYTES = 32
+MAX_SID_LENGTH = 64
+
+# first byte of a stored session
+_RAW, _ZLIB = b"j", b"z"
+
+# keys that alone do not earn a server-side session
+COOKIE_ONLY_KEYS = frozenset({"_flashes"})
+
+_serializer = TaggedJSONSerializer()
+
+
+def encode(data):
+    """Compact bytes for a session dict."""
+    raw = _serializer.dumps(dict(data)).encode()
+    if len(raw) > COMPRESS_OVER:
+        return _ZLIB + zlib.compress(raw)
+    return _RAW + raw
+
+
+def decode(blob):
+    """Inverse of encode(); raises ValueError on anything else."""
+    blob = bytes(blob)
+    try:
+        body = zlib.decompress(blob[1:]) if blob[:1] == _ZLIB else blob[1:]
+        return _serializer.loads(body.decode())
+    except zlib.error as e:
+        raise ValueError(str(e)) from e
+
+
+class ServerSession(SecureCookieSession):
+    """A session dict that remembers its id, expiry and who it was opened for."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None, in_cookie=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.opened_for = self.get("user_id")
+        # flashes only, carried in the signed cookie instead of the store
+        self.in_cookie = in_cookie
+
+
+class MemorySessionStore:
+    """Per-process LRU of encoded sessions; expired ones are dropped on sight."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, sid, now):
+        """(expires_at, blob) for a live session, else None."""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry
+
+    def save(self, sid, blob, expires_at, now):
+        with self._lock:
+            self._entries[sid] = (expires_at, blob)
+            self._entries.move_to_end(sid)
+            # least recently used first: drop what has expired, then the overflow
+            while self._entries:
+                oldest, (expiry, _) = next(iter(self._entries.items()))
+                if expiry > now and len(self._entries) <= self.maxsize:
+                    break
+                del self._entries[oldest]
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class MongoSessionStore:
+    """One document per session, removed by the expires_at TTL index."""
+
+    def __init__(self, collection):
+        self.collection = collection  # callable returning the sessions collection
+
+    def load(self, sid, now):
+        # the TTL monitor only runs once a minute, so expiry is checked here too
+        doc = self.collection().find_one({"_id": sid, "expires_at": {"$gt": now}})
+        return (doc["expires_at"], doc["data"]) if doc else None
+
+    def save(self, sid, blob, expires_at, now):
+        self.collection().replace_one({"_id": sid}, {"data": blob, "expires_at": expires_at}, upsert=True)
+
+    def delete(self, sid):
+        self.collection().delete_one({"_id": sid})
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps the session in a store and only its random id in the cookie."""
+
+    session_class = ServerSession
+
+    def __init__(self, store, lifetime, clock=datetime.utcnow):
+        self.store = store
+        self.lifetime = lifetime
+        self.clock = clock
+        self._signed = SecureCookieSessionInterface()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        # session ids are URL-safe base64, signed cookie values always contain a "."
+        if sid and "." in sid:
+            signer = self._signed.get_signing_serializer(app)
+            try:
+                data = signer.loads(sid, max_age=int(self.lifetime.total_seconds())) if signer else None
+            except BadSignature:
+                data = None
+            if data and set(data) <= COOKIE_ONLY_KEYS:
+                return self.session_class(data, in_cookie=True)
+            return self.session_class()
+        if sid and len(sid) <= MAX_SID_LENGTH:
+            entry = self.store.load(sid, self.clock())
+            if entry is not None:
+                try:
+                    return self.session_class(decode(entry[1]), sid, entry[0])
+                except ValueError:
+                    self.store.delete(sid)
+        return self.session_class()
+
+    def _cookie_options(self, app):
+        return {
+            "domain": self.get_cookie_domain(app),
+            "path": self.get_cookie_path(app),
+            "secure": self.get_cookie_secure(app),
+            "samesite": self.get_cookie_samesite(app),
+            "httponly": self.get_cookie_httponly(app),
+        }
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if (session.sid is not None or session.in_cookie) and session.modified:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, **self._cookie_options(app))
+            return
+
+        now = self.clock()
+        if session.sid is not None and session.get("user_id") != session.opened_for:
+            # a new sign-in gets a new id, so a planted session id is worthless
+            self.store.delete(session.sid)
+            session.sid = None
+        if session.sid is None and set(session) <= COOKIE_ONLY_KEYS:
+            if session.modified:
+                self._save_in_cookie(app, session, response)
+            return
+        new = session.sid is None
+        stale = session.expires_at is None or session.expires_at - now < self.lifetime / 2
+        if not (new or stale or session.modified):
+            return
+
+        session.sid = session.sid or secrets.token_urlsafe(SID_BYTES)
+        session.expires_at = now + self.lifetime
+        session.opened_for = session.get("user_id")
+        self.store.save(session.sid, encode(session), session.expires_at, now)
+        if new:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                **self._cookie_options(app))
+            response.vary.add("Cookie")
+
+    def _save_in_cookie(self, app, session, response):
+        signer = self._signed.get_signing_serializer(app)
+        if signer is None:
+            # no SECRET_KEY to sign with; flashes are lost rather than stored
+            return
+        response.set_cookie(self.get_cookie_name(app), signer.dumps(dict(session)),
+                            expires=self.get_expiration_time(app, session), **self._cookie_options(app))
+        response.vary.add("Cookie")
+
+
+def make_session_interface(kind, lifetime_seconds, memory_size, get_collection):
+    """Build the session backend named by kind (cookie | mongo | memory)."""
+    if kind not in BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of {', '.join(BACKENDS)}")
+    if kind == "cookie":
+        return SecureCookieSessionInterface()
+    store = MemorySessionStore(memory_size) if kind == "memory" else MongoSessionStore(get_collection)
+    return ServerSessionInterface(store, timedelta(seconds=lifetime_seconds))
@@ -0,0 +1,181 @@
+"""
+signatures.py
+
+Content-addressed storage for signature images.
+
+Signatures arrive from signature.html as encoded pen strokes (strokes.py)
+or, from older clients, as base64 PNG data URLs. Either way they are stored
+as raw bytes keyed by their SHA-256 digest, and agreements keep only a small
+signature_ref ({"hash", "content_type", "size"}). Identical signatures are
+stored once.
+
+Two backends share the same put/open/exists interface: GridFS (default) and
+a local-filesystem stand-in for single-node and test setups.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+import gridfs
+from gridfs.errors import FileExists, NoFile
+from pymongo.errors import DuplicateKeyError
+
+CHUNK_SIZE = 64 * 1024
+
+ALLOWED_TYPES = {"image/png"}
+
+_DATA_URL_RE = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+);base64,(?P<data>.*)$", re.S)
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class InvalidSignature(ValueError):
+    """Raised when submitted signature data cannot be decoded."""
+
+
+def is_signature_hash(value):
+    """True if value looks like a hex SHA-256 digest."""
+    return bool(_HASH_RE.match(value or ""))
+
+
+def decode_data_url(data_url):
+    """Split a base64 data URL into (content_type, raw bytes)."""
+    match = _DATA_URL_RE.match(data_url or "")
+    if not match or match.group("mime") not in ALLOWED_TYPES:
+        raise InvalidSignature("Signature must be a base64 PNG data URL.")
+    try:
+        raw = base64.b64decode(match.group("data"), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidSignature("Signature data is not valid base64.") from e
+    if not raw:
+        raise InvalidSignature("Signature is empty.")
+    return match.group("mime"), raw
+
+
+class GridFSBlobStore:
+    """Blobs live in a GridFS bucket with the content hash as file _id."""
+
+    def __init__(self, get_db, bucket_name="signatures"):
+        # a callable, so building the store does not open a connection
+        self.get_db = get_db
+        self.bucket_name = bucket_name
+
+    @property
+    def bucket(self):
+        return gridfs.GridFSBucket(self.get_db(), bucket_name=self.bucket_name)
+
+    def exists(self, blob_hash):
+        return next(iter(self.bucket.find({"_id": blob_hash}).limit(1)), None) is not None
+
+    def put(self, blob_hash, data, content_type):
+        if self.exists(blob_hash):
+            return
+        try:
+            self.bucket.upload_from_stream_with_id(
+                blob_hash, blob_hash, data,
+                metadata={"content_type": content_type})
+        except (FileExists, DuplicateKeyError):
+            # a concurrent upload of the same content won the race
+            pass
+
+    def open(self, blob_hash):
+        """Return (readable file, length), or None if the blob is unknown."""
+        try:
+            grid_out = self.bucket.open_download_stream(blob_hash)
+        except NoFile:
+            return None
+        return grid_out, grid_out.length
+
+
+class LocalBlobStore:
+    """Blobs live under root/<first two hex chars>/<hash>."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, blob_hash):
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    def exists(self, blob_hash):
+        return os.path.exists(self._path(blob_hash))
+
+    def put(self, blob_hash, data, content_type):
+        path = self._path(blob_hash)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def open(self, blob_hash):
+        """Return (readable file, length), or None if the blob is unknown."""
+        path = self._path(blob_hash)
+        try:
+            return open(path, "rb"), os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+
+def make_store(kind, directory, get_db):
+    """Build the blob backend named by kind (gridfs | local)."""
+    if kind == "local":
+        return LocalBlobStore(directory)
+    return GridFSBlobStore(get_db)
+
+
+def store_from_env(db):
+    """Blob backend for db as configured by SIGNATURE_STORE / SIGNATURE_DIR."""
+    return make_store(
+        os.getenv("SIGNATURE_STORE", "gridfs"),
+        os.getenv("SIGNATURE_DIR", "signature_blobs"),
+        lambda: db
+    )
+
+
+def store_signature(store, data_url):
+    """Decode a data URL, store its bytes once, and return the agreement ref."""
+    content_type, raw = decode_data_url(data_url)
+    blob_hash = hashlib.sha256(raw).hexdigest()
+    store.put(blob_hash, raw, content_type)
+    return {"hash": blob_hash, "content_type": content_type, "size": len(raw)}
+
+
+def iter_blob(fileobj):
+    """Yield a blob in CHUNK_SIZE pieces, closing it afterwards."""
+    with fileobj:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def migrate_inline_signatures(agreements_coll, store, batch_size=100):
+    """
+    Move legacy inline data-URL signatures into the blob store.
+
+    Resumable: only documents still holding a string signature are visited,
+    and each update is guarded on the old value. Returns (moved, skipped).
+    """
+    moved = skipped = 0
+    cursor = agreements_coll.find(
+        {"signature": {"$type": "string"}}, {"signature": 1}
+    ).batch_size(batch_size)
+    for agr in cursor:
+        try:
+            ref = store_signature(store, agr["signature"])
+        except InvalidSignature:
+            skipped += 1
+            continue
+        agreements_coll.update_one(
+            {"_id": agr["_id"], "signature": agr["signature"]},
+            {"$set": {"signature_ref": ref}, "$unset": {"signature": ""}}
+        )
+        moved += 1
+    return moved, skipped
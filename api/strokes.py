@@ -0,0 +1,290 @@
+"""
+strokes.py
+
+Compact vector signatures and their on-demand rasterisation.
+
+signature.html records the pen strokes instead of exporting the canvas as
+a PNG. Points are quantised to whole canvas pixels and delta-encoded, then
+written as zigzag varints, so most points take two bytes:
+
+    version, width, height, stroke count,
+    per stroke: point count, x0, y0, dx1, dy1, dx2, dy2, ...
+
+The form posts this as unpadded base64url. A typical signature is a few
+hundred bytes, about a twentieth of the PNG data URL it replaces. The
+stored blob is the canonical re-encoding, so identical signatures share
+one blob.
+
+to_svg() and to_png() render at any width; RenderCache keeps recently
+rendered images, bounded by total bytes.
+
+Input is limited to what signature.html can produce (a 300x150 canvas and a
+few thousand points), and the rasteriser's work is bounded too: render_cost()
+sums the pixels each segment's bounding box covers at the largest render
+width, and strokes over MAX_RENDER_PIXELS are refused when stored and never
+rendered. The rasteriser is pure Python and runs in the request thread, so
+widths stop at twice the canvas and the budget keeps a worst-case PNG to a
+few hundred milliseconds; RenderCache makes that a one-off per
+(hash, format, width).
+"""
+
+import base64
+import binascii
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from signatures import InvalidSignature
+
+CONTENT_TYPE = "application/vnd.consent.strokes"
+VERSION = 1
+
+LINE_WIDTH = 2.0
+
+# the canvas in signature.html
+MAX_WIDTH = 300
+MAX_HEIGHT = 150
+MAX_STROKES = 200
+MAX_POINTS = 5_000
+MIN_RENDER_WIDTH = 16
+# 2x the canvas, enough for HiDPI screens
+MAX_RENDER_WIDTH = 600
+# pixels _stamp_segment may visit for one rendering (~0.7M/s in CPython);
+# a real signature needs ~50k at 600 px
+MAX_RENDER_PIXELS = 250_000
+
+
+# --- Encoding ---
+def _put_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag: small negatives stay small
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _varints(data):
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift > 63:
+                raise InvalidSignature("Signature strokes are malformed.")
+            continue
+        yield (value >> 1) ^ -(value & 1)
+        value = shift = 0
+    if shift:
+        raise InvalidSignature("Signature strokes are truncated.")
+
+
+def encode(width, height, strokes):
+    """Serialise strokes ([[(x, y), ...], ...] in pixels) to bytes."""
+    out = bytearray()
+    for value in (VERSION, width, height, len(strokes)):
+        _put_varint(out, value)
+    for stroke in strokes:
+        _put_varint(out, len(stroke))
+        px = py = 0
+        for x, y in stroke:
+            x, y = int(round(x)), int(round(y))
+            _put_varint(out, x - px)
+            _put_varint(out, y - py)
+            px, py = x, y
+    return bytes(out)
+
+
+def decode(data):
+    """Parse and validate bytes from encode(); return (width, height, strokes)."""
+    values = _varints(data)
+    try:
+        version, width, height, count = [next(values) for _ in range(4)]
+        if version != VERSION:
+            raise InvalidSignature("Unsupported signature format.")
+        if not (0 < width <= MAX_WIDTH and 0 < height <= MAX_HEIGHT) or not 0 <= count <= MAX_STROKES:
+            raise InvalidSignature("Signature dimensions are out of range.")
+        strokes = []
+        total = 0
+        for _ in range(count):
+            n = next(values)
+            total += n
+            if n <= 0 or total > MAX_POINTS:
+                raise InvalidSignature("Signature has too many points.")
+            x = y = 0
+            stroke = []
+            for _ in range(n):
+                x += next(values)
+                y += next(values)
+                if not (0 <= x <= width and 0 <= y <= height):
+                    raise InvalidSignature("Signature point outside the canvas.")
+                stroke.append((x, y))
+            strokes.append(stroke)
+    except StopIteration:
+        raise InvalidSignature("Signature strokes are truncated.") from None
+    if next(values, None) is not None:
+        raise InvalidSignature("Signature strokes have trailing data.")
+    return width, height, strokes
+
+
+def parse_field(text):
+    """Decode the posted base64url field into canonical stroke bytes."""
+    try:
+        data = base64.urlsafe_b64decode((text or "") + "=" * (-len(text or "") % 4))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidSignature("Signature data is not valid base64.") from e
+    width, height, strokes = decode(data)
+    if not strokes:
+        raise InvalidSignature("Signature is empty.")
+    check_render_cost(width, height, strokes)
+    return encode(width, height, strokes)
+
+
+def store_strokes(store, text):
+    """Validate a posted stroke field, store it once, and return the agreement ref."""
+    data = parse_field(text)
+    blob_hash = hashlib.sha256(data).hexdigest()
+    store.put(blob_hash, data, CONTENT_TYPE)
+    return {"hash": blob_hash, "content_type": CONTENT_TYPE, "size": len(data)}
+
+
+# --- Rendering ---
+def _render_size(width, height, out_width):
+    out_width = min(max(int(out_width or width), MIN_RENDER_WIDTH), MAX_RENDER_WIDTH)
+    return out_width, max(1, round(height * out_width / width))
+
+
+def _segments(strokes):
+    for stroke in strokes:
+        if len(stroke) == 1:
+            yield stroke[0], stroke[0]
+        yield from zip(stroke, stroke[1:])
+
+
+def render_cost(width, height, strokes, out_width=MAX_RENDER_WIDTH):
+    """Pixels the rasteriser visits: the sum of every segment's padded bounding box."""
+    out_width, _ = _render_size(width, height, out_width)
+    scale = out_width / width
+    pad = 2 * (LINE_WIDTH * scale / 2 + 1) + 1
+    return sum(
+        (abs(x2 - x1) * scale + pad) * (abs(y2 - y1) * scale + pad)
+        for (x1, y1), (x2, y2) in _segments(strokes)
+    )
+
+
+def check_render_cost(width, height, strokes, out_width=MAX_RENDER_WIDTH):
+    if render_cost(width, height, strokes, out_width) > MAX_RENDER_PIXELS:
+        raise InvalidSignature("Signature is too complex.")
+
+
+def to_svg(data, out_width=None):
+    """SVG document for stored stroke bytes, out_width pixels wide."""
+    width, height, strokes = decode(data)
+    out_width, out_height = _render_size(width, height, out_width)
+    path = []
+    for stroke in strokes:
+        (x0, y0), rest = stroke[0], stroke[1:]
+        # a lone point still shows as a dot thanks to the round caps
+        path.append(f"M{x0} {y0}" + ("".join(f"L{x} {y}" for x, y in rest) or "l0 0"))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{out_width}" height="{out_height}" '
+        f'viewBox="0 0 {width} {height}"><path d="{"".join(path)}" fill="none" stroke="black" '
+        f'stroke-width="{LINE_WIDTH:g}" stroke-linecap="round" stroke-linejoin="round"/></svg>'
+    ).encode()
+
+
+def _stamp_segment(alpha, w, h, x1, y1, x2, y2, radius):
+    """Antialiased capsule from (x1, y1) to (x2, y2) into an 8-bit alpha plane."""
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    reach = radius + 1
+    for py in range(max(0, int(min(y1, y2) - reach)), min(h, int(max(y1, y2) + reach) + 1)):
+        cy = py + 0.5
+        for px in range(max(0, int(min(x1, x2) - reach)), min(w, int(max(x1, x2) + reach) + 1)):
+            cx = px + 0.5
+            t = 0.0 if not length2 else max(0.0, min(1.0, ((cx - x1) * dx + (cy - y1) * dy) / length2))
+            ex, ey = cx - (x1 + t * dx), cy - (y1 + t * dy)
+            cover = radius + 0.5 - (ex * ex + ey * ey) ** 0.5
+            if cover > 0:
+                value = 255 if cover >= 1 else int(cover * 255)
+                i = py * w + px
+                if value > alpha[i]:
+                    alpha[i] = value
+
+
+def _png_chunk(kind, payload):
+    return (struct.pack(">I", len(payload)) + kind + payload
+            + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF))
+
+
+def to_png(data, out_width=None):
+    """Black-on-transparent PNG for stored stroke bytes, out_width pixels wide."""
+    width, height, strokes = decode(data)
+    # blobs stored before the budget existed are checked here too
+    check_render_cost(width, height, strokes, out_width)
+    out_width, out_height = _render_size(width, height, out_width)
+    scale = out_width / width
+    radius = LINE_WIDTH * scale / 2
+    alpha = bytearray(out_width * out_height)
+    for (x1, y1), (x2, y2) in _segments(strokes):
+        _stamp_segment(alpha, out_width, out_height, x1 * scale, y1 * scale, x2 * scale, y2 * scale, radius)
+
+    # grey+alpha rows, filter type 0; the grey channel is always black
+    raw = bytearray()
+    for row in range(out_height):
+        raw.append(0)
+        line = bytearray(2 * out_width)
+        line[1::2] = alpha[row * out_width:(row + 1) * out_width]
+        raw += line
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", out_width, out_height, 8, 4, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(bytes(raw), 6)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+RENDERERS = {
+    "png": ("image/png", to_png),
+    "svg": ("image/svg+xml", to_svg),
+}
+
+
+class RenderCache:
+    """Thread-safe LRU of rendered images, bounded by their total size."""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, blob_hash, data_loader, fmt="png", out_width=None):
+        """(content_type, bytes) for one rendering; data_loader() runs on a miss."""
+        content_type, renderer = RENDERERS[fmt]
+        if out_width is not None:
+            out_width = min(max(out_width, MIN_RENDER_WIDTH), MAX_RENDER_WIDTH)
+        key = (blob_hash, fmt, out_width)
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+                return content_type, image
+        image = renderer(data_loader(), out_width)
+        if len(image) <= self.max_bytes:
+            with self._lock:
+                if key not in self._items:
+                    self._items[key] = image
+                    self.size += len(image)
+                    while self.size > self.max_bytes:
+                        _, evicted = self._items.popitem(last=False)
+                        self.size -= len(evicted)
+        return content_type, image
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,111 @@
+"""
+suggest.py
+
+In-process prefix index of usernames for the recipient type-ahead.
+
+Usernames are kept as one sorted list of case-folded keys plus a parallel
+list of the names as registered; a prefix query is two bisects and a slice,
+so /users/suggest answers in microseconds without touching MongoDB. The
+index is loaded with one projected scan when the worker starts (warm_up() in
+app.py), and register() adds new names directly.
+
+Users registered through another worker are picked up at most once every
+refresh_seconds by a catch-up query on created_at, starting OVERLAP before
+the previous query began. ObjectIds from different machines and processes
+do not sort in insertion order, so _id cannot serve as a watermark; the
+overlap absorbs clock skew and inserts still in flight, and names seen
+twice are skipped.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+MIN_PREFIX = 2
+
+# how far each catch-up query reaches back before the previous one
+OVERLAP = timedelta(minutes=2)
+
+
+class UsernameIndex:
+    """Thread-safe sorted-array prefix index over usernames."""
+
+    def __init__(self, users=None, refresh_seconds=300.0, clock=time.monotonic, utcnow=datetime.utcnow):
+        self.users = users  # callable returning the users collection
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.utcnow = utcnow
+        self._keys = []
+        self._names = []
+        # wall-clock start of the last query; created_at is compared against it
+        self._queried_at = None
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _add(self, username):
+        key = username.casefold()
+        i = bisect_left(self._keys, key)
+        # case-folded duplicates are kept; exact duplicates are not
+        while i < len(self._keys) and self._keys[i] == key:
+            if self._names[i] == username:
+                return
+            i += 1
+        self._keys.insert(i, key)
+        self._names.insert(i, username)
+
+    def add(self, username):
+        """Index one newly registered user."""
+        with self._lock:
+            self._add(username)
+
+    def _catch_up(self, since):
+        added = 0
+        # served by the created_at index; the overlap returns some users again
+        for row in self.users().find({"created_at": {"$gte": since - OVERLAP}}, {"username": 1}):
+            if row.get("username"):
+                before = len(self._keys)
+                self._add(row["username"])
+                added += len(self._keys) - before
+        return added
+
+    def refresh(self, force=False):
+        """Full load on first use, then catch up on users added elsewhere."""
+        with self._lock:
+            now = self.clock()
+            if not force and self._refreshed is not None and now - self._refreshed < self.refresh_seconds:
+                return 0
+            queried_at = self.utcnow()
+            if self._refreshed is None:
+                # one scan in key order beats insort per row
+                rows = sorted(
+                    (row["username"].casefold(), row["username"])
+                    for row in self.users().find({}, {"username": 1})
+                    if row.get("username")
+                )
+                self._keys = [r[0] for r in rows]
+                self._names = [r[1] for r in rows]
+                added = len(rows)
+            else:
+                added = self._catch_up(self._queried_at)
+            self._queried_at = queried_at
+            self._refreshed = now
+            return added
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """Up to limit usernames starting with prefix (case-insensitive), sorted."""
+        self.refresh()
+        key = prefix.casefold()
+        with self._lock:
+            start = bisect_left(self._keys, key)
+            out = []
+            for i in range(start, min(start + limit, len(self._keys))):
+                if not self._keys[i].startswith(key):
+                    break
+                out.append(self._names[i])
+            return out
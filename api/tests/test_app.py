@@ -8,6 +8,7 @@ Contains tests for authentication, agreement workflows, and view functions.
 # pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
 # pylint: disable=unused-argument,redefined-outer-name,no-member,line-too-long,useless-return,trailing-newlines,too-few-public-methods
 
+import base64
 from datetime import datetime
 
 import pytest
@@ -15,7 +16,10 @@ from flask import session, url_for
 from bson.objectid import ObjectId
 
 from api import app
+from api.passwords import PasswordHasher
 
+PNG_BYTES = b'\x89PNG\r\n\x1a\nfake-signature'
+PNG_DATA_URL = 'data:image/png;base64,' + base64.b64encode(PNG_BYTES).decode()
 
 
 class DummyCursor:
@@ -32,11 +36,14 @@ class DummyCursor:
 
 class DummyCollection:
     """A dummy collection that records inserts and updates."""
+    name = 'agreements'
+
     def __init__(self):
         self.docs = []
         self.updated = []
+        self.bulk = []
 
-    def find_one(self, query):
+    def find_one(self, query, projection=None):
         return None
 
     def insert_one(self, doc):
@@ -45,37 +52,78 @@ class DummyCollection:
         self.docs.append(doc)
         return Result()
 
-    def find(self, query=None):
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+    def find(self, query=None, projection=None):
         return DummyCursor(self.docs)
 
+    def aggregate(self, pipeline):
+        return DummyCursor([])
+
     def update_one(self, filter_query, update):
+        class Result:
+            modified_count = 1
         self.updated.append((filter_query, update))
+        return Result()
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk.extend(requests)
+
+
+class FakeRepository:
+    """Stands in for repository.Repository with in-memory collections."""
+    def __init__(self):
+        self.users = DummyCollection()
+        self.agreements = DummyCollection()
+        self.collections = {}
+
+    def collection(self, name, durability='default'):
+        return self.collections.setdefault(name, DummyCollection())
+
+    def reads(self, name):
+        return getattr(self, name) if name in ('users', 'agreements') else self.collection(name)
+
+    def ping(self):
         return None
 
 
 @pytest.fixture(autouse=True)
-def dummy_db_and_templates(monkeypatch):
-    """Patch MongoDB collections and stub out render_template."""
-    dummy_users = DummyCollection()
-    dummy_agreements = DummyCollection()
-    monkeypatch.setattr(app, 'users_coll', dummy_users)
-    monkeypatch.setattr(app, 'agreements_coll', dummy_agreements)
+def dummy_templates(monkeypatch):
+    """Stub out render_template."""
     monkeypatch.setattr(app, 'render_template', lambda template, **kwargs: f"<html>{template}</html>")
     yield
 
 
 @pytest.fixture
-def client():
+def repo():
+    """In-memory collections injected through create_app()."""
+    return FakeRepository()
+
+
+@pytest.fixture
+def flask_app(repo, tmp_path):
+    """A fresh application wired to the fake repository."""
+    return app.create_app({
+        'TESTING': True,
+        'REPOSITORY': repo,
+        'SIGNATURE_STORE': 'local',
+        'SIGNATURE_DIR': str(tmp_path / 'blobs'),
+        'SESSION_BACKEND': 'memory',
+    })
+
+
+@pytest.fixture
+def client(flask_app):
     """Provide a Flask test client."""
-    app.app.config['TESTING'] = True
-    with app.app.test_client() as client:
+    with flask_app.test_client() as client:
         yield client
 
 
 @pytest.fixture
-def ctx():
+def ctx(flask_app):
     """Provide a Flask request context."""
-    with app.app.test_request_context():
+    with flask_app.test_request_context():
         yield
 
 
@@ -117,67 +165,121 @@ def test_current_user_none(ctx):
     assert app.current_user() is None
 
 
-def test_current_user_found(ctx, monkeypatch):
+def test_current_user_found(ctx, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'alice'}
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: fake)
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: fake)
     session['user_id'] = str(fake['_id'])
     assert app.current_user() == fake
 
 
-def test_current_user_cached(ctx, monkeypatch):
+def test_current_user_cached(ctx, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'bob'}
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: fake)
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: fake)
     session['user_id'] = str(fake['_id'])
     first = app.current_user()
     second = app.current_user()
     assert first is second
 
 
+def test_current_user_memoized_per_request(ctx, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'carol'}
+    calls = []
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: calls.append(q) or fake)
+    session['user_id'] = str(fake['_id'])
+    app.current_user()
+    app.current_user()
+    assert len(calls) == 1
+
+
+def test_current_user_process_cache(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'dave'}
+    calls = []
+    monkeypatch.setitem(flask_app.extensions, 'user_cache', app.UserCache(ttl=60))
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: calls.append(q) or fake)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    client.get('/agreements/search')
+    client.get('/agreements/search')
+    assert len(calls) == 1
+    flask_app.extensions['user_cache'].invalidate(fake['_id'])
+    client.get('/agreements/search')
+    assert len(calls) == 2
+    assert client.get('/internal/user-cache').status_code == 404
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'user_cache_lookups_total{result="hits"} 1' in text
+    assert 'user_cache_lookups_total{result="misses"} 2' in text
+    assert 'user_cache_invalidations_total 1' in text
+
+
 def test_register_get(client):
     assert client.get('/auth/register').status_code == 200
 
 
-def test_register_post_success(client, monkeypatch):
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: None)
+def test_register_post_success(client, monkeypatch, repo):
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: None)
     resp = client.post(
         '/auth/register',
         data={'username': 'u', 'email': 'e@x.com', 'password': 'pw'},
         follow_redirects=False
     )
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
 
 
-def test_register_post_duplicate(client, monkeypatch):
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: {'_id': ObjectId()})
+def test_register_post_duplicate(client, monkeypatch, repo):
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: {'_id': ObjectId()})
     resp = client.post(
         '/auth/register',
         data={'username': 'u', 'email': 'e@x.com', 'password': 'pw'},
         follow_redirects=False
     )
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('register'))
+    assert resp.headers['Location'].endswith(url_for('main.register'))
 
 
 def test_login_get(client):
     assert client.get('/auth/login').status_code == 200
 
 
-def test_login_post_success(client, monkeypatch):
+def test_login_post_success(client, monkeypatch, repo, flask_app):
     fake = {'_id': ObjectId(), 'username': 'u', 'password_hash': 'h'}
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: fake)
-    monkeypatch.setattr(app, 'check_password_hash', lambda h, p: True)
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: fake)
+    monkeypatch.setattr(flask_app.extensions['password_hasher'], 'verify', lambda h, p: True)
+    monkeypatch.setattr(flask_app.extensions['password_hasher'], 'needs_rehash', lambda h: False)
     resp = client.post(
         '/auth/login',
         data={'username_or_email': 'u', 'password': 'pw'},
         follow_redirects=False
     )
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
+
 
+def test_login_upgrades_outdated_hash(client, monkeypatch, repo, flask_app):
+    old_hash = PasswordHasher(method='pbkdf2:sha256:1000').hash('pw')
+    fake = {'_id': ObjectId(), 'username': 'u', 'password_hash': old_hash}
+    monkeypatch.setitem(flask_app.extensions, 'password_hasher', PasswordHasher(method='pbkdf2:sha256:2000'))
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: fake)
+    resp = client.post('/auth/login', data={'username_or_email': 'u', 'password': 'pw'})
+    assert resp.status_code == 302
+    (query, update), = repo.users.updated
+    assert query == {'_id': fake['_id']}
+    assert update['$set']['password_hash'].startswith('pbkdf2:sha256:2000$')
 
-def test_login_post_failure(client, monkeypatch):
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: None)
+
+def test_login_busy_returns_503(client, monkeypatch, repo, flask_app):
+    def busy(*args):
+        raise app.HashingBusy()
+    fake = {'_id': ObjectId(), 'username': 'u', 'password_hash': 'h'}
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: fake)
+    monkeypatch.setattr(flask_app.extensions['password_hasher'], 'verify', busy)
+    resp = client.post('/auth/login', data={'username_or_email': 'u', 'password': 'pw'})
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
+
+
+def test_login_post_failure(client, monkeypatch, repo):
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: None)
     resp = client.post(
         '/auth/login',
         data={'username_or_email': 'x', 'password': 'pw'},
@@ -191,7 +293,7 @@ def test_logout_clears_session(client):
         sess['user_id'] = '123'
     resp = client.get('/auth/logout', follow_redirects=False)
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('login'))
+    assert resp.headers['Location'].endswith(url_for('main.login'))
     with client.session_transaction() as sess:
         assert 'user_id' not in sess
 
@@ -212,18 +314,42 @@ def test_home_empty_agreements(client, monkeypatch):
     assert b'home.html' in resp.data
 
 
-def test_home_with_agreements(client, monkeypatch):
+def test_home_with_agreements(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr1 = {'party1': {'user_id': fake['_id']}, 'created_at': datetime.utcnow(), 'response_status': 'pending'}
     agr2 = {'party2': {'user_id': fake['_id']}, 'created_at': datetime.utcnow(), 'response_status': 'agreed'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    app.agreements_coll.docs[:] = [agr1, agr2]
+    repo.agreements.docs[:] = [agr1, agr2]
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.get('/', follow_redirects=False)
     assert resp.status_code == 200
 
 
+def test_home_bucket_pages(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    captured = {}
+    size = flask_app.config['PAGE_SIZE']
+    rows = [
+        {'_id': ObjectId(), 'title': str(i), 'created_at': datetime(2025, 1, 1), 'bucket': 'sent_pending'}
+        for i in range(size + 1)
+    ]
+    agreed_cursor = app.pagination.encode_cursor({'created_at': datetime(2025, 1, 1), '_id': ObjectId()})
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'aggregate', lambda p: DummyCursor([dict(r) for r in rows]))
+    monkeypatch.setattr(app, 'render_template', lambda t, **kw: captured.update(kw) or t)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    assert client.get(f'/?sent_agreed={agreed_cursor}').status_code == 200
+    assert len(captured['sent_pending']) == size
+    pages = captured['pages']
+    assert 'sent_pending=' in pages['sent_pending']['next']
+    assert f'sent_agreed={agreed_cursor}' in pages['sent_pending']['next']
+    assert pages['sent_pending']['first'] is None
+    assert pages['sent_agreed']['first'] == '/'
+    assert pages['recv_agreed'] == {'next': None, 'first': None}
+
+
 def test_step1_requires_login(client):
     resp = client.get('/agreements/new/step1', follow_redirects=False)
     assert resp.status_code == 302
@@ -237,30 +363,30 @@ def test_step1_get_initial(client, monkeypatch):
     assert client.get('/agreements/new/step1').status_code == 200
 
 
-def test_step1_post_failure_and_success(client, monkeypatch):
+def test_step1_post_failure_and_success(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     target = {'_id': ObjectId(), 'username': 'v'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     # failure
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: None)
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: None)
     res_fail = client.post(
         '/agreements/new/step1',
         data={'title': 'T', 'party2_username': 'x'},
         follow_redirects=False
     )
     assert res_fail.status_code == 302
-    assert res_fail.headers['Location'].endswith(url_for('step1'))
+    assert res_fail.headers['Location'].endswith(url_for('main.step1'))
     # success
-    monkeypatch.setattr(app.users_coll, 'find_one', lambda q: target)
+    monkeypatch.setattr(repo.users, 'find_one', lambda q: target)
     res_succ = client.post(
         '/agreements/new/step1',
         data={'title': 'T', 'party2_username': 'v'},
         follow_redirects=False
     )
     assert res_succ.status_code == 302
-    assert res_succ.headers['Location'].endswith(url_for('step2'))
+    assert res_succ.headers['Location'].endswith(url_for('main.step2'))
 
 
 def test_step2_requires_login(client):
@@ -289,7 +415,7 @@ def test_step2_get_and_post(client, monkeypatch):
         follow_redirects=False
     )
     assert resp_post.status_code == 302
-    assert resp_post.headers['Location'].endswith(url_for('signature_page'))
+    assert resp_post.headers['Location'].endswith(url_for('main.signature_page'))
 
 
 def test_signature_requires_login(client):
@@ -297,7 +423,7 @@ def test_signature_requires_login(client):
     assert resp.status_code == 302
 
 
-def test_signature_get_and_post(client, monkeypatch):
+def test_signature_get_and_post(client, monkeypatch, repo, flask_app):
     fake = {'_id': ObjectId(), 'username': 'u'}
     target = {'_id': ObjectId(), 'username': 'v'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
@@ -312,11 +438,64 @@ def test_signature_get_and_post(client, monkeypatch):
     # POST
     resp_post = client.post(
         '/agreements/new/signature',
-        data={'signature_data': 'sig'},
+        data={'signature_data': PNG_DATA_URL},
         follow_redirects=False
     )
     assert resp_post.status_code == 302
     assert '/agreements/' in resp_post.headers['Location']
+    stored = repo.agreements.docs[-1]
+    assert 'signature' not in stored
+    assert stored['signature_ref']['size'] == len(PNG_BYTES)
+    assert flask_app.extensions['signature_store'].exists(stored['signature_ref']['hash'])
+
+
+def test_signature_post_invalid_keeps_draft(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+        sess['agreement_data'] = {'title': 'T'}
+    resp = client.post('/agreements/new/signature', data={'signature_data': 'sig'})
+    assert resp.status_code == 302
+    assert resp.headers['Location'].endswith(url_for('main.signature_page'))
+    assert not repo.agreements.docs
+    with client.session_transaction() as sess:
+        assert sess['agreement_data'] == {'title': 'T'}
+
+
+def _stored_signature_hash(flask_app):
+    return app.store_signature(flask_app.extensions['signature_store'], PNG_DATA_URL)['hash']
+
+
+def test_signature_image_streams_with_cache_headers(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    sig_hash = _stored_signature_hash(flask_app)
+    agr = {'_id': ObjectId(), 'signature_ref': {'hash': sig_hash, 'content_type': 'image/png'}}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q, p=None: agr)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.get(f'/signatures/{sig_hash}')
+    assert resp.status_code == 200
+    assert resp.data == PNG_BYTES
+    assert resp.mimetype == 'image/png'
+    assert resp.headers['ETag'] == f'"{sig_hash}"'
+    assert 'immutable' in resp.headers['Cache-Control']
+    again = client.get(f'/signatures/{sig_hash}', headers={'If-None-Match': f'"{sig_hash}"'})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def test_signature_image_not_found(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    sig_hash = _stored_signature_hash(flask_app)
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q, p=None: None)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    assert client.get('/signatures/not-a-hash').status_code == 404
+    # stored, but not on any agreement this user is a party to
+    assert client.get(f'/signatures/{sig_hash}').status_code == 404
 
 
 def test_view_agreement_requires_login(client):
@@ -324,7 +503,7 @@ def test_view_agreement_requires_login(client):
     assert resp.status_code == 302
 
 
-def test_view_agreement_unauthorized(client, monkeypatch):
+def test_view_agreement_unauthorized(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {
         '_id': ObjectId(),
@@ -332,15 +511,15 @@ def test_view_agreement_unauthorized(client, monkeypatch):
         'party1': {'user_id': 'x', 'name': 'x'}
     }
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.get(f"/agreements/{agr['_id']}", follow_redirects=False)
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
 
 
-def test_view_agreement_authorized(client, monkeypatch):
+def test_view_agreement_authorized(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {
         '_id': ObjectId(),
@@ -348,12 +527,75 @@ def test_view_agreement_authorized(client, monkeypatch):
         'party1': {'user_id': 'x', 'name': 'x'}
     }
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     assert client.get(f"/agreements/{agr['_id']}").status_code == 200
 
 
+def test_view_agreement_conditional_get(client, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {
+        '_id': ObjectId(),
+        'party2': {'user_id': fake['_id']},
+        'party1': {'user_id': 'x', 'name': 'x'},
+        'created_at': datetime(2025, 1, 1),
+        'response_status': 'pending',
+    }
+    rendered = []
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    monkeypatch.setattr(app, 'render_template', lambda template, **kwargs: rendered.append(template) or 'page')
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+
+    first = client.get(f"/agreements/{agr['_id']}")
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    assert 'Cookie' in first.headers['Vary']
+    assert first.last_modified == datetime(2025, 1, 1).replace(tzinfo=first.last_modified.tzinfo)
+    etag = first.headers['ETag']
+
+    again = client.get(f"/agreements/{agr['_id']}", headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert rendered == ['view_agreement.html']
+
+    # a response changes the page, so the old validator no longer matches
+    agr.update(response_status='agreed', response_date=datetime(2025, 1, 2))
+    changed = client.get(f"/agreements/{agr['_id']}", headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_view_agreement_renders_pending_flashes(client, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {'_id': ObjectId(), 'party2': {'user_id': fake['_id']}, 'party1': {'user_id': 'x', 'name': 'x'}}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    etag = client.get(f"/agreements/{agr['_id']}").headers['ETag']
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('success', 'Saved')]
+    assert client.get(f"/agreements/{agr['_id']}", headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_static_urls_are_fingerprinted_and_immutable(client, flask_app):
+    with flask_app.test_request_context():
+        url = url_for('static', filename='styles.css')
+    assert '?v=' in url
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.cache_control.immutable
+    assert resp.cache_control.max_age == 365 * 24 * 3600
+    resp.close()
+    # a stale or missing version is not cached forever
+    stale = client.get('/static/styles.css?v=old')
+    assert not stale.cache_control.immutable
+    stale.close()
+
+
 def test_search_agreements_requires_login(client):
     resp = client.get('/agreements/search', follow_redirects=False)
     assert resp.status_code == 302
@@ -367,10 +609,10 @@ def test_search_agreements_get(client, monkeypatch):
     assert client.get('/agreements/search').status_code == 200
 
 
-def test_search_agreements_post(client, monkeypatch):
+def test_search_agreements_post(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find', lambda q: DummyCursor([
+    monkeypatch.setattr(repo.agreements, 'aggregate', lambda p: DummyCursor([
         {'title': 'T', 'party1': {'name': 'x'}, 'party2': {'name': 'v'}}
     ]))
     with client.session_transaction() as sess:
@@ -378,16 +620,33 @@ def test_search_agreements_post(client, monkeypatch):
     assert client.post('/agreements/search', data={'keyword': 'x'}).status_code == 200
 
 
+def test_search_agreements_next_page(client, monkeypatch, repo, flask_app):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    captured = {}
+    rows = [
+        {'_id': ObjectId(), 'title': str(i), 'score': 1, 'created_at': datetime(2025, 1, 1)}
+        for i in range(flask_app.config['PAGE_SIZE'] + 1)
+    ]
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'aggregate', lambda p: DummyCursor(rows))
+    monkeypatch.setattr(app, 'render_template', lambda t, **kw: captured.update(kw) or t)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    assert client.get('/agreements/search?keyword=x').status_code == 200
+    assert len(captured['results']) == flask_app.config['PAGE_SIZE']
+    assert 'cursor=' in captured['next_url'] and 'keyword=x' in captured['next_url']
+
+
 def test_respond_agreement_requires_login(client):
     resp = client.post('/agreements/123/respond', follow_redirects=False)
     assert resp.status_code == 302
 
 
-def test_respond_agreement_unauthorized(client, monkeypatch):
+def test_respond_agreement_unauthorized(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {'_id': ObjectId(), 'party2': {'user_id': ObjectId()}, 'response_status': 'pending'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.post(
@@ -396,14 +655,14 @@ def test_respond_agreement_unauthorized(client, monkeypatch):
         follow_redirects=False
     )
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
 
 
-def test_respond_agreement_success(client, monkeypatch):
+def test_respond_agreement_success(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
-    agr = {'_id': ObjectId(), 'party2': {'user_id': fake['_id']}, 'response_status': 'pending'}
+    agr = {'_id': ObjectId(), 'party1': {'user_id': ObjectId()}, 'party2': {'user_id': fake['_id']}, 'response_status': 'pending'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.post(
@@ -411,40 +670,195 @@ def test_respond_agreement_success(client, monkeypatch):
         data={'response': 'agreed'},
         follow_redirects=False
     )
-    assert app.agreements_coll.updated
+    assert repo.agreements.updated
     assert resp.status_code == 302
 
 
+def test_respond_agreement_rejects_unknown_decisions(client, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {'_id': ObjectId(), 'party1': {'user_id': ObjectId()}, 'party2': {'user_id': fake['_id']}, 'response_status': 'pending'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    for data in ({'response': 'maybe'}, {}):
+        resp = client.post(f"/agreements/{agr['_id']}/respond", data=data)
+        assert resp.headers['Location'].endswith(f"/agreements/{agr['_id']}")
+    assert not repo.agreements.updated
+    assert not repo.collection('user_stats').bulk
+
+
+def test_respond_agreement_lost_race_changes_nothing(client, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {'_id': ObjectId(), 'party1': {'user_id': ObjectId()}, 'party2': {'user_id': fake['_id']}, 'response_status': 'pending'}
+
+    class Unmodified:
+        modified_count = 0
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'update_one', lambda q, u: Unmodified())
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.post(f"/agreements/{agr['_id']}/respond", data={'response': 'agreed'})
+    assert resp.headers['Location'].endswith(f"/agreements/{agr['_id']}")
+    assert not repo.collection('user_stats').bulk
+
+
+def test_respond_agreement_invalidates_cached_rows(client, flask_app, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {'_id': ObjectId(), 'party1': {'user_id': ObjectId()}, 'party2': {'user_id': fake['_id']}, 'response_status': 'pending'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    cache = flask_app.extensions['fragment_cache']
+    assert flask_app.jinja_env.fragment_cache is cache
+    cache.set((str(agr['_id']), 'home.html', 'recv_pending'), '<li>row</li>')
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    client.post(f"/agreements/{agr['_id']}/respond", data={'response': 'agreed'})
+    assert len(cache) == 0
+
+
+def test_agreement_events_streams_local_status_changes(client, flask_app, monkeypatch, repo):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    agr = {'_id': ObjectId(), 'title': 'T', 'party1': {'user_id': ObjectId()}, 'party2': {'user_id': fake['_id']},
+           'response_status': 'pending'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
+    flask_app.config['SSE_MAX_SECONDS'] = 0.2
+    feed = flask_app.extensions['status_feed']
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+
+    resp = client.get('/agreements/events', buffered=False)
+    assert resp.mimetype == 'text/event-stream'
+    assert resp.headers['Cache-Control'] == 'no-cache'
+    # FakeRepository cannot watch, so the feed has fallen back to in-process
+    assert feed.source == 'local' and feed.subscriber_count() == 1
+    client.post(f"/agreements/{agr['_id']}/respond", data={'response': 'agreed'})
+    body = b''.join(resp.response).decode()
+    resp.close()
+    assert body.startswith('retry: ')
+    assert 'event: status' in body and '"status": "agreed"' in body
+    assert feed.subscriber_count() == 0
+
+
+def test_agreement_events_turns_clients_away_beyond_the_stream_cap(client, flask_app, monkeypatch):
+    monkeypatch.setattr(app, 'current_user', lambda: {'_id': ObjectId()})
+    flask_app.config['SSE_RETRY_SECONDS'] = 7
+    feed = flask_app.extensions['status_feed']
+    feed.max_subscribers = 1
+    held = feed.subscribe(ObjectId())
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(ObjectId())
+    resp = client.get('/agreements/events')
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '7'
+    assert resp.get_data(as_text=True) == 'retry: 7000\n\n'
+    feed.unsubscribe(held)
+
+
+def test_agreement_events_can_be_disabled(repo, tmp_path, monkeypatch):
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repo, 'LIVE_UPDATES': 'off',
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+                                'SESSION_BACKEND': 'memory'})
+    monkeypatch.setattr(app, 'current_user', lambda: {'_id': ObjectId()})
+    with flask_app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_id'] = str(ObjectId())
+        assert client.get('/agreements/events').status_code == 404
+
+
+def test_batch_respond_json_reports_per_item(client, monkeypatch):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    mine = str(ObjectId())
+    calls = []
+
+    def respond_many(coll, user_id, ids, decision, stats_coll=None):
+        calls.append((user_id, ids, decision))
+        return {mine: 'updated', 'bad': 'invalid_id'}, 1
+
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(app, 'respond_many', respond_many)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.post('/agreements/respond', json={'ids': [mine, 'bad'], 'response': 'agreed'})
+    assert resp.status_code == 200
+    assert resp.get_json() == {
+        'response': 'agreed', 'modified': 1, 'results': {mine: 'updated', 'bad': 'invalid_id'}
+    }
+    assert calls == [(fake['_id'], [mine, 'bad'], 'agreed')]
+
+
+def test_batch_respond_json_rejects_bad_decision(client, monkeypatch):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.post('/agreements/respond', json={'ids': [str(ObjectId())], 'response': 'maybe'})
+    assert resp.status_code == 400
+    assert 'response must be one of' in resp.get_json()['error']
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'agreed', 7])
+def test_batch_respond_json_rejects_non_object_bodies(client, monkeypatch, body):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.post('/agreements/respond', json=body)
+    assert resp.status_code == 400
+    assert resp.get_json() == {'error': 'request body must be a JSON object'}
+
+
+def test_batch_respond_form_redirects_home(client, monkeypatch):
+    fake = {'_id': ObjectId(), 'username': 'u'}
+    ids = [str(ObjectId()), str(ObjectId())]
+    seen = []
+
+    def respond_many(coll, user_id, agreement_ids, decision, stats_coll=None):
+        seen.append(agreement_ids)
+        return {i: 'updated' for i in agreement_ids}, 2
+
+    monkeypatch.setattr(app, 'current_user', lambda: fake)
+    monkeypatch.setattr(app, 'respond_many', respond_many)
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(fake['_id'])
+    resp = client.post('/agreements/respond', data={'agreement_ids': ids, 'response': 'rejected'})
+    assert resp.status_code == 302
+    assert resp.headers['Location'].endswith(url_for('main.home'))
+    assert seen == [ids]
+
+
 def test_edit_agreement_requires_login(client):
     resp = client.get('/agreements/123/edit', follow_redirects=False)
     assert resp.status_code == 302
 
 
-def test_edit_agreement_unauthorized(client, monkeypatch):
+def test_edit_agreement_unauthorized(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {'_id': ObjectId(), 'party1': {'user_id': ObjectId()}, 'response_status': 'rejected'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.get(f"/agreements/{agr['_id']}/edit", follow_redirects=False)
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
 
 
-def test_edit_agreement_wrong_status(client, monkeypatch):
+def test_edit_agreement_wrong_status(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {'_id': ObjectId(), 'party1': {'user_id': fake['_id']}, 'response_status': 'agreed'}
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.get(f"/agreements/{agr['_id']}/edit", follow_redirects=False)
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('home'))
+    assert resp.headers['Location'].endswith(url_for('main.home'))
 
 
-def test_edit_agreement_success(client, monkeypatch):
+def test_edit_agreement_success(client, monkeypatch, repo):
     fake = {'_id': ObjectId(), 'username': 'u'}
     agr = {
         '_id': ObjectId(),
@@ -455,9 +869,24 @@ def test_edit_agreement_success(client, monkeypatch):
         'response_status': 'rejected'
     }
     monkeypatch.setattr(app, 'current_user', lambda: fake)
-    monkeypatch.setattr(app.agreements_coll, 'find_one', lambda q: agr)
+    monkeypatch.setattr(repo.agreements, 'find_one', lambda q: agr)
     with client.session_transaction() as sess:
         sess['user_id'] = str(fake['_id'])
     resp = client.get(f"/agreements/{agr['_id']}/edit", follow_redirects=False)
     assert resp.status_code == 302
-    assert resp.headers['Location'].endswith(url_for('step2'))
+    assert resp.headers['Location'].endswith(url_for('main.step2'))
+
+
+def test_healthz(client):
+    assert client.get('/healthz').get_json() == {'status': 'ok'}
+
+
+def test_readyz_ready_and_unavailable(client, repo, monkeypatch):
+    ready = client.get('/readyz')
+    assert ready.status_code == 200 and ready.get_json()['status'] == 'ready'
+
+    def down():
+        raise app.PyMongoError('down')
+
+    monkeypatch.setattr(repo, 'ping', down)
+    assert client.get('/readyz').status_code == 503
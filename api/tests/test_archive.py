@@ -0,0 +1,151 @@
+"""
+test_archive.py
+
+Unit tests for moving settled agreements to agreements_archive and reading
+them back.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,redefined-outer-name
+
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import app, archive, export, search, userstats
+from api.benchmarks.memdb import MemoryRepository
+
+NOW = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def repository():
+    return MemoryRepository()
+
+
+def _agreement(repository, sender, recipient, status, days_ago, title='lease'):
+    doc = {'title': title, 'party1': {'user_id': sender, 'name': 'sender'},
+           'party2': {'user_id': recipient, 'name': 'recipient'}, 'content': 'c',
+           'response_status': status, 'created_at': NOW - timedelta(days=days_ago + 1),
+           'response_date': NOW - timedelta(days=days_ago) if status != 'pending' else None}
+    doc.update(search.index_fields(doc))
+    repository.agreements.insert_one(doc)
+    return doc
+
+
+def _archive(repository, **kwargs):
+    return archive.archive_settled(repository.agreements, repository.collection(archive.ARCHIVE_COLL),
+                                   30, now=NOW, **kwargs)
+
+
+def test_moves_only_settled_agreements_in_batches(repository):
+    alice, bob = ObjectId(), ObjectId()
+    old = [_agreement(repository, alice, bob, 'agreed', 60) for _ in range(3)]
+    recent = _agreement(repository, alice, bob, 'agreed', 5)
+    pending = _agreement(repository, alice, bob, 'pending', 90)
+    # can still be edited and resent, so it stays on the dashboard
+    rejected = _agreement(repository, alice, bob, 'rejected', 90)
+
+    assert _archive(repository, batch_size=2, max_batches=1) == 2
+    assert _archive(repository, batch_size=2) == 1
+    assert _archive(repository) == 0
+    hot = {d['_id'] for d in repository.agreements.find()}
+    assert hot == {recent['_id'], pending['_id'], rejected['_id']}
+    assert repository.collection(archive.ARCHIVE_COLL).count_documents({}) == len(old)
+
+
+def test_interrupted_batch_is_resumed(repository):
+    alice, bob = ObjectId(), ObjectId()
+    agr = _agreement(repository, alice, bob, 'agreed', 60)
+    archived = repository.collection(archive.ARCHIVE_COLL)
+    # copied, but the run died before the delete
+    archived.insert_one(dict(agr))
+    assert _archive(repository) == 1
+    assert archived.count_documents({}) == 1
+    assert repository.agreements.count_documents({}) == 0
+
+
+def test_answered_again_during_a_batch_stays_hot(repository):
+    alice, bob = ObjectId(), ObjectId()
+    agr = _agreement(repository, alice, bob, 'agreed', 60)
+    archived = repository.collection(archive.ARCHIVE_COLL)
+
+    class Racing:
+        """Revises the agreement between the copy and the delete."""
+        def find(self, query, projection=None):
+            return repository.agreements.find(query, projection)
+
+        def delete_many(self, query):
+            repository.agreements.update_one({'_id': agr['_id']}, {'$set': {'response_status': 'pending'}})
+            return repository.agreements.delete_many(query)
+
+    assert archive.archive_batch(Racing(), archived, NOW) == 0
+    assert repository.agreements.find_one({'_id': agr['_id']})['response_status'] == 'pending'
+    assert archived.count_documents({}) == 0
+
+
+def test_search_export_and_counters_read_through(repository):
+    alice, bob = ObjectId(), ObjectId()
+    cold = _agreement(repository, alice, bob, 'agreed', 60, title='old lease')
+    hot = _agreement(repository, alice, bob, 'pending', 1, title='new lease')
+    _archive(repository)
+
+    results, _ = search.search_agreements(repository.agreements, bob, 'lease',
+                                          archive=archive.ARCHIVE_COLL)
+    assert [r['_id'] for r in results] == [hot['_id'], cold['_id']]
+
+    rows = export.iter_merged([repository.agreements, repository.collection(archive.ARCHIVE_COLL)],
+                              export.export_query(alice))
+    assert [r['_id'] for r in rows] == [cold['_id'], hot['_id']]
+
+    counts = userstats.count(repository.agreements, [alice])[alice]
+    assert counts['sent'] == {'pending': 1, 'agreed': 1, 'rejected': 0}
+
+
+def test_archived_listing_pages_both_directions(repository):
+    alice, bob, carol = ObjectId(), ObjectId(), ObjectId()
+    sent = [_agreement(repository, alice, bob, 'agreed', 60 + i) for i in range(3)]
+    received = _agreement(repository, carol, alice, 'agreed', 70)
+    _agreement(repository, bob, carol, 'agreed', 60)
+    _archive(repository)
+    coll = repository.collection(archive.ARCHIVE_COLL)
+
+    page, cursor = archive.list_archived(coll, alice, page_size=3)
+    assert [r['_id'] for r in page] == [s['_id'] for s in sent]
+    assert 'content' not in page[0]
+    rest, last = archive.list_archived(coll, alice, cursor, page_size=3)
+    assert [r['_id'] for r in rest] == [received['_id']] and last is None
+
+
+def test_routes_and_command(repository, tmp_path):
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository,
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+    alice = repository.users.insert_one({'username': 'alice'}).inserted_id
+    bob = repository.users.insert_one({'username': 'bob'}).inserted_id
+    agreed = [_agreement(repository, alice, bob, 'agreed', 400 + i, title=f'lease {i}') for i in range(2)]
+    rejected = _agreement(repository, alice, bob, 'rejected', 400)
+
+    result = flask_app.test_cli_runner().invoke(args=['archive', '--batch-size', '1'])
+    assert 'before agreements: 3 documents' in result.output
+    assert 'after agreements_archive: 2 documents' in result.output
+    assert '2 agreement(s) archived.' in result.output
+    # archived by an older version, which also moved rejected agreements
+    repository.agreements.delete_many({'_id': rejected['_id']})
+    repository.collection(archive.ARCHIVE_COLL).insert_one(rejected)
+
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(alice)
+    assert client.get(f"/agreements/{agreed[0]['_id']}").status_code == 200
+    assert client.get(f"/agreements/{agreed[0]['_id']}/edit").status_code == 302
+    assert repository.agreements.count_documents({}) == 0
+
+    # the dashboard links to a paged listing of the archive
+    assert b'/agreements/archived' in client.get('/').data
+    page = client.get('/agreements/archived')
+    assert b'lease 0' in page.data and b'lease 1' in page.data and b'To: recipient' in page.data
+
+    # editing a rejected agreement brings it back to the hot collection
+    client.get(f"/agreements/{rejected['_id']}/edit")
+    assert repository.agreements.find_one({'_id': rejected['_id']})['title'] == 'lease'
+    assert repository.collection(archive.ARCHIVE_COLL).find_one({'_id': rejected['_id']}) is None
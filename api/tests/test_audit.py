@@ -0,0 +1,150 @@
+"""
+test_audit.py
+
+Unit tests for the queued, batch-written audit trail.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,redefined-outer-name
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import AutoReconnect
+
+from api import app, audit
+from api.benchmarks.memdb import MemoryRepository
+
+
+class RecordingCollection:
+    """Collects insert_many batches; optionally holds them until released."""
+    def __init__(self, gate=None, error=None):
+        self.batches = []
+        self.gate = gate
+        self.error = error
+        self.entered = threading.Event()
+
+    def insert_many(self, docs, ordered=True):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.batches.append(list(docs))
+
+
+def test_events_are_written_in_bounded_batches():
+    coll = RecordingCollection()
+    log = audit.AuditLog(lambda: coll, batch_size=2, flush_seconds=0.05)
+    user = ObjectId()
+    for i in range(5):
+        assert log.record('user.login', user, attempt=i)
+    assert log.flush()
+    written = [e for batch in coll.batches for e in batch]
+    assert [e['details']['attempt'] for e in written] == [0, 1, 2, 3, 4]
+    assert all(len(batch) <= 2 for batch in coll.batches)
+    assert written[0]['users'] == [user]
+    assert log.stats()['written'] == 5 and log.stats()['dropped'] == 0
+
+
+def test_a_full_queue_drops_after_a_short_wait():
+    gate = threading.Event()
+    coll = RecordingCollection(gate)
+    log = audit.AuditLog(lambda: coll, queue_size=1, batch_size=1, block_seconds=0.01)
+    log.record('a')
+    assert coll.entered.wait(1)  # the writer holds the first event
+    assert log.record('b')
+    began = time.monotonic()
+    assert not log.record('c')
+    assert time.monotonic() - began < 1
+    gate.set()
+    assert log.flush()
+    assert log.stats()['dropped'] == 1 and log.stats()['written'] == 2
+
+
+def test_failed_writes_are_counted_and_the_writer_survives():
+    coll = RecordingCollection(error=AutoReconnect('down'))
+    log = audit.AuditLog(lambda: coll, flush_seconds=0.01)
+    log.record('a')
+    assert log.flush()
+    coll.error = None
+    log.record('b')
+    assert log.flush()
+    assert log.stats()['failed'] == 1 and log.stats()['written'] == 1
+
+
+def test_zero_queue_size_disables_auditing():
+    log = audit.AuditLog(lambda: pytest.fail('no writes expected'), queue_size=0)
+    assert not log.record('a')
+    assert log.stats()['enabled'] is False
+
+
+def test_query_filters_and_pages_newest_first():
+    coll = MemoryRepository().collection(audit.AUDIT_COLL)
+    alice, bob = ObjectId(), ObjectId()
+    start = datetime(2026, 1, 1)
+    for i in range(5):
+        doc = audit.event('agreement.created' if i % 2 else 'user.login', alice, users=[bob])
+        doc['ts'] = start + timedelta(minutes=i)
+        coll.insert_one(doc)
+    coll.insert_one(audit.event('user.login', ObjectId()))
+
+    page, cursor = audit.query(coll, alice, page_size=3)
+    assert [e['ts'].minute for e in page] == [4, 3, 2]
+    rest, last = audit.query(coll, alice, cursor=cursor, page_size=3)
+    assert [e['ts'].minute for e in rest] == [1, 0] and last is None
+
+    created, _ = audit.query(coll, bob, actions=['agreement.created'])
+    assert [e['ts'].minute for e in created] == [3, 1]
+    recent, _ = audit.query(coll, bob, since=start + timedelta(minutes=3))
+    assert len(recent) == 2
+
+
+def test_routes_record_events(tmp_path):
+    repository = MemoryRepository()
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository, 'SESSION_BACKEND': 'memory',
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+                                'AUDIT_FLUSH_SECONDS': 0.01})
+    client = flask_app.test_client()
+    client.post('/auth/register', data={'username': 'alice', 'email': 'a@x.com', 'password': 'pw'})
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'username_or_email': 'alice', 'password': 'wrong'})
+    client.post('/auth/login', data={'username_or_email': 'alice', 'password': 'pw'})
+    assert flask_app.extensions['audit_log'].flush()
+
+    body = client.get('/audit/events').get_json()
+    assert [e['action'] for e in body['events']] == [
+        'user.login', 'user.login_failed', 'user.logout', 'user.registered']
+    assert body['events'][1]['details'] == {'known_user': True}
+    assert body['events'][1]['ip'] == '127.0.0.1'
+    only = client.get('/audit/events?action=user.logout').get_json()['events']
+    assert [e['action'] for e in only] == ['user.logout']
+    assert client.get('/internal/audit').status_code == 404
+    assert 'audit_events_total{outcome="written"} 4' in client.get('/metrics').get_data(as_text=True)
+
+
+def test_batch_responses_reach_the_senders_trail(tmp_path):
+    repository = MemoryRepository()
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository, 'SESSION_BACKEND': 'memory',
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+                                'AUDIT_FLUSH_SECONDS': 0.01})
+    alice = repository.users.insert_one({'username': 'alice'}).inserted_id
+    bob = repository.users.insert_one({'username': 'bob'}).inserted_id
+    agr = repository.agreements.insert_one({
+        'title': 't', 'party1': {'user_id': alice, 'name': 'alice'}, 'party2': {'user_id': bob, 'name': 'bob'},
+        'response_status': 'pending', 'created_at': datetime(2026, 1, 1)}).inserted_id
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(bob)
+    client.post('/agreements/respond', json={'ids': [str(agr)], 'response': 'agreed'})
+    assert flask_app.extensions['audit_log'].flush()
+
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(alice)
+    events = client.get('/audit/events').get_json()['events']
+    assert [(e['action'], e['actor'], e['target']) for e in events] == [
+        ('agreement.responded', str(bob), str(agr))]
+    # the other party's address is not shown
+    assert 'ip' not in events[0] and 'ip' not in events[0]['details']
@@ -0,0 +1,89 @@
+"""
+test_benchmarks.py
+
+Smoke tests for the benchmark suite and its in-process Mongo stand-in.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import json
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from api import dashboard, search, userstats
+from api.benchmarks import memdb, render, run, seed
+from api.signatures import LocalBlobStore
+
+
+def test_memdb_query_operators():
+    coll = memdb.MemoryRepository().agreements
+    coll.insert_many([
+        {'party2': {'user_id': 1}, 'n': 1, 'tags': ['a', 'b']},
+        {'party2': {'user_id': 2}, 'n': 2, 'tags': ['b']},
+        {'party2': {'user_id': 1}, 'n': 3},
+    ])
+    assert coll.count_documents({'party2.user_id': 1}) == 2
+    assert coll.count_documents({'tags': {'$all': ['a', 'b']}}) == 1
+    assert coll.count_documents({'n': {'$gte': 2}, 'tags': {'$exists': False}}) == 1
+    assert [d['n'] for d in coll.find({'$or': [{'n': 1}, {'n': 3}]}).sort('n', -1)] == [3, 1]
+    coll.update_one({'n': 2}, {'$set': {'party2.user_id': 1}, '$inc': {'n': 10}})
+    assert coll.find_one({'n': 12}, {'party2': 1})['party2'] == {'user_id': 1}
+
+
+def test_memdb_runs_dashboard_and_search_pipelines():
+    repository = memdb.MemoryRepository()
+    uid = ObjectId()
+    for day in (1, 2, 3):
+        doc = {'title': f'Beach trip {day}', 'party1': {'user_id': ObjectId(), 'name': 'alice'},
+               'party2': {'user_id': uid, 'name': 'bob'}, 'created_at': datetime(2025, 1, day),
+               'response_status': 'agreed'}
+        doc.update(search.index_fields(doc))
+        repository.agreements.insert_one(doc)
+    buckets, cursors = dashboard.fetch_dashboard(repository.agreements, uid, {}, 2)
+    assert [a['title'] for a in buckets['recv_agreed']] == ['Beach trip 3', 'Beach trip 2']
+    assert cursors['recv_agreed'] is not None and buckets['sent_pending'] == []
+    results, _ = search.search_agreements(repository.agreements, uid, 'bea tri', page_size=5)
+    assert len(results) == 3
+
+
+def test_percentile_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]
+    assert run.percentile(values, 50) == 0.05
+    assert run.percentile(values, 99) == 0.099
+    assert run.percentile([], 95) == 0.0
+
+
+def test_compare_flags_p95_regressions(capsys):
+    old = {'routes': {'home': {'p95_ms': 10.0}, 'login': {'p95_ms': 100.0}}}
+    new = {'routes': {'home': {'p95_ms': 15.0}, 'login': {'p95_ms': 90.0}, 'step1': {'p95_ms': 1.0}}}
+    assert run.compare(old, new, threshold=0.2) == ['home']
+    assert '+50.0%' in capsys.readouterr().out
+
+
+def test_short_run_writes_results(tmp_path):
+    out = tmp_path / 'results.json'
+    assert run.main([
+        '--users', '5', '--agreements', '40', '--signature-bytes', '1000',
+        '--hash-method', 'pbkdf2:sha256:1000', '--concurrency', '2',
+        '--duration', '0.5', '--out', str(out),
+    ]) == 0
+    result = json.loads(out.read_text())
+    assert result['meta']['agreements'] == 40
+    assert 'home' in result['routes']
+    assert all(stats['errors'] == 0 for stats in result['routes'].values())
+
+
+def test_seed_fills_the_user_counters(tmp_path):
+    repository = memdb.MemoryRepository()
+    seed.seed(repository, LocalBlobStore(str(tmp_path)), 'hash', users=4, agreements=30, signature_bytes=600)
+    stats = repository.collection(userstats.STATS_COLL)
+    assert stats.count_documents({}) == 4
+    recount = userstats.count(repository.agreements)
+    assert all(userstats.get(stats, user_id) == values for user_id, values in recount.items())
+
+
+def test_render_benchmark_reports_each_stage():
+    result = render.measure(rows=40, repeat=1)
+    assert result['rows'] == 40
+    assert all(result[f'{stage}_ms'] > 0 for stage in ('cold', 'bytecode', 'uncached', 'fragments'))
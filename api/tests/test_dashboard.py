@@ -0,0 +1,85 @@
+"""
+test_dashboard.py
+
+Unit tests for the single-round-trip home() dashboard query.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+# pylint: disable=too-few-public-methods
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from api import dashboard, pagination
+
+
+class UnionCollection:
+    """Records the pipeline it was given and returns canned tagged rows."""
+    name = 'agreements'
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter([dict(r) for r in self.rows])
+
+
+def _row(bucket, day):
+    return {'_id': ObjectId(), 'title': f'{bucket}-{day}', 'created_at': datetime(2025, 1, day), 'bucket': bucket}
+
+
+def test_page_cursors_ignores_garbage():
+    token = pagination.encode_cursor({'created_at': datetime(2025, 1, 1), '_id': ObjectId()})
+    cursors = dashboard.page_cursors({'sent_pending': token, 'sent_agreed': 'nope'})
+    assert cursors['sent_pending'][0] == datetime(2025, 1, 1)
+    assert cursors['sent_agreed'] is None and cursors['recv_agreed'] is None
+
+
+def test_bucket_match_pending_includes_missing_status():
+    uid = ObjectId()
+    assert dashboard.bucket_match('sent_pending', uid) == {
+        'party1.user_id': uid, 'response_status': {'$in': ['pending', 'rejected', None]}
+    }
+    assert dashboard.bucket_match('recv_agreed', uid) == {
+        'party2.user_id': uid, 'response_status': 'agreed'
+    }
+
+
+def test_pipeline_is_one_union_of_indexed_branches():
+    uid = ObjectId()
+    pipeline = dashboard.dashboard_pipeline('agreements', uid, {}, 20)
+    stages = [next(iter(stage)) for stage in pipeline]
+    assert stages == ['$match', '$sort', '$limit', '$project'] + ['$unionWith'] * 3
+    assert pipeline[1] == {'$sort': {'created_at': -1, '_id': -1}}
+    assert pipeline[2] == {'$limit': 21}
+    project = pipeline[3]['$project']
+    assert 'signature_ref' not in project and 'content' not in project
+    # cached rows are keyed by status, revision and response date
+    assert {'response_status', 'revision', 'response_date'} <= set(project)
+    branch = pipeline[4]['$unionWith']
+    assert branch['coll'] == 'agreements'
+    assert branch['pipeline'][0]['$match'] == dashboard.bucket_match('sent_agreed', uid)
+
+
+def test_cursor_bounds_only_its_own_branch():
+    uid = ObjectId()
+    after = [datetime(2025, 1, 5), ObjectId()]
+    pipeline = dashboard.dashboard_pipeline('agreements', uid, {'recv_pending': after}, 20)
+    recv_pending = pipeline[5]['$unionWith']['pipeline'][0]['$match']
+    assert recv_pending['$and'][1] == pagination.keyset_match(after)
+    assert '$and' not in pipeline[0]['$match']
+
+
+def test_fetch_dashboard_groups_and_pages():
+    rows = [_row('sent_pending', d) for d in (3, 2, 1)] + [_row('recv_agreed', 1)]
+    coll = UnionCollection(rows)
+    buckets, next_cursors = dashboard.fetch_dashboard(coll, ObjectId(), {}, 2)
+    assert len(coll.pipelines) == 1
+    assert [a['title'] for a in buckets['sent_pending']] == ['sent_pending-3', 'sent_pending-2']
+    assert 'bucket' not in buckets['sent_pending'][0]
+    assert pagination.decode_cursor(next_cursors['sent_pending'])[1] == rows[1]['_id']
+    assert next_cursors['recv_agreed'] is None
+    assert buckets['sent_agreed'] == []
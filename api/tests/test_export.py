@@ -0,0 +1,101 @@
+"""
+test_export.py
+
+Unit tests for streaming CSV/NDJSON export.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import export
+from api.app import create_app
+from api.benchmarks.memdb import MemoryRepository
+
+
+def _agreement(p1, p2, day, status='agreed', sig='ab' * 32):
+    return {
+        '_id': ObjectId(), 'title': f'Day {day}', 'created_at': datetime(2025, 1, day),
+        'party1': {'user_id': p1, 'name': 'alice'}, 'party2': {'user_id': p2, 'name': 'bob'},
+        'content': {'contraception': 'yes'}, 'response_status': status,
+        'signature_ref': {'hash': sig}, 'search_terms': ['d', 'da', 'day'],
+    }
+
+
+def test_query_filters_dates_inclusively_and_status():
+    uid = ObjectId()
+    query = export.export_query(uid, '2025-01-02', '2025-01-03', 'pending')
+    assert query['$or'] == [{'party1.user_id': uid}, {'party2.user_id': uid}]
+    assert query['created_at'] == {'$gte': datetime(2025, 1, 2), '$lt': datetime(2025, 1, 4)}
+    assert query['response_status'] == {'$nin': ['agreed', 'rejected']}
+
+
+@pytest.mark.parametrize('args', [('01/02/2025', None, None), (None, None, 'maybe')])
+def test_query_rejects_bad_filters(args):
+    with pytest.raises(export.InvalidExport):
+        export.export_query(ObjectId(), *args)
+
+
+def test_generators_pull_one_document_at_a_time():
+    me = ObjectId()
+    pulled = []
+
+    def docs():
+        for day in (1, 2, 3):
+            pulled.append(day)
+            yield _agreement(me, ObjectId(), day)
+
+    lines = export.iter_csv(docs(), me)
+    assert next(lines).startswith('id,title,role')
+    next(lines)
+    assert pulled == [1]
+
+
+def test_csv_with_signature_references():
+    me = ObjectId()
+    lines = export.iter_csv([_agreement(ObjectId(), me, 1)], me, lambda h: f'https://x/signatures/{h}')
+    rows = list(csv.DictReader(io.StringIO(''.join(lines))))
+    assert rows[0]['role'] == 'received'
+    assert rows[0]['signature_url'] == 'https://x/signatures/' + 'ab' * 32
+    assert 'search_terms' not in rows[0]
+
+
+def test_unknown_format_fails_before_output():
+    with pytest.raises(export.InvalidExport):
+        export.stream('xml', [], ObjectId())
+
+
+def test_export_route_streams_filtered_ndjson(tmp_path):
+    repository = MemoryRepository()
+    me = repository.users.insert_one({'username': 'alice'}).inserted_id
+    other = ObjectId()
+    for day, status in ((1, 'agreed'), (2, 'pending'), (3, 'agreed'), (9, 'agreed')):
+        repository.agreements.insert_one(_agreement(me, other, day, status))
+    repository.agreements.insert_one(_agreement(other, ObjectId(), 2))
+    client = create_app({
+        'TESTING': True, 'REPOSITORY': repository,
+        'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+    }).test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(me)
+
+    resp = client.get('/agreements/export?format=ndjson&from=2025-01-01&to=2025-01-03&status=agreed')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.mimetype == 'application/x-ndjson'
+    assert 'attachment' in resp.headers['Content-Disposition']
+    rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert [r['title'] for r in rows] == ['Day 1', 'Day 3']
+    assert 'signature_hash' not in rows[0]
+
+    resp = client.get('/agreements/export?format=csv&signatures=1')
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert len(rows) == 4 and rows[0]['signature_url'].startswith('http://localhost/signatures/')
+
+    assert client.get('/agreements/export?format=pdf').status_code == 400
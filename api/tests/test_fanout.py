@@ -0,0 +1,132 @@
+"""
+test_fanout.py
+
+Unit tests for sending one agreement to many recipients.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import base64
+import io
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+from api import fanout
+from api.app import create_app
+from api.benchmarks.memdb import MemoryRepository
+
+PNG_DATA_URL = 'data:image/png;base64,' + base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'0' * 64).decode()
+
+
+class CountingUsers:
+    def __init__(self, inner):
+        self.inner = inner
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return self.inner.find(query, projection)
+
+
+@pytest.fixture(name='repository')
+def fixture_repository():
+    repository = MemoryRepository()
+    for name in ('alice', 'bob', 'carol', 'dave'):
+        repository.users.insert_one({'username': name})
+    return repository
+
+
+def _user(repository, name):
+    return repository.users.find_one({'username': name})
+
+
+def test_parse_recipients_merges_text_and_csv():
+    csv_bytes = b'email,username\nx@example.com,carol\ny@example.com,bob\n'
+    assert fanout.parse_recipients('bob, dave;erin\nbob', csv_bytes) == ['bob', 'dave', 'erin', 'carol']
+    assert fanout.parse_recipients('', b'\xef\xbb\xbfcarol\ndave\n') == ['carol', 'dave']
+
+
+@pytest.mark.parametrize('text, csv_bytes', [
+    ('', b''),
+    (' '.join(f'u{i}' for i in range(fanout.MAX_RECIPIENTS + 1)), b''),
+    ('', b'x' * (fanout.MAX_CSV_BYTES + 1)),
+])
+def test_parse_recipients_limits(text, csv_bytes):
+    with pytest.raises(fanout.InvalidRecipients):
+        fanout.parse_recipients(text, csv_bytes)
+
+
+def test_create_job_resolves_in_one_query(repository):
+    users = CountingUsers(repository.users)
+    jobs = repository.collection(fanout.JOBS_COLL)
+    alice = _user(repository, 'alice')
+    job_id = fanout.create_job(jobs, users, alice['_id'], ['bob', 'alice', 'zed', 'carol'])
+    assert users.queries == [{'username': {'$in': ['bob', 'alice', 'zed', 'carol']}}]
+    job = fanout.load_job(jobs, str(job_id), alice['_id'])
+    assert [r['status'] for r in job['recipients']] == ['pending', 'self', 'unknown_user', 'pending']
+    assert fanout.load_job(jobs, str(job_id), ObjectId()) is None
+    assert fanout.load_job(jobs, 'garbage', alice['_id']) is None
+
+
+def test_run_job_inserts_once_and_only_once(repository):
+    jobs = repository.collection(fanout.JOBS_COLL)
+    alice = _user(repository, 'alice')
+    job_id = fanout.create_job(jobs, repository.users, alice['_id'], ['bob', 'carol', 'zed'])
+    job = jobs.find_one({'_id': job_id})
+    template = {'title': 'Movie night', 'party1': {'user_id': alice['_id'], 'name': 'alice'},
+                'content': {'contraception': 'yes'}, 'signature_ref': {'hash': 'abc'}}
+    recipients = fanout.run_job(jobs, repository.agreements, job, template)
+    assert [r['status'] for r in recipients] == ['created', 'created', 'unknown_user']
+    docs = list(repository.agreements.find({'fanout_id': job_id}))
+    assert sorted(d['party2']['name'] for d in docs) == ['bob', 'carol']
+    assert {d['signature_ref']['hash'] for d in docs} == {'abc'}
+    assert 'movie' in docs[0]['search_words']
+    assert jobs.find_one({'_id': job_id})['created'] == 2
+    # a second submit of the same wizard must not send again
+    assert fanout.run_job(jobs, repository.agreements, job, template) is None
+    assert repository.agreements.count_documents({'fanout_id': job_id}) == 2
+
+
+def test_run_job_reports_partial_failures(repository):
+    class FailingSecond:
+        def insert_many(self, docs, ordered=True):
+            assert ordered is False
+            raise BulkWriteError({'writeErrors': [{'index': 1, 'errmsg': 'boom'}]})
+
+    jobs = repository.collection(fanout.JOBS_COLL)
+    alice = _user(repository, 'alice')
+    job_id = fanout.create_job(jobs, repository.users, alice['_id'], ['bob', 'carol'])
+    recipients = fanout.run_job(jobs, FailingSecond(), jobs.find_one({'_id': job_id}),
+                                {'title': 't', 'party1': {'user_id': alice['_id'], 'name': 'alice'}})
+    assert [r['status'] for r in recipients] == ['created', 'failed']
+
+
+def test_wizard_fan_out_end_to_end(repository, tmp_path):
+    flask_app = create_app({
+        'TESTING': True, 'REPOSITORY': repository,
+        'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+    })
+    client = flask_app.test_client()
+    alice = _user(repository, 'alice')
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(alice['_id'])
+    feed = flask_app.extensions['status_feed']
+    feed.source = 'local'
+    bob_tab = feed.subscribe(_user(repository, 'bob')['_id'])
+
+    resp = client.post('/agreements/new/step1', data={
+        'title': 'Group hike', 'recipients': 'bob',
+        'recipients_csv': (io.BytesIO(b'username\ncarol\nnobody\n'), 'people.csv'),
+    }, content_type='multipart/form-data')
+    assert resp.headers['Location'].endswith('/agreements/new/step2')
+    client.post('/agreements/new/step2', data={'contraception': 'yes'})
+    resp = client.post('/agreements/new/signature', data={'signature_data': PNG_DATA_URL})
+    assert '/agreements/bulk/' in resp.headers['Location']
+
+    assert sorted(a['party2']['name'] for a in repository.agreements.find({})) == ['bob', 'carol']
+    assert bob_tab.get(0)['title'] == 'Group hike'
+    report = client.get(resp.headers['Location'])
+    assert report.status_code == 200
+    assert b'No such user' in report.data
@@ -0,0 +1,92 @@
+"""
+test_fragments.py
+
+Unit tests for the {% cache %} fragment cache and the bytecode cache.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring
+
+from jinja2 import DictLoader, Environment
+
+from api import fragments
+
+ROW = '{% for r in rows %}{% cache r.id, r.status %}<li>{{ r.title }} {{ count(r) }}</li>{% endcache %}{% endfor %}'
+
+
+def env_with(cache, templates=None):
+    env = Environment(loader=DictLoader(templates or {'rows.html': ROW}),
+                      extensions=[fragments.FragmentCacheExtension], autoescape=True)
+    env.fragment_cache = cache
+    return env
+
+
+def counting():
+    calls = []
+    return calls, lambda row: calls.append(row['id']) or len(calls)
+
+
+def test_rows_render_once_until_their_key_changes():
+    cache = fragments.FragmentCache()
+    template = env_with(cache).get_template('rows.html')
+    calls, count = counting()
+    rows = [{'id': 'a', 'status': 'pending', 'title': 'One'}, {'id': 'b', 'status': 'pending', 'title': 'Two'}]
+
+    first = template.render(rows=rows, count=count)
+    assert first == '<li>One 1</li><li>Two 2</li>'
+    assert template.render(rows=rows, count=count) == first
+    assert calls == ['a', 'b']
+
+    rows[0]['status'] = 'agreed'
+    assert template.render(rows=rows, count=count) == '<li>One 3</li><li>Two 2</li>'
+    assert cache.stats()['hits'] == 3
+
+
+def test_invalidate_drops_every_fragment_of_an_agreement():
+    cache = fragments.FragmentCache()
+    cache.set(('a', 'home.html', 'pending'), 'x')
+    cache.set(('a', 'search_results.html'), 'y')
+    cache.set(('b', 'home.html', 'pending'), 'z')
+    cache.invalidate('a', 'missing')
+    assert len(cache) == 1
+    assert cache.get(('b', 'home.html', 'pending')) == 'z'
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_lru_eviction_keeps_tags_consistent():
+    cache = fragments.FragmentCache(maxsize=2)
+    for tag in 'abc':
+        cache.set((tag, 't'), tag)
+    assert cache.get(('a', 't')) is None
+    cache.invalidate('a', 'b')
+    assert len(cache) == 1
+
+
+def test_output_is_escaped_once_and_disabled_cache_renders_live():
+    calls, count = counting()
+    rows = [{'id': 'a', 'status': 'p', 'title': '<b>'}]
+    cached = env_with(fragments.FragmentCache()).get_template('rows.html')
+    assert cached.render(rows=rows, count=count) == '<li>&lt;b&gt; 1</li>'
+    assert cached.render(rows=rows, count=count) == '<li>&lt;b&gt; 1</li>'
+
+    for cache in (None, fragments.FragmentCache(maxsize=0)):
+        live = env_with(cache).get_template('rows.html')
+        live.render(rows=rows, count=count)
+        live.render(rows=rows, count=count)
+    assert len(calls) == 5
+
+
+def test_same_key_in_two_templates_does_not_collide():
+    cache = fragments.FragmentCache()
+    env = env_with(cache, {
+        'one.html': '{% cache "a" %}one{% endcache %}',
+        'two.html': '{% cache "a" %}two{% endcache %}',
+    })
+    assert env.get_template('one.html').render() == 'one'
+    assert env.get_template('two.html').render() == 'two'
+
+
+def test_bytecode_cache_persists_compiled_templates(tmp_path):
+    directory = tmp_path / 'jinja'
+    Environment(loader=DictLoader({'rows.html': ROW}), extensions=[fragments.FragmentCacheExtension],
+                bytecode_cache=fragments.bytecode_cache(str(directory))).get_template('rows.html')
+    assert len(list(directory.iterdir())) == 1
@@ -0,0 +1,73 @@
+"""
+test_gunicorn_conf.py
+
+Unit tests for the production serving configuration.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import os
+import runpy
+from types import SimpleNamespace
+
+import pytest
+
+CONF = os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py')
+
+
+def test_sizes_come_from_environment(monkeypatch):
+    monkeypatch.setenv('WEB_WORKERS', '3')
+    monkeypatch.setenv('WEB_THREADS', '8')
+    monkeypatch.setenv('PORT', '8000')
+    conf = runpy.run_path(CONF)
+    assert (conf['workers'], conf['threads']) == (3, 8)
+    assert conf['bind'] == '0.0.0.0:8000'
+    assert conf['worker_class'] == 'gthread'
+
+
+def test_workers_default_to_core_count(monkeypatch):
+    monkeypatch.delenv('WEB_WORKERS', raising=False)
+    assert runpy.run_path(CONF)['workers'] == os.cpu_count()
+
+
+def test_workers_import_app_after_fork():
+    # a preloaded app would share one MongoClient across forked workers
+    assert runpy.run_path(CONF)['preload_app'] is False
+
+
+def test_on_starting_refuses_without_indexes(monkeypatch, tmp_path):
+    conf = runpy.run_path(CONF)
+    closed = []
+    stale = tmp_path / '123.json'
+    stale.write_text('{}')
+
+    def missing(db):
+        raise RuntimeError('missing index')
+
+    monkeypatch.setenv('AUTO_MIGRATE', '0')
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr('repository.Repository.db', property(lambda self: 'db'))
+    monkeypatch.setattr('repository.Repository.close', lambda self: closed.append(True))
+    monkeypatch.setattr('migrations.verify_indexes', missing)
+    with pytest.raises(RuntimeError):
+        conf['on_starting'](server=None)
+    assert closed == [True]
+    # snapshots from a previous master run are not summed into the new one
+    assert not stale.exists()
+
+
+def test_child_exit_folds_the_workers_snapshot(monkeypatch, tmp_path):
+    conf = runpy.run_path(CONF)
+    (tmp_path / '4242.json').write_text('{"hits": {"kind": "counter", "rows": [[[], 3]]}}')
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    conf['child_exit'](server=None, worker=SimpleNamespace(pid=4242))
+    assert not (tmp_path / '4242.json').exists()
+    assert '"hits"' in (tmp_path / 'dead.json').read_text()
+
+
+def test_post_worker_init_warms_the_loaded_app(monkeypatch):
+    conf = runpy.run_path(CONF)
+    warmed = []
+    monkeypatch.setattr('app.warm_up', warmed.append)
+    conf['post_worker_init'](worker=SimpleNamespace(wsgi='loaded app'))
+    assert warmed == ['loaded app']
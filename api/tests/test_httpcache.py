@@ -0,0 +1,56 @@
+"""
+test_httpcache.py
+
+Unit tests for agreement validators and static file fingerprints.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,line-too-long
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from api import httpcache
+
+
+def agreement(**fields):
+    doc = {'_id': ObjectId('65a000000000000000000001'), 'created_at': datetime(2025, 1, 1), 'response_status': 'pending'}
+    doc.update(fields)
+    return doc
+
+
+def test_etag_is_stable_for_the_same_version_and_viewer():
+    assert httpcache.agreement_validators(agreement(), 'u1', 'd') == httpcache.agreement_validators(agreement(), 'u1', 'd')
+
+
+def test_etag_changes_with_anything_the_page_shows():
+    base, _ = httpcache.agreement_validators(agreement(), 'u1', 'd')
+    assert httpcache.agreement_validators(agreement(), 'u2', 'd')[0] != base
+    assert httpcache.agreement_validators(agreement(), 'u1', 'd2')[0] != base
+    assert httpcache.agreement_validators(agreement(revision=2), 'u1', 'd')[0] != base
+    assert httpcache.agreement_validators(agreement(response_status='agreed'), 'u1', 'd')[0] != base
+    assert httpcache.agreement_validators(agreement(signature_ref={'hash': 'ab'}), 'u1', 'd')[0] != base
+
+
+def test_last_modified_is_the_latest_timestamp():
+    assert httpcache.last_modified(agreement()) == datetime(2025, 1, 1)
+    assert httpcache.last_modified(agreement(response_date=datetime(2025, 2, 1))) == datetime(2025, 2, 1)
+    assert httpcache.last_modified({'_id': 1}) is None
+
+
+def test_manifest_tracks_file_contents(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'a.css').write_text('body{}')
+    first = httpcache.tree_manifest(str(tmp_path))
+    assert set(first) == {'css/a.css'}
+    assert len(first['css/a.css']) == httpcache.HASH_LEN
+
+    (tmp_path / 'css' / 'a.css').write_text('body{color:red}')
+    second = httpcache.tree_manifest(str(tmp_path))
+    assert second['css/a.css'] != first['css/a.css']
+    assert httpcache.manifest_digest(first) != httpcache.manifest_digest(second)
+
+
+def test_manifest_of_missing_folder_is_empty(tmp_path):
+    assert httpcache.tree_manifest(str(tmp_path / 'missing')) == {}
+    assert httpcache.tree_manifest(None) == {}
@@ -0,0 +1,158 @@
+"""
+test_livefeed.py
+
+Unit tests for the per-process status feed behind /agreements/events.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import json
+import queue
+import threading
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from api import livefeed
+from api.benchmarks import memdb
+
+
+def agreement(status='agreed', party1=None, party2=None):
+    return {
+        '_id': ObjectId(), 'title': 'Trip', 'response_status': status,
+        'response_date': datetime(2025, 1, 2), 'party1': {'user_id': party1 or ObjectId()},
+        'party2': {'user_id': party2 or ObjectId()},
+    }
+
+
+class FakeStream:
+    """A change stream fed from a queue; None ends it, an exception is raised."""
+    def __init__(self):
+        self.changes = queue.Queue()
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            change = self.changes.get()
+            if change is None:
+                return
+            if isinstance(change, Exception):
+                raise change
+            yield change
+
+    def close(self):
+        self.closed = True
+        self.changes.put(None)
+
+
+class WatchableCollection:
+    def __init__(self):
+        self.streams = []
+        self.resumed_after = []
+        self.opened = threading.Event()
+
+    def watch(self, pipeline, full_document=None, resume_after=None):
+        assert full_document == 'updateLookup'
+        self.resumed_after.append(resume_after)
+        self.streams.append(FakeStream())
+        self.opened.set()
+        return self.streams[-1]
+
+
+def test_event_names_both_parties():
+    agr = agreement()
+    recipients, event = livefeed.event_for(agr)
+    assert recipients == {str(agr['party1']['user_id']), str(agr['party2']['user_id'])}
+    assert event == {'id': str(agr['_id']), 'title': 'Trip', 'status': 'agreed',
+                     'response_date': '2025-01-02T00:00:00', 'revision': 1}
+    frame = livefeed.format_sse(event)
+    assert frame.startswith(f"id: {agr['_id']}.1.agreed\nevent: status\ndata: ")
+    assert json.loads(frame.split('data: ')[1]) == event
+
+
+def test_publish_reaches_every_tab_of_the_recipients_only():
+    feed = livefeed.StatusFeed('local')
+    me, other = ObjectId(), ObjectId()
+    tabs = [feed.subscribe(me), feed.subscribe(me)]
+    stranger = feed.subscribe(other)
+    feed.notify(agreement(party1=me))
+    assert all(tab.get(0)['status'] == 'agreed' for tab in tabs)
+    assert stranger.get(0) is None
+    feed.unsubscribe(tabs[0])
+    assert feed.subscriber_count() == 2
+
+
+def test_subscribers_are_capped_per_process():
+    feed = livefeed.StatusFeed('local', max_subscribers=2)
+    first, _ = feed.subscribe(ObjectId()), feed.subscribe(ObjectId())
+    assert feed.subscribe(ObjectId()) is None
+    feed.unsubscribe(first)
+    assert feed.subscribe(ObjectId()) is not None
+    assert feed.stats()['refused'] == 1
+
+
+def test_full_queue_drops_instead_of_growing():
+    feed = livefeed.StatusFeed('local', queue_size=2)
+    me = ObjectId()
+    sub = feed.subscribe(me)
+    for _ in range(5):
+        feed.notify(agreement(party2=me))
+    assert sub.dropped == 3 and feed.stats()['dropped'] == 3
+
+
+def test_notify_is_a_no_op_without_local_subscribers():
+    feed = livefeed.StatusFeed('local')
+    assert not feed.wants_notify()
+    feed.notify(agreement())
+    assert feed.published == 0
+    assert livefeed.StatusFeed('off').enabled is False
+
+
+def test_auto_falls_back_to_local_without_change_streams():
+    feed = livefeed.StatusFeed('auto', lambda: memdb.MemoryRepository().agreements)
+    feed.subscribe(ObjectId())
+    assert feed.source == 'local' and not feed.watching
+
+    class Standalone:
+        def watch(self, *args, **kwargs):
+            raise OperationFailure('The $changeStream stage is only supported on replica sets', 40573)
+    feed = livefeed.StatusFeed('auto', Standalone)
+    feed.subscribe(ObjectId())
+    assert feed.source == 'local'
+
+
+def test_one_watcher_fans_out_change_stream_events():
+    coll = WatchableCollection()
+    feed = livefeed.StatusFeed('changestream', lambda: coll, retry_seconds=0)
+    me = ObjectId()
+    subs = [feed.subscribe(me) for _ in range(3)]
+    assert len(coll.streams) == 1 and feed.watching
+
+    agr = agreement(party2=me)
+    coll.streams[0].changes.put({'_id': {'_data': 't1'}, 'operationType': 'update', 'fullDocument': agr})
+    assert [sub.get(1)['id'] for sub in subs] == [str(agr['_id'])] * 3
+    # routes never publish a second copy while the change stream is the source
+    feed.notify(agr)
+    assert subs[0].get(0) is None
+
+    for sub in subs:
+        feed.unsubscribe(sub)
+    assert coll.streams[0].closed and not feed.watching
+
+
+def test_watcher_resumes_after_errors():
+    coll = WatchableCollection()
+    feed = livefeed.StatusFeed('changestream', lambda: coll, retry_seconds=0)
+    me = ObjectId()
+    sub = feed.subscribe(me)
+    coll.streams[0].changes.put({'_id': 't1', 'fullDocument': agreement(party1=me)})
+    assert sub.get(1)
+    coll.opened.clear()
+    coll.streams[0].changes.put(PyMongoError('primary stepped down'))
+    assert coll.opened.wait(1)
+    assert coll.resumed_after == [None, 't1']
+    coll.streams[1].changes.put({'_id': 't2', 'fullDocument': agreement(status='rejected', party1=me)})
+    assert sub.get(1)['status'] == 'rejected'
+    feed.unsubscribe(sub)
+    assert coll.streams[1].closed
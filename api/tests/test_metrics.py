@@ -0,0 +1,192 @@
+"""
+test_metrics.py
+
+Unit tests for request/Mongo instrumentation and the /metrics export.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import json
+import logging
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import metrics as m
+from api.app import create_app
+from api.benchmarks.memdb import MemoryRepository
+
+
+def _started(request_id, name, command):
+    return SimpleNamespace(request_id=request_id, command_name=name, command=command)
+
+
+def _done(request_id, name, micros, reply=None):
+    return SimpleNamespace(request_id=request_id, command_name=name,
+                           duration_micros=micros, reply=reply or {'ok': 1})
+
+
+@pytest.fixture(name='flask_app')
+def fixture_flask_app(tmp_path):
+    return create_app({
+        'TESTING': True,
+        'REPOSITORY': MemoryRepository(),
+        'SIGNATURE_STORE': 'local',
+        'SIGNATURE_DIR': str(tmp_path / 'blobs'),
+        'SLOW_REQUEST_MS': 0,
+        'SLOW_REQUEST_SAMPLE': 1.0,
+        'METRICS_DIR': '',
+    })
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = m.Registry()
+    hist = registry.histogram('t_seconds', 'Test.', ('route',), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        hist.observe(('home',), value)
+    text = registry.render()
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{route="home",le="0.1"} 1' in text
+    assert 't_seconds_bucket{route="home",le="1.0"} 3' in text
+    assert 't_seconds_bucket{route="home",le="+Inf"} 4' in text
+    assert 't_seconds_count{route="home"} 4' in text
+
+
+def test_label_values_are_escaped():
+    registry = m.Registry()
+    registry.counter('c_total', 'Test.', ('path',)).inc(('a"b\\c',))
+    assert 'c_total{path="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_query_shape_hides_values():
+    assert m.query_shape({'party2.user_id': ObjectId(), 'search_terms': {'$all': ['be', 'tr']}}) == {
+        'party2.user_id': '?', 'search_terms': {'$all': '?'}
+    }
+    assert m.command_shape('aggregate', {'pipeline': [{'$match': {'a': 1}}, {'$limit': 21}]}) == [
+        {'$match': {'a': '?'}}, {'$limit': '?'}
+    ]
+    assert m.command_shape('insert', {'documents': [{'a': 1}]}) is None
+
+
+def test_command_timer_records_and_charges_request(flask_app):
+    recorder = flask_app.extensions['metrics']
+    listener = recorder.command_listener
+    with flask_app.test_request_context('/'):
+        trace = recorder.start_request()
+        listener.started(_started(1, 'find', {'find': 'agreements', 'filter': {'x': 1}}))
+        listener.succeeded(_done(1, 'find', 2000, {'cursor': {'firstBatch': [{'a': 'b'}]}}))
+        listener.started(_started(2, 'getMore', {'getMore': 5, 'collection': 'agreements'}))
+        listener.failed(_done(2, 'getMore', 1000))
+        assert trace.mongo_commands == 2
+        assert trace.mongo_seconds == pytest.approx(0.003)
+        recorder.finish_request('main.home', 'GET', 200)
+    text = recorder.render()
+    assert 'mongo_command_duration_seconds_count{command="find",collection="agreements"} 1' in text
+    assert 'mongo_command_failures_total{command="getMore",collection="agreements"} 1' in text
+    assert 'mongo_command_reply_documents_total{command="find",collection="agreements"} 1' in text
+    assert 'http_request_mongo_commands_total{route="main.home"} 2' in text
+
+
+def test_commands_outside_requests_are_still_counted(flask_app):
+    listener = flask_app.extensions['metrics'].command_listener
+    listener.started(_started(9, 'createIndexes', {'createIndexes': 'users'}))
+    listener.succeeded(_done(9, 'createIndexes', 500))
+    assert 'command="createIndexes",collection="users"' in flask_app.extensions['metrics'].render()
+
+
+def test_requests_are_timed_per_route(flask_app):
+    client = flask_app.test_client()
+    client.get('/healthz')
+    client.get('/no-such-page')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{route="main.healthz",method="GET",status="200"} 1' in text
+    assert 'route="unmatched",method="GET",status="404"' in text
+
+
+def test_slow_requests_are_logged_with_query_shapes(flask_app, caplog):
+    recorder = flask_app.extensions['metrics']
+    with caplog.at_level(logging.WARNING, logger='consent.slow_requests'):
+        with flask_app.test_request_context('/'):
+            recorder.start_request()
+            recorder.command_listener.started(
+                _started(3, 'find', {'find': 'users', 'filter': {'username': 'alice'}}))
+            recorder.command_listener.succeeded(_done(3, 'find', 100))
+            recorder.finish_request('main.login', 'POST', 302)
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['route'] == 'main.login'
+    assert record['commands'][0]['shape'] == {'username': '?'}
+    assert 'http_slow_requests_total{route="main.login"} 1' in recorder.render()
+
+
+def test_unsampled_slow_requests_are_counted_not_logged(flask_app, caplog):
+    recorder = m.Metrics(slow_request_ms=0, slow_sample=0.5, rng=lambda: 0.9)
+    with caplog.at_level(logging.WARNING, logger='consent.slow_requests'):
+        with flask_app.test_request_context('/'):
+            recorder.start_request()
+            recorder.finish_request('main.home', 'GET', 200)
+    assert not caplog.records
+    assert 'http_slow_requests_total{route="main.home"} 1' in recorder.render()
+
+
+def test_metrics_dir_sums_worker_snapshots(flask_app, tmp_path):
+    worker = m.Metrics(directory=str(tmp_path))
+    worker.observe_command('find', 'users', 0.001, 10)
+    worker.dump()
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / '1.json')
+
+    current = m.Metrics(directory=str(tmp_path))
+    current.observe_command('find', 'users', 0.002, 5)
+    text = current.render()
+    assert 'mongo_command_duration_seconds_count{command="find",collection="users"} 2' in text
+    assert 'mongo_command_reply_documents_total{command="find",collection="users"} 15' in text
+
+
+def test_collectors_mirror_service_counters_across_workers(tmp_path, caplog):
+    def collector(value):
+        def collect(registry):
+            registry.counter('svc_hits_total', 'Hits.', ()).set((), value)
+            registry.gauge('svc_entries', 'Entries.', ()).set((), value)
+        return collect
+
+    worker = m.Metrics(directory=str(tmp_path))
+    worker.collect(collector(3))
+    worker.dump()
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / '1.json')
+
+    current = m.Metrics(directory=str(tmp_path))
+    current.collect(collector(4))
+    current.collect(lambda registry: 1 / 0)
+    text = current.render()
+    assert 'svc_hits_total 7' in text
+    assert '# TYPE svc_entries gauge' in text and 'svc_entries 7' in text
+    assert 'metrics collector' in caplog.text
+
+
+def test_exited_workers_keep_counters_but_not_gauges(tmp_path):
+    def collect(registry):
+        registry.gauge('svc_entries', 'Entries.', ()).set((), 5)
+
+    worker = m.Metrics(directory=str(tmp_path))
+    worker.collect(collect)
+    worker.observe_command('find', 'users', 0.001, 10)
+    worker.dump()
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                            capture_output=True, text=True, check=True)
+    dead_pid = int(exited.stdout)
+    os.rename(tmp_path / f'{os.getpid()}.json', tmp_path / f'{dead_pid}.json')
+
+    current = m.Metrics(directory=str(tmp_path))
+    current.collect(collect)
+    # not folded in yet: a dead worker's file is skipped, not summed
+    assert 'reply_documents_total{command="find",collection="users"}' not in current.render()
+
+    m.mark_process_dead(str(tmp_path), dead_pid)
+    m.mark_process_dead(str(tmp_path), dead_pid)
+    assert not (tmp_path / f'{dead_pid}.json').exists()
+    text = current.render()
+    assert 'mongo_command_reply_documents_total{command="find",collection="users"} 10' in text
+    assert 'svc_entries 5' in text
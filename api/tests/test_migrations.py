@@ -0,0 +1,117 @@
+"""
+test_migrations.py
+
+Unit tests for the versioned index migration runner.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+# pylint: disable=too-few-public-methods
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from api import app, migrations
+
+
+class DocCursor(list):
+    def batch_size(self, n):
+        return self
+
+
+class IndexCollection:
+    """Tracks created indexes and inserted documents."""
+    def __init__(self):
+        self.indexes = {'_id_': {}}
+        self.docs = []
+
+    def create_index(self, keys, name=None, **kwargs):
+        self.indexes[name] = {'key': keys, **kwargs}
+        return name
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def drop_index(self, name):
+        del self.indexes[name]
+
+    def find(self, query=None, projection=None):
+        return DocCursor(self.docs)
+
+    def aggregate(self, pipeline):
+        return DocCursor()
+
+    def bulk_write(self, requests, ordered=True):
+        self.docs.extend(requests)
+
+    def delete_many(self, query):
+        return None
+
+    def insert_one(self, doc):
+        if any(d['_id'] == doc['_id'] for d in self.docs):
+            raise DuplicateKeyError('dup')
+        self.docs.append(doc)
+
+
+class IndexDB(dict):
+    def __missing__(self, name):
+        self[name] = IndexCollection()
+        return self[name]
+
+
+@pytest.fixture(autouse=True)
+def local_signature_store(monkeypatch, tmp_path):
+    monkeypatch.setenv('SIGNATURE_STORE', 'local')
+    monkeypatch.setenv('SIGNATURE_DIR', str(tmp_path))
+
+
+def test_run_migrations_applies_once():
+    db = IndexDB()
+    applied = migrations.run_migrations(db, log=lambda msg: None)
+    assert applied == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.run_migrations(db, log=lambda msg: None) == []
+    assert migrations.applied_versions(db) == set(applied)
+
+
+def test_migrations_create_required_indexes():
+    db = IndexDB()
+    assert migrations.missing_indexes(db)
+    migrations.run_migrations(db, log=lambda msg: None)
+    assert migrations.missing_indexes(db) == []
+    assert db['users'].indexes['username_unique']['unique'] is True
+    drafts = db['fanout_jobs'].indexes['draft_created_at_ttl']
+    assert drafts['partialFilterExpression'] == {'status': 'draft'}
+    assert drafts['expireAfterSeconds'] == 24 * 3600
+    # superseded by the keyset indexes
+    assert 'party1_user_created_at' not in db['agreements'].indexes
+    migrations.verify_indexes(db)
+
+
+def test_verify_indexes_refuses_when_missing():
+    db = IndexDB()
+    with pytest.raises(migrations.MissingIndexError, match='users.username_unique'):
+        migrations.verify_indexes(db)
+
+
+def test_duplicate_version_rejected():
+    with pytest.raises(ValueError):
+        migrations.migration(1, 'again')(lambda db: None)
+
+
+def test_concurrent_record_is_tolerated():
+    db = IndexDB()
+    db[migrations.MIGRATIONS_COLL].docs.append({'_id': 1})
+    # simulate a worker that read the ledger before the other one wrote it
+    db[migrations.MIGRATIONS_COLL].find = lambda *a, **kw: DocCursor()
+    assert migrations.run_migrations(db, log=lambda msg: None)[0] == 1
+
+
+def test_migrate_cli():
+    class Repo:
+        db = IndexDB()
+
+    runner = app.create_app({'TESTING': True, 'REPOSITORY': Repo()}).test_cli_runner()
+    check = runner.invoke(args=['migrate', '--check'])
+    assert check.exit_code != 0
+    result = runner.invoke(args=['migrate'])
+    assert result.exit_code == 0
+    assert 'All required indexes present.' in result.output
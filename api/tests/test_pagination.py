@@ -0,0 +1,55 @@
+"""
+test_pagination.py
+
+Unit tests for the shared keyset pagination helpers.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import pagination
+
+
+def test_cursor_round_trip_is_opaque_and_url_safe():
+    row = {'created_at': datetime(2025, 3, 1, 8, 0, 0, 123000), '_id': ObjectId(), 'title': 'x'}
+    token = pagination.encode_cursor(row)
+    assert set(token) <= set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_')
+    assert pagination.decode_cursor(token) == [row['created_at'], row['_id']]
+
+
+@pytest.mark.parametrize('token', [None, '', 'garbage!', 'e30', 'WzFd'])
+def test_decode_rejects_bad_tokens(token):
+    assert pagination.decode_cursor(token) is None
+
+
+def test_keyset_match_newest_first():
+    after = [datetime(2025, 1, 1), ObjectId()]
+    assert pagination.keyset_match(after) == {'$or': [
+        {'created_at': {'$lt': after[0]}},
+        {'created_at': after[0], '_id': {'$lt': after[1]}},
+    ]}
+
+
+def test_keyset_match_ascending():
+    assert pagination.keyset_match([1, 2], (('a', 1), ('b', 1))) == {'$or': [
+        {'a': {'$gt': 1}}, {'a': 1, 'b': {'$gt': 2}},
+    ]}
+
+
+def test_split_page():
+    rows = [{'created_at': datetime(2025, 1, d), '_id': ObjectId()} for d in (3, 2, 1)]
+    page, cursor = pagination.split_page(list(rows), 2)
+    assert page == rows[:2]
+    assert pagination.decode_cursor(cursor) == [rows[1]['created_at'], rows[1]['_id']]
+    assert pagination.split_page(rows[:1], 2) == (rows[:1], None)
+
+
+def test_clamp_page_size():
+    assert pagination.clamp_page_size('5') == 5
+    assert pagination.clamp_page_size('0') == 1
+    assert pagination.clamp_page_size(10_000) == pagination.MAX_PAGE_SIZE
+    assert pagination.clamp_page_size('x') == pagination.DEFAULT_PAGE_SIZE
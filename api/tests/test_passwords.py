@@ -0,0 +1,102 @@
+"""
+test_passwords.py
+
+Unit tests for the bounded password hashing service.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from api import passwords
+
+
+def test_inline_hash_and_verify():
+    hasher = passwords.PasswordHasher(method='pbkdf2:sha256:1000')
+    pwhash = hasher.hash('secret')
+    assert pwhash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.verify(pwhash, 'wrong')
+
+
+def test_needs_rehash_normalises_method():
+    hasher = passwords.PasswordHasher(method='pbkdf2:sha256:1000')
+    assert not hasher.needs_rehash(hasher.hash('x'))
+    assert hasher.needs_rehash(passwords.PasswordHasher(method='pbkdf2:sha256:500').hash('x'))
+    assert hasher.needs_rehash('scrypt:32768:8:1$salt$hash')
+
+
+def test_pool_hashes_in_worker_process():
+    hasher = passwords.PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    try:
+        assert hasher.verify(hasher.hash('pw'), 'pw')
+    finally:
+        hasher.shutdown()
+
+
+def test_full_queue_rejects_fast(monkeypatch):
+    hasher = passwords.PasswordHasher(workers=1, max_queue=0)
+    release = threading.Event()
+    submitted = threading.Event()
+
+    class BlockingPool:
+        def submit(self, func, *args):
+            submitted.set()
+            future = Future()
+            threading.Thread(target=lambda: (release.wait(), future.set_result(True))).start()
+            return future
+
+    monkeypatch.setattr(hasher, '_executor', BlockingPool)
+    in_flight = Future()
+    first = threading.Thread(target=lambda: in_flight.set_result(hasher.verify('h', 'p')))
+    first.start()
+    # the only slot is taken until the blocked job finishes
+    assert submitted.wait(timeout=5)
+    with pytest.raises(passwords.HashingBusy):
+        hasher.verify('h', 'p')
+    assert hasher.rejected == 1
+    release.set()
+    assert in_flight.result(timeout=5) is True
+    assert hasher.verify('h', 'p') is True
+
+
+def test_timeout_is_reported_as_busy(monkeypatch):
+    hasher = passwords.PasswordHasher(workers=1, timeout=0.01)
+
+    class StuckPool:
+        def submit(self, func, *args):
+            return Future()
+
+    monkeypatch.setattr(hasher, '_executor', StuckPool)
+    with pytest.raises(passwords.HashingBusy, match='timed out'):
+        hasher.verify('h', 'p')
+
+
+def test_pool_workers_are_not_forked():
+    hasher = passwords.PasswordHasher('pbkdf2:sha256:1000', workers=1)
+    try:
+        # pylint: disable=protected-access
+        assert hasher._executor()._mp_context.get_start_method() in ('forkserver', 'spawn')
+        assert hasher.verify(hasher.hash('pw'), 'pw')
+    finally:
+        hasher.shutdown()
+
+
+def test_hasher_from_config():
+    hasher = passwords.hasher_from_config({
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'HASH_WORKERS': 2,
+        'HASH_QUEUE': 3,
+        'HASH_TIMEOUT': 5.0,
+    })
+    assert (hasher.method, hasher.workers, hasher.max_queue) == ('pbkdf2:sha256:1000', 2, 3)
+    assert hasher.timeout == 5.0
+
+
+def test_benchmark_reports_per_core_rate():
+    result = passwords.benchmark('pbkdf2:sha256:1000', processes=1, duration=0.05)
+    assert result['hashes'] > 0
+    assert result['hashes_per_sec_per_core'] == result['hashes_per_sec']
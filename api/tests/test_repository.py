@@ -0,0 +1,212 @@
+"""
+test_repository.py
+
+Unit tests for the lazily connected repository and the app factory's
+startup cost.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from bson.timestamp import Timestamp
+from pymongo.read_preferences import SecondaryPreferred
+
+from api import app, config, repository
+from api.benchmarks.memdb import MemoryRepository
+
+API_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+# importing app.py and building the app must stay well under this
+STARTUP_BUDGET_SECONDS = 1.5
+
+
+class FakeClient:
+    created = []
+
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = options
+        self.closed = False
+        FakeClient.created.append(self)
+
+    def __getitem__(self, name):
+        return {'db': name}
+
+    def close(self):
+        self.closed = True
+
+
+def test_from_config_passes_pool_and_timeouts():
+    settings = config.from_env({'MONGO_MAX_POOL_SIZE': '7', 'MONGO_SOCKET_TIMEOUT_MS': '900'})
+    repo = repository.Repository.from_config(settings)
+    assert repo.db_name == 'consent_data'
+    assert repo.client_options['maxPoolSize'] == 7
+    assert repo.client_options['socketTimeoutMS'] == 900
+    assert repo.client_options['serverSelectionTimeoutMS'] == 5000
+
+
+def test_client_is_lazy_and_per_process(monkeypatch):
+    FakeClient.created.clear()
+    monkeypatch.setattr(repository, 'MongoClient', FakeClient)
+    repo = repository.Repository('mongodb://example', maxPoolSize=3)
+    assert not repo.connected and FakeClient.created == []
+    assert repo.db == {'db': 'consent_data'}
+    assert repo.client is repo.client
+    assert FakeClient.created[0].options == {'maxPoolSize': 3}
+    # a forked child must not reuse its parent's client
+    monkeypatch.setattr(repository.os, 'getpid', lambda: -1)
+    assert not repo.connected
+    assert repo.client is FakeClient.created[1]
+
+
+def test_close_drops_client(monkeypatch):
+    monkeypatch.setattr(repository, 'MongoClient', FakeClient)
+    repo = repository.Repository('mongodb://example')
+    client = repo.client
+    repo.close()
+    assert client.closed and not repo.connected
+
+
+def test_import_and_create_app_within_budget():
+    script = (
+        'import json, time\n'
+        't = time.perf_counter()\n'
+        'import app\n'
+        'elapsed = time.perf_counter() - t\n'
+        'print(json.dumps({"seconds": elapsed,'
+        ' "connected": app.app.extensions["repository"].connected}))\n'
+    )
+    # an unroutable address: any handshake at import time would blow the budget
+    env = dict(os.environ, MONGO_URI='mongodb://192.0.2.1:27017', MONGO_CONNECT_TIMEOUT_MS='5000')
+    out = subprocess.run(
+        [sys.executable, '-c', script], cwd=API_DIR, env=env,
+        capture_output=True, text=True, check=True, timeout=30
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    assert result['connected'] is False
+    assert result['seconds'] < STARTUP_BUDGET_SECONDS
+
+
+def _routed(**kwargs):
+    # connect=False: with_options and start_session need no server
+    return repository.Repository('mongodb://localhost:1', read_mode='secondaryPreferred', max_staleness=120,
+                                 connect=False, **kwargs)
+
+
+def test_reads_are_routed_and_writes_carry_their_concern():
+    repo = _routed()
+    reads = repo.reads('agreements')
+    assert reads.read_preference == SecondaryPreferred(max_staleness=120)
+    assert reads.read_concern.level == 'majority'
+    assert repo.agreements.write_concern.document == {'w': 'majority', 'wtimeout': 5000}
+    assert repo.collection('sessions', 'fast').write_concern.document == {'w': 1}
+
+    primary = repository.Repository('mongodb://localhost:1', connect=False)
+    assert not primary.routes_reads
+    assert primary.reads('agreements').read_preference.mongos_mode == 'primary'
+    with pytest.raises(ValueError, match='MONGO_READ_PREFERENCE'):
+        repository.read_preference('secondaries')
+
+
+def test_request_operations_share_the_causal_session():
+    calls = []
+
+    class Coll:
+        name = 'agreements'
+
+        def find_one(self, query, session=None):
+            calls.append(('find_one', session))
+
+        def update_one(self, query, update, session=None):
+            calls.append(('update_one', session))
+
+    context = repository.CausalContext('session')
+    coll = repository.SessionCollection(Coll(), context)
+    coll.find_one({})
+    assert not context.wrote
+    coll.update_one({}, {})
+    assert context.wrote and calls == [('find_one', 'session'), ('update_one', 'session')]
+    assert coll.name == 'agreements'
+
+
+def test_causal_token_round_trips():
+    repo = _routed()
+    position = {'cluster_time': {'clusterTime': Timestamp(7, 2), 'signature': {'hash': b'h' * 20, 'keyId': 1}},
+                'operation_time': Timestamp(7, 2)}
+    session = repo.causal_session(repository.json_util.dumps(position))
+    assert session.operation_time == Timestamp(7, 2)
+    assert repository.decode_token(repository.encode_token(session)) == position
+    assert repository.encode_token(repo.causal_session()) is None
+
+
+class FakeSession:
+    def __init__(self, token):
+        self.token = token
+        self.operation_time = None
+        self.cluster_time = {'clusterTime': Timestamp(1, 1)}
+        self.ended = False
+
+    def end_session(self):
+        self.ended = True
+
+
+class CausalMemoryRepository(MemoryRepository):
+    def __init__(self):
+        super().__init__()
+        self.sessions = []
+
+    def causal_session(self, token=None):
+        self.sessions.append(FakeSession(token))
+        return self.sessions[-1]
+
+
+def test_writes_carry_over_to_the_next_request(tmp_path):
+    repo = CausalMemoryRepository()
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repo, 'SESSION_BACKEND': 'memory',
+                                'MONGO_READ_PREFERENCE': 'secondaryPreferred',
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+
+    def write():
+        context = app.causal_context()
+        context.session.operation_time = Timestamp(9, 1)
+        context.wrote = True
+        return 'ok'
+
+    def read():
+        app.causal_context()
+        return 'ok'
+
+    flask_app.add_url_rule('/_write', view_func=write)
+    flask_app.add_url_rule('/_read', view_func=read)
+    client = flask_app.test_client()
+    client.get('/healthz')
+    assert repo.sessions == []  # nothing touched MongoDB, so no session was started
+
+    client.get('/_write')
+    assert repo.sessions[0].ended
+    client.get('/_read')
+    assert repository.decode_token(repo.sessions[1].token)['operation_time'] == Timestamp(9, 1)
+
+
+@pytest.mark.skipif(not os.environ.get('MONGO_REPLSET_URI'),
+                    reason='set MONGO_REPLSET_URI to a replica set, e.g. docker compose up mongodb')
+def test_read_your_writes_on_a_replica_set():
+    repo = repository.Repository(os.environ['MONGO_REPLSET_URI'], 'consent_test', read_mode='secondaryPreferred',
+                                 max_staleness=90, serverSelectionTimeoutMS=5000)
+    writer = repository.CausalContext(repo.causal_session())
+    repo.session_source = lambda: writer
+    try:
+        inserted = repo.collection('routing_check', 'critical').insert_one({'n': 1}).inserted_id
+        token = repository.encode_token(writer.session)
+        reader = repository.CausalContext(repo.causal_session(token))
+        repo.session_source = lambda: reader
+        assert repo.reads('routing_check').find_one({'_id': inserted})['n'] == 1
+    finally:
+        repo.session_source = None
+        repo.db.drop_collection('routing_check')
+        repo.close()
@@ -0,0 +1,103 @@
+"""
+test_responses.py
+
+Unit tests for batch agree/reject.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import responses
+from api.benchmarks.memdb import MemoryRepository
+
+
+class CountingCollection:
+    """Wraps a memdb collection and counts round trips."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = []
+
+    def find(self, query, projection=None):
+        self.calls.append('find')
+        return self.inner.find(query, projection)
+
+    def bulk_write(self, requests, ordered=True):
+        self.calls.append(('bulk_write', len(requests), ordered))
+        return self.inner.bulk_write(requests, ordered)
+
+
+@pytest.fixture(name='inbox')
+def fixture_inbox():
+    me, other = ObjectId(), ObjectId()
+    coll = MemoryRepository().agreements
+    mine = [coll.insert_one({'party1': {'user_id': other}, 'party2': {'user_id': me},
+                             'response_status': 'pending'}).inserted_id
+            for _ in range(3)]
+    theirs = coll.insert_one({'party2': {'user_id': other}, 'response_status': 'pending'}).inserted_id
+    return coll, me, mine, theirs
+
+
+def test_one_query_and_one_bulk_write(inbox):
+    coll, me, mine, theirs = inbox
+    counted = CountingCollection(coll)
+    ids = [str(i) for i in mine] + [str(theirs), 'nope', str(ObjectId())]
+    now = datetime(2025, 5, 1)
+    results, modified = responses.respond_many(counted, me, ids, 'agreed', now=now)
+    assert counted.calls == ['find', ('bulk_write', 3, False)]
+    assert modified == 3
+    assert [results[str(i)] for i in mine] == ['updated'] * 3
+    assert results[str(theirs)] == 'not_found'
+    assert results['nope'] == 'invalid_id'
+    assert list(results) == ids
+    assert coll.find_one({'_id': mine[0]})['response_date'] == now
+    assert coll.find_one({'_id': theirs})['response_status'] == 'pending'
+
+
+def test_lost_races_are_reported_as_conflicts(inbox):
+    coll, me, mine, _ = inbox
+    stats = MemoryRepository().collection('user_stats')
+
+    class Racing(CountingCollection):
+        """Another tab answers mine[1] between the read and the write."""
+        def bulk_write(self, requests, ordered=True):
+            self.inner.update_one({'_id': mine[1]}, {'$set': {'response_status': 'rejected'}})
+            return super().bulk_write(requests, ordered)
+
+        def aggregate(self, pipeline):
+            return self.inner.aggregate(pipeline)
+
+    counted = Racing(coll)
+    results, modified = responses.respond_many(counted, me, [str(i) for i in mine], 'agreed',
+                                               now=datetime(2025, 5, 1, 0, 0, 0, 123456), stats_coll=stats)
+    assert modified == 2
+    assert [results[str(i)] for i in mine] == ['updated', 'conflict', 'updated']
+    assert counted.calls == ['find', ('bulk_write', 3, False), 'find']
+    # the date is stored as BSON keeps it, so the re-read matches
+    assert coll.find_one({'_id': mine[0]})['response_date'].microsecond == 123000
+    # the counters are recounted and include the racer's answer
+    assert stats.find_one({'_id': me})['received'] == {'pending': 0, 'agreed': 2, 'rejected': 1}
+
+
+def test_nothing_owned_skips_the_write(inbox):
+    coll, me, _, theirs = inbox
+    counted = CountingCollection(coll)
+    results, modified = responses.respond_many(counted, me, [str(theirs)], 'rejected')
+    assert counted.calls == ['find']
+    assert (results, modified) == ({str(theirs): 'not_found'}, 0)
+
+
+@pytest.mark.parametrize('ids, decision', [
+    (['a'], 'maybe'),
+    ([], 'agreed'),
+    ('not-a-list', 'agreed'),
+    ([str(ObjectId()) for _ in range(responses.MAX_BATCH + 1)], 'agreed'),
+])
+def test_malformed_batches_are_rejected(inbox, ids, decision):
+    coll, me, _, _ = inbox
+    with pytest.raises(responses.InvalidBatch):
+        responses.respond_many(coll, me, ids, decision)
@@ -0,0 +1,114 @@
+"""
+test_revisions.py
+
+Unit tests for revision chains of edited agreements.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import base64
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import revisions
+from api.app import create_app
+from api.benchmarks.memdb import MemoryRepository
+from api.signatures import store_signature
+
+CONTENT = {'sexual_content': 'kissing', 'contraception': 'yes', 'std_check': 'no', 'record_allowed': 'no'}
+
+
+def _data_url(payload):
+    return 'data:image/png;base64,' + base64.b64encode(b'\x89PNG\r\n\x1a\n' + payload).decode()
+
+
+@pytest.fixture(name='chain')
+def fixture_chain():
+    repository = MemoryRepository()
+    alice, bob = ObjectId(), ObjectId()
+    agreement_id = repository.agreements.insert_one({
+        'title': 'Date night', 'content': dict(CONTENT),
+        'party1': {'user_id': alice, 'name': 'alice'}, 'party2': {'user_id': bob, 'name': 'bob'},
+        'signature_ref': {'hash': 'a' * 64}, 'created_at': datetime(2025, 1, 1),
+        'response_status': 'rejected', 'response_date': datetime(2025, 1, 2),
+    }).inserted_id
+    return repository, alice, bob, agreement_id
+
+
+def _revise(repository, agreement_id, editor, title, content, sig, day):
+    return revisions.revise(repository.agreements, repository.collection(revisions.REVISIONS_COLL),
+                            agreement_id, editor, title, content, {'hash': sig}, now=datetime(2025, 1, day))
+
+
+def test_revise_updates_head_and_stores_compact_diff(chain):
+    repository, alice, bob, agreement_id = chain
+    assert _revise(repository, agreement_id, alice, 'Date night',
+                   dict(CONTENT, std_check='yes'), 'b' * 64, 3) == 2
+
+    assert repository.agreements.count_documents({}) == 1
+    head = repository.agreements.find_one({'_id': agreement_id})
+    assert head['revision'] == 2 and head['response_status'] == 'pending'
+    assert head['signature_ref']['hash'] == 'b' * 64
+    assert head['created_at'] == datetime(2025, 1, 3)
+
+    rev = repository.collection(revisions.REVISIONS_COLL).find_one({'_id': head['prev_revision']})
+    assert rev['changes'] == [{'field': 'content.std_check', 'old': 'no'}]
+    assert rev['signature_ref']['hash'] == 'a' * 64
+    assert rev['party_ids'] == [alice, bob] and rev['prev'] is None
+
+
+def test_history_rebuilds_every_version(chain):
+    repository, alice, _, agreement_id = chain
+    _revise(repository, agreement_id, alice, 'Date night v2', dict(CONTENT, std_check='yes'), 'b' * 64, 3)
+    repository.agreements.update_one({'_id': agreement_id}, {'$set': {'response_status': 'rejected'}})
+    _revise(repository, agreement_id, alice, 'Date night v3', dict(CONTENT, std_check='yes', record_allowed='yes'),
+            'c' * 64, 5)
+
+    head = repository.agreements.find_one({'_id': agreement_id})
+    versions = revisions.history(repository.collection(revisions.REVISIONS_COLL), head)
+    assert [v['revision'] for v in versions] == [3, 2, 1]
+    assert [v['title'] for v in versions] == ['Date night v3', 'Date night v2', 'Date night']
+    assert versions[1]['content'] == dict(CONTENT, std_check='yes')
+    assert versions[2]['content'] == CONTENT
+    assert versions[2]['signature_ref']['hash'] == 'a' * 64
+    assert versions[2]['created_at'] == datetime(2025, 1, 1)
+
+
+def test_only_party1_of_a_rejected_agreement_can_revise(chain):
+    repository, alice, bob, agreement_id = chain
+    with pytest.raises(revisions.RevisionConflict):
+        _revise(repository, agreement_id, bob, 't', CONTENT, 'b' * 64, 3)
+    _revise(repository, agreement_id, alice, 't', CONTENT, 'b' * 64, 3)
+    # now pending again: a second resend of the same edit must fail
+    with pytest.raises(revisions.RevisionConflict):
+        _revise(repository, agreement_id, alice, 't', CONTENT, 'c' * 64, 4)
+    assert repository.collection(revisions.REVISIONS_COLL).count_documents({}) == 1
+
+
+def test_edit_flow_resends_in_place_and_keeps_old_signature_visible(chain, tmp_path):
+    repository, alice, bob, agreement_id = chain
+    flask_app = create_app({
+        'TESTING': True, 'REPOSITORY': repository,
+        'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+    })
+    repository.users.insert_one({'_id': alice, 'username': 'alice'})
+    old_ref = store_signature(flask_app.extensions['signature_store'], _data_url(b'first'))
+    repository.agreements.update_one({'_id': agreement_id}, {'$set': {'signature_ref': old_ref}})
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(alice)
+
+    client.get(f'/agreements/{agreement_id}/edit')
+    client.post('/agreements/new/step2', data=dict(CONTENT, contraception='no'))
+    resp = client.post('/agreements/new/signature', data={'signature_data': _data_url(b'second')})
+    assert resp.headers['Location'].endswith(f'/agreements/{agreement_id}')
+
+    assert repository.agreements.count_documents({}) == 1
+    head = repository.agreements.find_one({'_id': agreement_id})
+    assert head['revision'] == 2 and head['content']['contraception'] == 'no'
+    assert head['signature_ref']['hash'] != old_ref['hash']
+    assert client.get(f'/agreements/{agreement_id}/history').status_code == 200
+    # the superseded signature is still served to the parties
+    assert client.get(f"/signatures/{old_ref['hash']}").status_code == 200
@@ -0,0 +1,88 @@
+"""
+test_search.py
+
+Unit tests for the prefix-index agreement search.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+# pylint: disable=too-few-public-methods
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from api import pagination, search
+
+
+class RecordingCollection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.pipelines = []
+        self.updates = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.rows)
+
+
+def test_tokenize_ignores_regex_syntax():
+    assert search.tokenize('(a+)+$ .*Alice') == ['a', 'alice']
+    assert search.query_tokens('') == []
+    assert search.query_tokens('Bob bob BOB') == ['bob']
+
+
+def test_index_fields_prefixes_title_and_party1():
+    fields = search.index_fields({'title': 'Movie night', 'party1': {'name': 'Al'}})
+    assert fields['search_words'] == ['al', 'movie', 'night']
+    assert {'m', 'mo', 'mov', 'movie', 'n', 'night', 'a', 'al'} <= set(fields['search_terms'])
+
+
+def test_index_fields_caps_prefix_length():
+    fields = search.index_fields({'title': 'x' * 50})
+    assert max(len(t) for t in fields['search_terms']) == search.MAX_PREFIX_LEN
+
+
+def test_cursor_round_trip_on_ranked_order():
+    doc = {'score': 2, 'created_at': datetime(2025, 4, 1, 12, 30), '_id': ObjectId()}
+    token = pagination.encode_cursor(doc, search.RANKED)
+    assert pagination.decode_cursor(token, search.RANKED) == [2, doc['created_at'], doc['_id']]
+    # a newest-first dashboard cursor is not a search cursor
+    assert pagination.decode_cursor(pagination.encode_cursor(doc), search.RANKED) is None
+
+
+def test_pipeline_uses_index_fields_not_regex():
+    uid = ObjectId()
+    pipeline = search.search_pipeline(uid, ['mov'])
+    assert pipeline[0] == {'$match': {'party2.user_id': uid, 'search_terms': {'$all': ['mov']}}}
+    assert '$regex' not in repr(pipeline)
+    assert pipeline[-2] == {'$limit': pagination.DEFAULT_PAGE_SIZE + 1}
+    # the cached result row is keyed by revision
+    assert pipeline[-1]['$project']['revision'] == 1
+
+
+def test_pipeline_after_cursor_adds_keyset_match():
+    after = (1, datetime(2025, 1, 1), ObjectId())
+    pipeline = search.search_pipeline(ObjectId(), ['a'], after)
+    keyset = pipeline[2]['$match']['$or']
+    assert keyset[0] == {'score': {'$lt': 1}}
+    assert keyset[2]['_id'] == {'$lt': after[2]}
+
+
+def test_search_agreements_pages():
+    rows = [
+        {'_id': ObjectId(), 'score': 1, 'created_at': datetime(2025, 1, i + 1)}
+        for i in range(3)
+    ]
+    coll = RecordingCollection(rows)
+    results, cursor = search.search_agreements(coll, ObjectId(), 'x', page_size=2)
+    assert results == rows[:2]
+    assert pagination.decode_cursor(cursor, search.RANKED)[2] == rows[1]['_id']
+    coll.rows = rows[2:]
+    results, cursor = search.search_agreements(coll, ObjectId(), 'x', cursor, page_size=2)
+    assert results == rows[2:] and cursor is None
+
+
+def test_search_agreements_empty_query_skips_db():
+    coll = RecordingCollection([])
+    assert search.search_agreements(coll, ObjectId(), '  *** ') == ([], None)
+    assert coll.pipelines == []
@@ -0,0 +1,136 @@
+"""
+test_sessions.py
+
+Unit tests for the server-side session backends.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,redefined-outer-name
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from api import app, sessions
+from api.benchmarks.memdb import MemoryRepository
+
+T0 = datetime(2026, 1, 1)
+
+
+class Clock:
+    def __init__(self):
+        self.now = T0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def repository():
+    return MemoryRepository()
+
+
+def _app(repository, tmp_path, backend='mongo'):
+    return app.create_app({'TESTING': True, 'REPOSITORY': repository, 'SESSION_BACKEND': backend,
+                           'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+
+
+def _cookie(client):
+    return client.get_cookie('session')
+
+
+def test_encoding_round_trips_and_compresses_large_drafts():
+    small = {'user_id': 'u', '_flashes': [('info', 'hi')]}
+    assert sessions.decode(sessions.encode(small)) == small
+    draft = {'agreement_data': {'title': 'x' * 2000, 'content': {'std_check': 'yes'}}}
+    blob = sessions.encode(draft)
+    assert blob[:1] == b'z' and len(blob) < 200
+    assert sessions.decode(blob) == draft
+    with pytest.raises(ValueError):
+        sessions.decode(b'z-not-zlib')
+
+
+def test_memory_store_expires_and_evicts():
+    store = sessions.MemorySessionStore(maxsize=2)
+    later = T0 + timedelta(hours=1)
+    store.save('a', b'ja', later, T0)
+    store.save('b', b'jb', later, T0)
+    assert store.load('a', T0) == (later, b'ja')
+    store.save('c', b'jc', later, T0)
+    # 'b' was least recently used
+    assert store.load('b', T0) is None and len(store) == 2
+    assert store.load('a', later) is None
+
+
+def test_cookie_holds_only_an_id_and_the_draft_stays_server_side(repository, tmp_path):
+    client = _app(repository, tmp_path).test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'u1'
+        sess['agreement_data'] = {'title': 'lease ' * 200}
+    sid = _cookie(client).value
+    assert len(sid) < 64 and 'lease' not in sid
+    doc = repository.collection(sessions.SESSIONS_COLL).find_one({'_id': sid})
+    assert doc['expires_at'] > datetime.utcnow()
+    with client.session_transaction() as sess:
+        assert sess['agreement_data']['title'].startswith('lease')
+
+    # signing out drops the stored session; the goodbye flash rides in the cookie
+    client.get('/auth/logout')
+    stored = repository.collection(sessions.SESSIONS_COLL)
+    assert stored.count_documents({}) == 0
+    assert '.' in _cookie(client).value
+    with client.session_transaction() as sess:
+        assert list(sess) == ['_flashes']
+
+
+def test_anonymous_flashes_are_not_stored(repository, tmp_path):
+    client = _app(repository, tmp_path).test_client()
+    stored = repository.collection(sessions.SESSIONS_COLL)
+    for _ in range(3):
+        client.get('/auth/logout')
+    assert stored.count_documents({}) == 0
+    # shown on the next page, then the cookie is cleared
+    assert b'You have been logged out.' in client.get('/auth/login').data
+    assert _cookie(client) is None
+
+    # a tampered cookie is ignored
+    client.set_cookie('session', 'eyJ4IjoxfQ.forged.sig')
+    with client.session_transaction() as sess:
+        assert not sess
+
+
+def test_unchanged_sessions_are_not_rewritten_until_half_expired():
+    clock = Clock()
+    store = sessions.MemorySessionStore()
+    writes = []
+    store.save = lambda *args, save=store.save: (writes.append(args[0]), save(*args))
+    interface = sessions.ServerSessionInterface(store, timedelta(hours=2), clock)
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': MemoryRepository(), 'SIGNATURE_STORE': 'local'})
+    flask_app.session_interface = interface
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'u1'
+    client.get('/healthz')
+    assert len(writes) == 1
+    clock.now = T0 + timedelta(hours=1, minutes=1)
+    client.get('/healthz')
+    assert len(writes) == 2
+    clock.now = T0 + timedelta(hours=4)
+    with client.session_transaction() as sess:
+        assert 'user_id' not in sess
+
+
+def test_sign_in_rotates_the_session_id(repository, tmp_path):
+    client = _app(repository, tmp_path, 'memory').test_client()
+    with client.session_transaction() as sess:
+        sess['agreement_data'] = {'title': 'planted'}
+    planted = _cookie(client).value
+    with client.session_transaction() as sess:
+        sess['user_id'] = 'u1'
+    assert _cookie(client).value != planted
+    with client.session_transaction() as sess:
+        assert sess['agreement_data'] == {'title': 'planted'}
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match='SESSION_BACKEND'):
+        sessions.make_session_interface('redis', 60, 10, None)
@@ -0,0 +1,96 @@
+"""
+test_signatures.py
+
+Unit tests for the content-addressed signature blob store.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+# pylint: disable=too-few-public-methods
+
+import base64
+import hashlib
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import signatures
+
+RAW = b'\x89PNG\r\n\x1a\nsignature-bytes'
+DATA_URL = 'data:image/png;base64,' + base64.b64encode(RAW).decode()
+
+
+class ListCursor(list):
+    def batch_size(self, n):
+        return self
+
+
+class InlineCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return ListCursor(d for d in self.docs if isinstance(d.get('signature'), str))
+
+    def update_one(self, query, update):
+        for doc in self.docs:
+            if doc['_id'] == query['_id'] and doc.get('signature') == query['signature']:
+                doc.update(update['$set'])
+                for key in update['$unset']:
+                    doc.pop(key)
+
+
+def test_decode_data_url():
+    assert signatures.decode_data_url(DATA_URL) == ('image/png', RAW)
+
+
+@pytest.mark.parametrize('bad', [
+    None, '', 'sig', 'data:text/html;base64,PGI+', 'data:image/png;base64,@@@', 'data:image/png;base64,'
+])
+def test_decode_data_url_rejects(bad):
+    with pytest.raises(signatures.InvalidSignature):
+        signatures.decode_data_url(bad)
+
+
+def test_store_signature_is_content_addressed(tmp_path):
+    store = signatures.LocalBlobStore(str(tmp_path))
+    ref = signatures.store_signature(store, DATA_URL)
+    assert ref == {
+        'hash': hashlib.sha256(RAW).hexdigest(),
+        'content_type': 'image/png',
+        'size': len(RAW),
+    }
+    assert signatures.store_signature(store, DATA_URL) == ref
+    fileobj, length = store.open(ref['hash'])
+    assert length == len(RAW)
+    assert b''.join(signatures.iter_blob(fileobj)) == RAW
+    assert fileobj.closed
+    assert store.open('0' * 64) is None
+
+
+def test_is_signature_hash():
+    assert signatures.is_signature_hash('a' * 64)
+    assert not signatures.is_signature_hash('../etc/passwd')
+    assert not signatures.is_signature_hash(None)
+
+
+def test_store_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv('SIGNATURE_STORE', 'local')
+    monkeypatch.setenv('SIGNATURE_DIR', str(tmp_path))
+    store = signatures.store_from_env(db=None)
+    assert isinstance(store, signatures.LocalBlobStore)
+    assert store.root == str(tmp_path)
+
+
+def test_migrate_inline_signatures(tmp_path):
+    store = signatures.LocalBlobStore(str(tmp_path))
+    docs = [
+        {'_id': ObjectId(), 'signature': DATA_URL},
+        {'_id': ObjectId(), 'signature': 'sig'},
+        {'_id': ObjectId(), 'signature_ref': {'hash': 'x'}},
+    ]
+    coll = InlineCollection(docs)
+    assert signatures.migrate_inline_signatures(coll, store) == (1, 1)
+    assert 'signature' not in docs[0]
+    assert store.exists(docs[0]['signature_ref']['hash'])
+    # resumable: a second run only revisits what could not be moved
+    assert signatures.migrate_inline_signatures(coll, store) == (0, 1)
@@ -0,0 +1,143 @@
+"""
+test_strokes.py
+
+Unit tests for vector stroke signatures and their rasterisation.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+import base64
+import math
+import struct
+import zlib
+
+import pytest
+
+from api import strokes
+from api.app import create_app
+from api.benchmarks.memdb import MemoryRepository
+
+WAVE = [(int(150 + 100 * math.sin(i / 15)), int(75 + 40 * math.sin(i / 9))) for i in range(300)]
+
+
+def _field(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _png_pixels(png):
+    """(width, height, alpha rows) of a grey+alpha PNG written by to_png."""
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    pos, chunks = 8, {}
+    while pos < len(png):
+        length, = struct.unpack('>I', png[pos:pos + 4])
+        kind = png[pos + 4:pos + 8]
+        chunks[kind] = chunks.get(kind, b'') + png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    width, height = struct.unpack('>II', chunks[b'IHDR'][:8])
+    raw = zlib.decompress(chunks[b'IDAT'])
+    stride = 1 + 2 * width
+    return width, height, [raw[r * stride + 2:(r + 1) * stride:2] for r in range(height)]
+
+
+def test_round_trip_with_negative_deltas():
+    lines = [[(10, 10), (9, 12), (0, 0)], [(300, 150)]]
+    assert strokes.decode(strokes.encode(300, 150, lines)) == (300, 150, lines)
+
+
+def test_encoding_is_an_order_of_magnitude_smaller_than_png():
+    data = strokes.encode(300, 150, [WAVE])
+    # a 300x150 canvas PNG data URL is typically 10-15 KB
+    assert len(_field(data)) < 1200
+
+
+@pytest.mark.parametrize('field', [
+    'not base64!',
+    _field(strokes.encode(300, 150, [])),
+    _field(strokes.encode(300, 150, [[(10, 10)]])[:-1]),
+    _field(strokes.encode(300, 150, [[(10, 10)]]) + b'\x02'),
+    _field(strokes.encode(300, 150, [[(301, 10)]])),
+    _field(strokes.encode(5000, 150, [[(1, 1)]])),
+    _field(bytes([4]) + strokes.encode(300, 150, [[(1, 1)]])[1:]),
+])
+def test_parse_field_rejects_malformed_input(field):
+    with pytest.raises(strokes.InvalidSignature):
+        strokes.parse_field(field)
+
+
+def test_canvas_size_and_render_cost_are_bounded():
+    assert strokes.parse_field(_field(strokes.encode(300, 150, [WAVE])))
+    assert strokes.render_cost(300, 150, [WAVE], 10_000) < strokes.MAX_RENDER_PIXELS
+    with pytest.raises(strokes.InvalidSignature, match='out of range'):
+        strokes.parse_field(_field(strokes.encode(2000, 2000, [[(1, 1)]])))
+    # few points, but every segment spans the canvas diagonally
+    zigzag = [(0, 0), (300, 150)] * 10
+    assert strokes.render_cost(300, 150, [zigzag]) > strokes.MAX_RENDER_PIXELS
+    with pytest.raises(strokes.InvalidSignature, match='too complex'):
+        strokes.parse_field(_field(strokes.encode(300, 150, [zigzag])))
+    with pytest.raises(strokes.InvalidSignature):
+        strokes.to_png(strokes.encode(300, 150, [zigzag]), strokes.MAX_RENDER_WIDTH)
+
+
+def test_png_renders_at_requested_width():
+    data = strokes.encode(300, 150, [[(10, 75), (290, 75)]])
+    width, height, rows = _png_pixels(strokes.to_png(data, 600))
+    assert (width, height) == (600, 300)
+    assert rows[150][300] == 255
+    assert rows[10][300] == 0
+
+
+def test_svg_scales_through_viewbox():
+    svg = strokes.to_svg(strokes.encode(300, 150, [[(1, 2), (3, 4)], [(5, 6)]]), 150).decode()
+    assert 'width="150" height="75" viewBox="0 0 300 150"' in svg
+    assert 'd="M1 2L3 4M5 6l0 0"' in svg
+
+
+def test_render_cache_loads_once_and_evicts_by_size():
+    data = strokes.encode(300, 150, [WAVE])
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return data
+
+    # room for two renderings (the width attribute adds a couple of bytes)
+    cache = strokes.RenderCache(max_bytes=len(strokes.to_svg(data)) * 2 + 16)
+    for _ in range(3):
+        assert cache.render('h', loader, 'svg')[0] == 'image/svg+xml'
+    assert len(loads) == 1
+    # widths beyond the limit share one entry
+    cache.render('h', loader, 'svg', 5000)
+    cache.render('h', loader, 'svg', 9000)
+    assert len(loads) == 2
+    cache.render('other', loader, 'svg')
+    assert len(cache) == 2 and cache.size <= cache.max_bytes
+
+
+def test_stroke_signature_is_stored_and_rendered(tmp_path):
+    repository = MemoryRepository()
+    me = repository.users.insert_one({'username': 'alice'}).inserted_id
+    bob = repository.users.insert_one({'username': 'bob'}).inserted_id
+    client = create_app({
+        'TESTING': True, 'REPOSITORY': repository,
+        'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path),
+    }).test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(me)
+        sess['agreement_data'] = {'title': 't', 'party1': {'user_id': str(me), 'name': 'alice'},
+                                  'party2': {'user_id': str(bob), 'name': 'bob'}, 'content': {}}
+
+    field = _field(strokes.encode(300, 150, [WAVE]))
+    client.post('/agreements/new/signature', data={'signature_strokes': field})
+    ref = repository.agreements.find_one({})['signature_ref']
+    assert ref['content_type'] == strokes.CONTENT_TYPE and ref['size'] < 1000
+
+    png = client.get(f"/signatures/{ref['hash']}")
+    assert png.mimetype == 'image/png'
+    assert _png_pixels(png.data)[:2] == (300, 150)
+    svg = client.get(f"/signatures/{ref['hash']}?format=svg&w=600")
+    assert svg.mimetype == 'image/svg+xml' and b'width="600"' in svg.data
+    assert svg.headers['ETag'] == f'"{ref["hash"]}.svg.600"'
+    again = client.get(f"/signatures/{ref['hash']}?format=svg&w=600", headers={'If-None-Match': svg.headers['ETag']})
+    assert again.status_code == 304
+    assert client.get(f"/signatures/{ref['hash']}?format=gif").status_code == 404
+    assert client.get(f"/signatures/{'0' * 64}").status_code == 404
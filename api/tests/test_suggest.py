@@ -0,0 +1,112 @@
+"""
+test_suggest.py
+
+Unit tests for the username prefix index behind /users/suggest.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,redefined-outer-name
+
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import app, suggest
+from api.benchmarks.memdb import MemoryRepository
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingUsers:
+    def __init__(self, inner):
+        self.inner = inner
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return self.inner.find(query, projection)
+
+
+@pytest.fixture
+def repository():
+    repository = MemoryRepository()
+    for name in ('alice', 'Alicia', 'albert', 'bob', 'alina'):
+        repository.users.insert_one({'username': name, 'email': f'{name}@x.com', 'password_hash': 'h'})
+    return repository
+
+
+def test_prefix_matches_are_sorted_case_insensitive_and_bounded(repository):
+    index = suggest.UsernameIndex(lambda: repository.users)
+    assert index.suggest('AL') == ['albert', 'alice', 'Alicia', 'alina']
+    assert index.suggest('ali', limit=2) == ['alice', 'Alicia']
+    assert index.suggest('zz') == []
+    assert index.suggest('') == ['albert', 'alice', 'Alicia', 'alina', 'bob']
+
+
+def test_loads_once_then_catches_up_by_creation_time(repository):
+    users = CountingUsers(repository.users)
+    clock = Clock()
+    started = datetime(2026, 1, 1, 12)
+    index = suggest.UsernameIndex(lambda: users, refresh_seconds=60, clock=clock, utcnow=lambda: started)
+    index.suggest('al')
+    index.suggest('bo')
+    assert users.queries == [{}]
+
+    # registered through another worker
+    repository.users.insert_one({'username': 'alfred', 'created_at': started + timedelta(seconds=5)})
+    assert 'alfred' not in index.suggest('al')
+    clock.now = 61
+    assert 'alfred' in index.suggest('al')
+    assert users.queries[-1] == {'created_at': {'$gte': started - suggest.OVERLAP}}
+    assert len(index) == 6
+
+
+def test_add_indexes_new_users_without_a_query(repository):
+    users = CountingUsers(repository.users)
+    index = suggest.UsernameIndex(lambda: users)
+    index.refresh()
+    index.add('alvin')
+    index.add('alvin')
+    assert index.suggest('alv') == ['alvin']
+    assert len(users.queries) == 1
+
+
+def test_catch_up_does_not_depend_on_id_order(repository):
+    now = datetime(2026, 1, 1, 12)
+    index = suggest.UsernameIndex(lambda: repository.users, utcnow=lambda: now)
+    index.refresh()
+    # another node's user has the smaller id and a slightly skewed clock
+    elsewhere, here = ObjectId(), ObjectId()
+    repository.users.insert_one({'_id': here, 'username': 'alvin', 'created_at': now})
+    index.add('alvin')
+    index.refresh(force=True)
+    repository.users.insert_one({'_id': elsewhere, 'username': 'alma', 'created_at': now - timedelta(seconds=30)})
+    assert index.refresh(force=True) == 1
+    assert index.suggest('alm') == ['alma'] and index.suggest('alv') == ['alvin']
+
+
+def test_warm_up_loads_the_index_outside_requests(repository, tmp_path):
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository,
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+    app.warm_up(flask_app)
+    assert len(flask_app.extensions['username_index']) == 5
+
+
+def test_suggest_route(repository, tmp_path):
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository,
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+    client = flask_app.test_client()
+    assert client.get('/users/suggest?q=al').status_code == 302
+
+    client.post('/auth/register', data={'username': 'alma', 'email': 'alma@x.com', 'password': 'pw'})
+    body = client.get('/users/suggest?q=alm').get_json()
+    assert body == {'q': 'alm', 'users': ['alma']}
+    assert client.get('/users/suggest?q=a').get_json()['users'] == []
+    assert len(client.get('/users/suggest?q=al&limit=2').get_json()['users']) == 2
+    assert client.get('/users/suggest?q=al&limit=999').headers['Cache-Control'] == 'private, max-age=60'
@@ -0,0 +1,61 @@
+"""
+test_usercache.py
+
+Unit tests for the process-wide user cache.
+"""
+
+# pylint: disable=missing-function-docstring,missing-class-docstring,missing-module-docstring
+
+from api.usercache import UserCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_disabled_cache_never_stores():
+    cache = UserCache(ttl=0)
+    cache.set('a', {'username': 'a'})
+    assert cache.get('a') is None
+    assert cache.stats()['enabled'] is False
+
+
+def test_hit_miss_and_expiry():
+    clock = FakeClock()
+    cache = UserCache(ttl=10, clock=clock)
+    assert cache.get('a') is None
+    cache.set('a', {'username': 'a'})
+    assert cache.get('a') == {'username': 'a'}
+    clock.now = 10
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 0)
+    assert stats['hit_ratio'] == 1 / 3
+
+
+def test_lru_eviction():
+    cache = UserCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_invalidate_accepts_object_ids():
+    cache = UserCache(ttl=60)
+    cache.set('64b000000000000000000000', {'username': 'a'})
+
+    class Oid:
+        def __str__(self):
+            return '64b000000000000000000000'
+
+    cache.invalidate(Oid())
+    assert cache.get('64b000000000000000000000') is None
+    assert cache.stats()['invalidations'] == 1
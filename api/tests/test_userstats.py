@@ -0,0 +1,143 @@
+"""
+test_userstats.py
+
+Unit tests for the incrementally maintained per-user agreement counters.
+"""
+
+# pylint: disable=missing-function-docstring,missing-module-docstring,redefined-outer-name
+
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from api import app, fanout, responses, revisions, userstats
+from api.benchmarks.memdb import MemoryRepository
+
+
+@pytest.fixture
+def repository():
+    return MemoryRepository()
+
+
+def _agreement(repository, sender, recipient, status='pending'):
+    doc = {'title': 't', 'party1': {'user_id': sender, 'name': 's'},
+           'party2': {'user_id': recipient, 'name': 'r'}, 'response_status': status,
+           'created_at': datetime(2025, 1, 1)}
+    repository.agreements.insert_one(doc)
+    userstats.record(repository.collection(userstats.STATS_COLL), userstats.created(doc))
+    return doc
+
+
+def _recount(repository, user_id):
+    return userstats.count(repository.agreements, [user_id])[user_id]
+
+
+def test_changes_for_create_and_transition():
+    sender, recipient = ObjectId(), ObjectId()
+    agr = {'party1': {'user_id': sender}, 'party2': {'user_id': recipient}}
+    assert userstats.created(agr) == [(sender, 'sent', 'pending', 1), (recipient, 'received', 'pending', 1)]
+    assert userstats.transition(agr, 'pending', 'pending') == []
+    assert (sender, 'sent', 'pending', -1) in userstats.transition(agr, 'pending', 'agreed')
+
+
+def test_record_is_one_upsert_per_user(repository):
+    stats = repository.collection(userstats.STATS_COLL)
+    sender, recipient = ObjectId(), ObjectId()
+    agr = {'party1': {'user_id': sender}, 'party2': {'user_id': recipient}}
+    userstats.record(stats, userstats.created(agr) + userstats.created(agr))
+    userstats.record(stats, userstats.transition(agr, 'pending', 'rejected'))
+    assert stats.count_documents({}) == 2
+    assert userstats.get(stats, sender)['sent'] == {'pending': 1, 'agreed': 0, 'rejected': 1}
+    assert userstats.get(stats, recipient)['received'] == {'pending': 1, 'agreed': 0, 'rejected': 1}
+    assert userstats.get(stats, ObjectId()) == userstats.empty()
+
+
+def test_incremental_counters_match_a_full_recount(repository):
+    stats = repository.collection(userstats.STATS_COLL)
+    alice, bob, carol = ObjectId(), ObjectId(), ObjectId()
+    first = _agreement(repository, alice, bob)
+    _agreement(repository, alice, carol)
+    _agreement(repository, bob, alice)
+
+    results, _ = responses.respond_many(repository.agreements, bob, [str(first['_id'])], 'rejected',
+                                        stats_coll=stats)
+    assert results == {str(first['_id']): 'updated'}
+    revisions.revise(repository.agreements, repository.collection(revisions.REVISIONS_COLL), first['_id'],
+                     alice, 'again', {}, None, stats_coll=stats)
+    responses.respond_many(repository.agreements, bob, [str(first['_id'])], 'agreed', stats_coll=stats)
+
+    jobs = repository.collection(fanout.JOBS_COLL)
+    for name, uid in (('bob', bob), ('carol', carol)):
+        repository.users.insert_one({'_id': uid, 'username': name})
+    job_id = fanout.create_job(jobs, repository.users, alice, ['bob', 'carol'])
+    fanout.run_job(jobs, repository.agreements, jobs.find_one({'_id': job_id}),
+                   {'title': 'x', 'party1': {'user_id': alice, 'name': 'alice'}}, stats_coll=stats)
+
+    for user in (alice, bob, carol):
+        assert userstats.get(stats, user) == _recount(repository, user)
+    assert userstats.get(stats, alice)['sent'] == {'pending': 3, 'agreed': 1, 'rejected': 0}
+
+
+def test_lost_race_recounts_the_users_involved(repository):
+    stats = repository.collection(userstats.STATS_COLL)
+    alice, bob = ObjectId(), ObjectId()
+    agr = _agreement(repository, alice, bob)
+
+    class Racing:
+        """Answers the agreement between the ownership read and the write."""
+        def find(self, query, projection=None):
+            docs = list(repository.agreements.find(query, projection))
+            repository.agreements.update_one({'_id': agr['_id']}, {'$set': {'response_status': 'agreed'}})
+            return docs
+
+        def bulk_write(self, requests, ordered=True):
+            return repository.agreements.bulk_write(requests, ordered)
+
+        def aggregate(self, pipeline):
+            return repository.agreements.aggregate(pipeline)
+
+    _, modified = responses.respond_many(Racing(), bob, [str(agr['_id'])], 'rejected', stats_coll=stats)
+    assert modified == 0
+    # the status written by the racer is what the counters show
+    assert userstats.get(stats, bob)['received'] == {'pending': 0, 'agreed': 1, 'rejected': 0}
+
+
+def test_legacy_agreements_without_status_count_as_pending(repository):
+    alice, bob = ObjectId(), ObjectId()
+    repository.agreements.insert_one({'party1': {'user_id': alice}, 'party2': {'user_id': bob}})
+    assert _recount(repository, alice)['sent']['pending'] == 1
+
+
+def test_rebuild_repairs_drift_and_drops_orphans(repository):
+    stats = repository.collection(userstats.STATS_COLL)
+    alice, bob, gone = ObjectId(), ObjectId(), ObjectId()
+    _agreement(repository, alice, bob, status='agreed')
+    stats.update_one({'_id': alice}, {'$inc': {'sent.agreed': 5}})
+    stats.insert_one({'_id': gone, 'sent': {'pending': 1}, 'rebuilt_at': datetime(2020, 1, 1)})
+
+    assert userstats.rebuild(repository.agreements, stats) == 2
+    assert userstats.get(stats, alice)['sent']['agreed'] == 1
+    assert stats.find_one({'_id': gone}) is None
+
+    stats.update_one({'_id': bob}, {'$inc': {'received.agreed': 3}})
+    assert userstats.rebuild(repository.agreements, stats, [bob]) == 1
+    assert userstats.get(stats, bob)['received']['agreed'] == 1
+
+
+def test_rebuild_stats_command(repository, tmp_path):
+    flask_app = app.create_app({'TESTING': True, 'REPOSITORY': repository,
+                                'SIGNATURE_STORE': 'local', 'SIGNATURE_DIR': str(tmp_path)})
+    alice = repository.users.insert_one({'username': 'alice'}).inserted_id
+    repository.agreements.insert_one({'party1': {'user_id': alice}, 'party2': {'user_id': ObjectId()}})
+    runner = flask_app.test_cli_runner()
+
+    result = runner.invoke(args=['rebuild-stats', '--user', 'alice'])
+    assert 'rebuilt for 1 user(s)' in result.output
+    assert runner.invoke(args=['rebuild-stats', '--user', 'nobody']).exit_code != 0
+    assert 'rebuilt for 2 user(s)' in runner.invoke(args=['rebuild-stats']).output
+
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = str(alice)
+    assert client.get('/agreements/stats').get_json()['sent']['pending'] == 1
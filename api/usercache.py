@@ -0,0 +1,103 @@
+"""
+usercache.py
+
+Process-wide TTL/LRU cache for user documents looked up by current_user().
+
+current_user() memoizes on flask.g for the lifetime of a request; this cache
+additionally spans requests when USER_CACHE_TTL > 0. Entries are dropped on
+expiry, on LRU eviction, or explicitly through invalidate() whenever a user
+document changes. Counters are kept so the cache can be sized; they are
+exported on /metrics by export_metrics().
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize=1024, ttl=0.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.request_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, user_id):
+        """Return the cached user, or None on a miss or expired entry."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, user):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = (self.clock() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Drop one user, e.g. after their document was updated."""
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def record_request_hit(self):
+        """Count a lookup answered by the per-request flask.g memo."""
+        with self._lock:
+            self.request_hits += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "request_hits": self.request_hits,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def export_metrics(self, registry):
+        """Copy the counters into a metrics Registry (see Metrics.collect)."""
+        stats = self.stats()
+        lookups = registry.counter("user_cache_lookups_total", "current_user() lookups by outcome.", ("result",))
+        for result in ("hits", "misses", "request_hits"):
+            lookups.set((result,), stats[result])
+        registry.counter("user_cache_evictions_total", "Users evicted from the cache.", ()).set(
+            (), stats["evictions"])
+        registry.counter("user_cache_invalidations_total", "Users invalidated after a write.", ()).set(
+            (), stats["invalidations"])
+        registry.gauge("user_cache_entries", "Users currently cached.", ()).set((), stats["size"])
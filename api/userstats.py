@@ -0,0 +1,136 @@
+"""
+userstats.py
+
+Per-user agreement counters, maintained incrementally.
+
+One user_stats document per user holds how many agreements they sent and
+received in each status:
+
+    {"_id": user_id, "sent": {"pending": 3, "agreed": 12, "rejected": 1},
+     "received": {...}}
+
+Every write that creates an agreement or changes its status turns into a
+list of (user_id, role, status, delta) changes and record() applies them as
+one unordered bulk of $inc upserts right after the agreement write. Status
+updates are conditional on the status they replace, so a lost race changes
+neither the agreement nor the counters. rebuild() recomputes the documents
+from the agreements, archived ones included, with one $group per role; it
+backs migration 8 and the `flask rebuild-stats` repair command.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from pymongo import ReplaceOne, UpdateOne
+
+from archive import ARCHIVE_COLL
+
+STATS_COLL = "user_stats"
+REBUILD_BATCH = 1000
+
+ROLES = ("sent", "received")
+STATUSES = ("pending", "agreed", "rejected")
+
+# the party field that makes a user the sender or the recipient
+_PARTY = {"sent": "party1", "received": "party2"}
+
+
+def status_of(agr):
+    """Legacy agreements without a response_status count as pending."""
+    return agr.get("response_status") or "pending"
+
+
+def created(agr):
+    """Changes for a newly inserted agreement."""
+    status = status_of(agr)
+    return [(agr[_PARTY[role]]["user_id"], role, status, 1) for role in ROLES]
+
+
+def transition(agr, old, new):
+    """Changes for an agreement moving from status old to new."""
+    if old == new:
+        return []
+    return [
+        change
+        for role in ROLES
+        for change in ((agr[_PARTY[role]]["user_id"], role, old, -1),
+                       (agr[_PARTY[role]]["user_id"], role, new, 1))
+    ]
+
+
+def record(stats_coll, changes):
+    """Apply changes as one $inc upsert per affected user."""
+    incs = defaultdict(Counter)
+    for user_id, role, status, delta in changes:
+        incs[user_id][f"{role}.{status}"] += delta
+    ops = [
+        UpdateOne({"_id": user_id}, {"$inc": {k: v for k, v in inc.items() if v}}, upsert=True)
+        for user_id, inc in incs.items()
+        if any(inc.values())
+    ]
+    if ops:
+        stats_coll.bulk_write(ops, ordered=False)
+
+
+def empty():
+    return {role: dict.fromkeys(STATUSES, 0) for role in ROLES}
+
+
+def get(stats_coll, user_id):
+    """The user's counters; zeros for a user with no agreements yet."""
+    counts = empty()
+    doc = stats_coll.find_one({"_id": user_id}) or {}
+    for role in ROLES:
+        for status in STATUSES:
+            counts[role][status] = (doc.get(role) or {}).get(status, 0)
+    return counts
+
+
+def count(agreements_coll, user_ids=None):
+    """{user_id: counters} recomputed from agreements (all users, or user_ids)."""
+    counts = defaultdict(empty)
+    for role in ROLES:
+        user_field = f"{_PARTY[role]}.user_id"
+        pipeline = [
+            {"$group": {
+                "_id": {"user": f"${user_field}",
+                        "status": {"$ifNull": ["$response_status", "pending"]}},
+                "n": {"$sum": 1},
+            }},
+        ]
+        archived = []
+        if user_ids is not None:
+            # served by the party{1,2}_user_created_at_id indexes
+            match = {"$match": {user_field: {"$in": list(user_ids)}}}
+            pipeline.insert(0, match)
+            archived.append(match)
+        # archived agreements still count towards a user's totals
+        pipeline.insert(len(archived), {"$unionWith": {"coll": ARCHIVE_COLL, "pipeline": archived}})
+        for row in agreements_coll.aggregate(pipeline):
+            if row["_id"]["status"] in STATUSES:
+                counts[row["_id"]["user"]][role][row["_id"]["status"]] = row["n"]
+    for user_id in user_ids or ():
+        counts.setdefault(user_id, empty())
+    return counts
+
+
+def rebuild(agreements_coll, stats_coll, user_ids=None, now=None):
+    """
+    Overwrite counters with values recomputed from agreements.
+
+    Returns the number of users written. Writes racing the recount can leave
+    a counter off by the racing change; run it again (or per user) if the
+    system was busy.
+    """
+    now = now or datetime.utcnow()
+    counts = count(agreements_coll, user_ids)
+    ops = [
+        ReplaceOne({"_id": user_id}, dict(values, rebuilt_at=now), upsert=True)
+        for user_id, values in counts.items()
+    ]
+    for start in range(0, len(ops), REBUILD_BATCH):
+        stats_coll.bulk_write(ops[start:start + REBUILD_BATCH], ordered=False)
+    if user_ids is None:
+        # users whose last agreement disappeared keep no stale counters
+        stats_coll.delete_many({"rebuilt_at": {"$lt": now}})
+    return len(ops)